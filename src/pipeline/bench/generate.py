@@ -0,0 +1,113 @@
+import os
+import duckdb
+from pipeline.utils import setup_logger
+
+# Set up logging
+logger = setup_logger(__name__)
+
+# Size of the synthetic datasets at scale factor 1. Rows grow linearly with the scale factor:
+# WDI gets more indicators, the UIS datasets more indicators per country.
+BASE_COUNTRIES = 200
+BASE_WDI_INDICATORS = 200
+BASE_UIS_INDICATORS = 40
+WDI_YEARS = range(1960, 2024)
+UIS_YEARS = range(1970, 2024)
+UIS_DATASETS = ('OPRI', 'SDG')
+NULL_SHARE = 4  # Out of 10 values left empty, as in the real WDI extract
+
+def _copy_csv(con, query: str, path: str) -> None:
+    """Write the result of a query to a CSV file with a header row."""
+    con.sql(f"COPY ({query}) TO '{path}' (FORMAT CSV, HEADER true)")
+    logger.info(f"Generated {path} ({os.path.getsize(path) / 1024 ** 2:.1f} MB)")
+
+def generate_wdi(con, raw_dir: str, scale: int) -> None:
+    """
+    Generate WDI-shaped files: a wide WDICSV.csv with one column per year, and its WDISeries.csv labels.
+
+    :param con: DuckDB connection used to generate the files.
+    :param raw_dir: Raw data directory (files are written to its wdi/ subfolder).
+    :param scale: Scale factor.
+    """
+    out_dir = os.path.join(raw_dir, 'wdi')
+    os.makedirs(out_dir, exist_ok=True)
+    indicators = BASE_WDI_INDICATORS * scale
+
+    # Values are a hash of (country, indicator, year), so every run generates the same files
+    years = ",\n".join(
+        f"CASE WHEN hash(c, i, {year}) % 10 < {NULL_SHARE} THEN NULL "
+        f"ELSE round((hash(c, i, {year}) % 1000000) / 100.0, 2) END AS \"{year}\""
+        for year in WDI_YEARS
+    )
+    _copy_csv(con, f"""
+        SELECT
+            'Country ' || c AS "Country Name",
+            'C' || lpad(c::VARCHAR, 3, '0') AS "Country Code",
+            'Indicator ' || i AS "Indicator Name",
+            'IND.' || lpad(i::VARCHAR, 6, '0') AS "Indicator Code",
+            {years}
+        FROM range({BASE_COUNTRIES}) AS countries(c), range({indicators}) AS indicators(i)
+        ORDER BY c, i
+    """, os.path.join(out_dir, 'WDICSV.csv'))
+
+    _copy_csv(con, f"""
+        SELECT
+            'IND.' || lpad(i::VARCHAR, 6, '0') AS "Series Code",
+            'Topic ' || (i % 20) AS "Topic",
+            'Indicator ' || i AS "Indicator Name",
+            'Short definition of indicator ' || i AS "Short definition",
+            repeat('Long definition of indicator ' || i || '. ', 8) AS "Long definition",
+            'Source ' || (i % 7) AS "Source"
+        FROM range({indicators}) AS indicators(i)
+    """, os.path.join(out_dir, 'WDISeries.csv'))
+
+def generate_uis(con, raw_dir: str, scale: int) -> None:
+    """
+    Generate UIS-shaped files for each dataset: a long <dataset>_DATA_NATIONAL.csv and its <dataset>_LABEL.csv.
+
+    :param con: DuckDB connection used to generate the files.
+    :param raw_dir: Raw data directory (files are written to its edu/ subfolder).
+    :param scale: Scale factor.
+    """
+    out_dir = os.path.join(raw_dir, 'edu')
+    os.makedirs(out_dir, exist_ok=True)
+    indicators = BASE_UIS_INDICATORS * scale
+
+    for dataset in UIS_DATASETS:
+        _copy_csv(con, f"""
+            SELECT
+                '{dataset}.' || i AS INDICATOR_ID,
+                'C' || lpad(c::VARCHAR, 3, '0') AS COUNTRY_ID,
+                y AS YEAR,
+                round((hash(c, i, y, '{dataset}') % 1000000) / 100.0, 2) AS VALUE,
+                CASE WHEN hash(c, i, y) % 5 = 0 THEN 'NA' END AS MAGNITUDE,
+                CASE WHEN hash(c, i, y) % 7 = 0 THEN 'UIS_EST' END AS QUALIFIER
+            FROM range({BASE_COUNTRIES}) AS countries(c), range({indicators}) AS indicators(i),
+                 range({UIS_YEARS.start}, {UIS_YEARS.stop}) AS years(y)
+            WHERE hash(c, i, y) % 10 >= {NULL_SHARE}
+            ORDER BY i, c, y
+        """, os.path.join(out_dir, f'{dataset}_DATA_NATIONAL.csv'))
+
+        _copy_csv(con, f"""
+            SELECT '{dataset}.' || i AS INDICATOR_ID, 'Label of {dataset} indicator ' || i AS INDICATOR_LABEL_EN
+            FROM range({indicators}) AS indicators(i)
+        """, os.path.join(out_dir, f'{dataset}_LABEL.csv'))
+
+def generate(raw_dir: str, scale: int = 1) -> None:
+    """
+    Generate a synthetic raw data directory with the same layout and shapes as datalake/raw.
+
+    :param raw_dir: Directory to write the raw CSV files to.
+    :param scale: Scale factor (1 generates about 30 MB of CSV, 10 and 100 ten and a hundred times as much).
+    """
+    try:
+        logger.info(f"Generating synthetic raw data at scale {scale}x in {raw_dir}")
+        con = duckdb.connect()
+        try:
+            generate_wdi(con, raw_dir, scale)
+            generate_uis(con, raw_dir, scale)
+        finally:
+            con.close()
+
+    except Exception as e:
+        logger.error(f"Error generating synthetic raw data: {e}", exc_info=True)
+        raise
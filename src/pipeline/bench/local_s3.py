@@ -0,0 +1,202 @@
+import io
+import os
+import shutil
+import hashlib
+import threading
+import datetime
+import contextlib
+import jmespath
+from fsspec.implementations.dirfs import DirFileSystem
+from fsspec.implementations.local import LocalFileSystem
+from s3transfer.manager import TransferManager
+from botocore.exceptions import ClientError
+from pipeline.utils import setup_logger, set_s3
+
+# Set up logging
+logger = setup_logger(__name__)
+
+# Objects per page of the stand-in's listings (S3 returns up to 1000)
+PAGE_SIZE = 1000
+
+# Serializes the conditional writes of the stand-in's clients
+PUT_LOCK = threading.Lock()
+
+def client_error(code: str, message: str, operation: str = 'S3') -> ClientError:
+    """The botocore error S3 answers with, e.g. 'NoSuchKey' or 'PreconditionFailed'."""
+    return ClientError({'Error': {'Code': code, 'Message': message}}, operation)
+
+class LocalS3FileSystem(DirFileSystem):
+    """
+    fsspec filesystem serving s3://<bucket>/<key> paths from <root>/<bucket>/<key> on the local disk.
+
+    Registered with DuckDB, it replaces the httpfs S3 client for reads and writes of s3:// paths.
+    """
+    protocol = ('s3', 's3a')
+
+    def __init__(self, root: str, **kwargs) -> None:
+        os.makedirs(root, exist_ok=True)
+        super().__init__(path=root, fs=LocalFileSystem(auto_mkdir=True), **kwargs)
+
+    def _join(self, path):
+        if isinstance(path, str):
+            path = path.split('://', 1)[-1]
+        return super()._join(path)
+
+class LocalPageIterator(list):
+    """List of `list_objects_v2` pages, supporting the JMESPath `search` of boto3 page iterators."""
+
+    def search(self, expression: str):
+        for page in self:
+            yield from jmespath.search(expression, page) or []
+
+class LocalS3Client:
+    """
+    Stand-in for the boto3 S3 client calls made by the pipeline, backed by <root>/<bucket>/<key> on the local disk.
+
+    ETags are the MD5 of the object's content, as for objects uploaded in a single part.
+    """
+
+    def __init__(self, root: str) -> None:
+        self.root = root
+
+    def _path(self, bucket: str, key: str) -> str:
+        return os.path.join(self.root, bucket, key)
+
+    def _object(self, bucket: str, key: str, missing_code: str = 'NoSuchKey') -> dict:
+        path = self._path(bucket, key)
+        if not os.path.isfile(path):
+            raise client_error(missing_code, f"s3://{bucket}/{key} does not exist")
+        with open(path, 'rb') as f:
+            etag = hashlib.md5(f.read()).hexdigest()
+        stat = os.stat(path)
+        return {
+            'Key': key,
+            'Size': stat.st_size,
+            'ETag': f'"{etag}"',
+            'LastModified': datetime.datetime.fromtimestamp(stat.st_mtime, datetime.timezone.utc),
+        }
+
+    def _keys(self, bucket: str, prefix: str = '', start_after: str = None) -> list:
+        base = os.path.join(self.root, bucket)
+        keys = []
+        for subdir, _, files in os.walk(base):
+            for file_name in files:
+                key = os.path.relpath(os.path.join(subdir, file_name), base).replace(os.sep, '/')
+                if key.startswith(prefix) and (start_after is None or key > start_after):
+                    keys.append(key)
+        return sorted(keys)
+
+    def list_objects_v2(self, Bucket, Prefix='', StartAfter=None, ContinuationToken=None, MaxKeys=PAGE_SIZE, **kwargs):
+        keys = self._keys(Bucket, Prefix, ContinuationToken or StartAfter)
+        response = {'KeyCount': min(len(keys), MaxKeys), 'IsTruncated': len(keys) > MaxKeys}
+        if keys:
+            response['Contents'] = [self._object(Bucket, key) for key in keys[:MaxKeys]]
+        if response['IsTruncated']:
+            response['NextContinuationToken'] = keys[MaxKeys - 1]
+        return response
+
+    def get_paginator(self, operation_name: str):
+        if operation_name != 'list_objects_v2':
+            raise NotImplementedError(f"Paginator '{operation_name}' is not supported by the local S3 stand-in")
+        return self
+
+    def paginate(self, PaginationConfig=None, **kwargs):
+        pages = LocalPageIterator()
+        token = None
+        while True:
+            page = self.list_objects_v2(ContinuationToken=token, **kwargs)
+            pages.append(page)
+            if not page['IsTruncated']:
+                return pages
+            token = page['NextContinuationToken']
+
+    def head_object(self, Bucket, Key, **kwargs):
+        obj = self._object(Bucket, Key, missing_code='404')
+        return {'ETag': obj['ETag'], 'ContentLength': obj['Size'], 'LastModified': obj['LastModified']}
+
+    def get_object(self, Bucket, Key, Range=None, IfMatch=None, **kwargs):
+        obj = self._object(Bucket, Key)
+        obj = {'ETag': obj['ETag'], 'ContentLength': obj['Size'], 'LastModified': obj['LastModified']}
+        if IfMatch is not None and IfMatch.strip('"') != obj['ETag'].strip('"'):
+            raise client_error('PreconditionFailed', f"s3://{Bucket}/{Key} does not match ETag {IfMatch}")
+        with open(self._path(Bucket, Key), 'rb') as f:
+            if Range is None:
+                return {**obj, 'Body': io.BytesIO(f.read())}
+            start, end = (int(bound) for bound in Range.removeprefix('bytes=').split('-'))
+            f.seek(start)
+            return {**obj, 'ContentLength': end - start + 1, 'Body': io.BytesIO(f.read(end - start + 1))}
+
+    def put_object(self, Bucket, Key, Body, IfMatch=None, IfNoneMatch=None, **kwargs):
+        path = self._path(Bucket, Key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Conditional writes are checked and applied under a lock, as S3 applies them atomically
+        with PUT_LOCK:
+            exists = os.path.isfile(path)
+            if IfNoneMatch == '*' and exists:
+                raise client_error('PreconditionFailed', f"s3://{Bucket}/{Key} already exists")
+            if IfMatch is not None and (not exists or IfMatch.strip('"') != self._object(Bucket, Key)['ETag'].strip('"')):
+                raise client_error('PreconditionFailed', f"s3://{Bucket}/{Key} does not match ETag {IfMatch}")
+            with open(path, 'wb') as f:
+                if hasattr(Body, 'read'):
+                    shutil.copyfileobj(Body, f)
+                else:
+                    f.write(Body.encode('utf-8') if isinstance(Body, str) else Body)
+        return {'ETag': self._object(Bucket, Key)['ETag']}
+
+    def delete_object(self, Bucket, Key, **kwargs):
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(self._path(Bucket, Key))
+
+    def delete_objects(self, Bucket, Delete, **kwargs):
+        for obj in Delete['Objects']:
+            self.delete_object(Bucket, obj['Key'])
+        return {'Deleted': Delete['Objects']}
+
+    def copy_object(self, Bucket, Key, CopySource, **kwargs):
+        path = self._path(Bucket, Key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        shutil.copyfile(self._path(CopySource['Bucket'], CopySource['Key']), path)
+
+    def download_file(self, Bucket, Key, Filename, ExtraArgs=None, **kwargs):
+        # s3transfer only accepts these arguments, and raises before any request for the others (e.g. IfMatch)
+        invalid = set(ExtraArgs or {}) - set(TransferManager.ALLOWED_DOWNLOAD_ARGS)
+        if invalid:
+            raise ValueError(f"Invalid extra_args key '{sorted(invalid)[0]}', must be one of: {', '.join(TransferManager.ALLOWED_DOWNLOAD_ARGS)}")
+        shutil.copyfile(self._path(Bucket, Key), Filename)
+
+    def upload_file(self, Filename, Bucket, Key, **kwargs):
+        path = self._path(Bucket, Key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        shutil.copyfile(Filename, path)
+
+class LocalS3Session:
+    """Stand-in for the boto3 session returned by `s3_init(return_session=True)`."""
+    region_name = 'local'
+
+@contextlib.contextmanager
+def local_s3(root: str):
+    """
+    Point the pipeline's S3 access at a local directory for the duration of the context.
+
+    The shared S3 client is a LocalS3Client, the shared fsspec filesystem a LocalS3FileSystem, and the
+    ingest registers that filesystem with DuckDB instead of creating an S3 secret. Nothing is sent to AWS.
+
+    :param root: Directory holding one subfolder per bucket.
+    """
+    from pipeline.ingest.run import Ingest
+
+    client = LocalS3Client(root)
+
+    def setup_s3_secret(self, con=None):
+        (con or self.con).register_filesystem(LocalS3FileSystem(root))
+
+    previous = set_s3(client=client, session=LocalS3Session(), filesystem=LocalS3FileSystem(root))
+    setup_s3_secret_original = Ingest.setup_s3_secret
+    Ingest.setup_s3_secret = setup_s3_secret
+    try:
+        logger.info(f"Using the local S3 stand-in in {root}")
+        yield client
+
+    finally:
+        Ingest.setup_s3_secret = setup_s3_secret_original
+        set_s3(**previous)
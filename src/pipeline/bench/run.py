@@ -0,0 +1,235 @@
+import os
+import sys
+import json
+import shutil
+import argparse
+import platform
+import tempfile
+import datetime
+from pipeline.bench.generate import generate
+from pipeline.bench.startup import measure_startup
+from pipeline.utils import setup_logger
+
+# Set up logging
+logger = setup_logger(__name__)
+
+# Default working directory: generated raw data, the local S3 stand-in and the staging outputs
+BENCH_DIR = os.getenv('BENCH_DIR', os.path.join(tempfile.gettempdir(), 'osaa-bench'))
+# Default baseline file, holding the results of a reference run for each scale factor (committed with the benchmark)
+BENCH_BASELINE_PATH = os.getenv('BENCH_BASELINE_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json'))
+# Relative increase of a stage's wall time or peak memory over the baseline reported as a regression
+BENCH_TOLERANCE = float(os.getenv('BENCH_TOLERANCE', 0.25))
+# Metrics compared against the baseline (bytes read and written are reported but vary with caching)
+COMPARED_METRICS = ('seconds', 'peak_rss_mb')
+
+# Marker file recording the scale of the generated raw data (hidden files are not ingested)
+SCALE_MARKER = '.bench_scale'
+
+def prepare_workdir(workdir: str, scale: int) -> None:
+    """
+    Reset the benchmark working directory, generating the raw data unless it already exists at this scale.
+
+    :param workdir: The benchmark working directory.
+    :param scale: Scale factor of the raw data.
+    """
+    raw_dir = os.path.join(workdir, 'datalake', 'raw')
+    marker = os.path.join(raw_dir, SCALE_MARKER)
+    if not (os.path.isfile(marker) and open(marker).read() == str(scale)):
+        shutil.rmtree(raw_dir, ignore_errors=True)
+        generate(raw_dir, scale)
+        with open(marker, 'w') as f:
+            f.write(str(scale))
+    else:
+        logger.info(f"Reusing the raw data generated at scale {scale}x in {raw_dir}")
+
+    # Every run starts from an empty landing area and staging area, laid out as in datalake/
+    for path in os.listdir(os.path.join(workdir, 'datalake')):
+        if path != 'raw':
+            shutil.rmtree(os.path.join(workdir, 'datalake', path), ignore_errors=True)
+    shutil.rmtree(os.path.join(workdir, 's3'), ignore_errors=True)
+    os.makedirs(os.path.join(workdir, 'datalake', 'staging', 'master'))
+
+def run_stages(workdir: str, pipelined: bool = False) -> dict:
+    """
+    Run the pipeline stages against the local S3 stand-in and measure each of them.
+
+    The stages are the full ingest (`Ingest.convert_and_upload_files`), the extract (`DataLoader.load_data`),
+    the transform (`DataTransformer.create_master_table`) and the load (`ETL.load`). Their metrics are
+    taken from the run reports of the ingest and the ETL, which are kept in the working directory.
+    With `pipelined`, the ingest and ETL run as one `PipelinedRun` instead, whose 'pipelined' stage
+    measures the whole run; the ingest and transform stages then overlap.
+
+    :param workdir: The benchmark working directory.
+    :param pipelined: Whether to run the ingest and ETL as one pipeline.
+    :return: Metrics of each stage, as recorded in the run reports.
+    """
+    # The pipeline reads its paths from the configuration when it is first imported
+    import pipeline.config as config
+    from pipeline.utils import ibis_connect
+    from pipeline.bench.local_s3 import local_s3
+    from pipeline.ingest.run import Ingest
+    from pipeline.etl.run import ETL
+
+    if config.DATALAKE_DIR != os.path.join(workdir, 'datalake'):
+        raise RuntimeError("The pipeline configuration was imported before the benchmark set DATALAKE_DIR")
+
+    if pipelined:
+        from pipeline.pipelined import PipelinedRun
+
+        with local_s3(os.path.join(workdir, 's3')):
+            run = PipelinedRun()
+            run.ingest.report.enabled = run.etl.report.enabled = True
+            run.run(incremental=False)
+        records = run.ingest.report.to_dict()['stages'] + run.etl.report.to_dict()['stages']
+        return {
+            record['stage']: {key: value for key, value in record.items() if key not in ('stage', 'source', 'status')}
+            for record in records
+        }
+
+    with local_s3(os.path.join(workdir, 's3')):
+        ingest = Ingest()
+        ingest.report.enabled = True
+        try:
+            ingest.setup_s3_secret()
+            results = ingest.convert_and_upload_files(incremental=False)
+            failed = [path for path, outcome in results.items() if outcome["status"] == "error"]
+            if failed:
+                raise RuntimeError(f"{len(failed)} of {len(results)} files failed to ingest")
+        finally:
+            ingest.report.save(upload=False)
+            for con in ingest.connections.values():
+                if con is not ingest.con:
+                    con.close()
+            ingest.con.close()
+
+        etl = ETL(ibis_connect(':memory:'))
+        etl.report.enabled = True
+        try:
+            etl.extract()
+            master = etl.transform()
+            etl.load(master)
+        finally:
+            etl.report.save(upload=False)
+            etl.con.disconnect()
+
+    records = ingest.report.to_dict()['stages'] + etl.report.to_dict()['stages']
+    return {
+        record['stage']: {key: value for key, value in record.items() if key not in ('stage', 'source', 'status')}
+        for record in records
+    }
+
+def compare(results: dict, baseline: dict, tolerance: float = BENCH_TOLERANCE) -> list:
+    """
+    Compare the metrics of a run to its baseline and log the difference of each stage.
+
+    :param results: Results of the run, as returned by `run_benchmark`.
+    :param baseline: Results of the baseline run at the same scale.
+    :param tolerance: Relative increase over the baseline reported as a regression (e.g. 0.25 for 25%).
+    :return: Descriptions of the regressions found.
+    """
+    regressions = []
+    for stage, metrics in results['stages'].items():
+        reference = baseline['stages'].get(stage)
+        if reference is None:
+            logger.warning(f"Stage '{stage}' has no baseline")
+            continue
+
+        if metrics.get('eager_imports') and not reference.get('eager_imports'):
+            message = f"{stage}.eager_imports: {metrics['eager_imports']}"
+            regressions.append(message)
+            logger.warning(f"Regression {message}")
+
+        for metric in COMPARED_METRICS:
+            current, previous = metrics.get(metric), reference.get(metric)
+            if current is None or not previous:
+                continue
+            change = current / previous - 1
+            message = f"{stage}.{metric}: {previous} -> {current} ({change:+.0%})"
+            if change > tolerance:
+                regressions.append(message)
+                logger.warning(f"Regression {message}")
+            else:
+                logger.info(message)
+
+    return regressions
+
+def run_benchmark(scale: int = 1, workdir: str = BENCH_DIR, profile: str = None, pipelined: bool = False) -> dict:
+    """
+    Generate the synthetic data at a scale factor and benchmark the pipeline on it, after timing the startup of its entry points.
+
+    Must run before the pipeline configuration is imported, as the pipeline's data directories are
+    pointed at the working directory through the DATALAKE_DIR environment variable.
+
+    :param scale: Scale factor of the synthetic data (e.g. 1, 10 or 100).
+    :param workdir: The benchmark working directory.
+    :param profile: DuckDB runtime profile of the pipeline's connections (defaults to DUCKDB_PROFILE).
+    :param pipelined: Whether to run the ingest and ETL as one pipeline (see `run_stages`).
+    :return: Dictionary with the scale, environment and per-stage metrics of the run.
+    """
+    import duckdb
+
+    workdir = os.path.abspath(workdir)
+    os.environ['DATALAKE_DIR'] = os.path.join(workdir, 'datalake')
+    if profile:
+        os.environ['DUCKDB_PROFILE'] = profile
+    os.makedirs(os.environ['DATALAKE_DIR'], exist_ok=True)
+
+    prepare_workdir(workdir, scale)
+    stages = {**measure_startup(), **run_stages(workdir, pipelined)}
+
+    return {
+        'scale': scale,
+        'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'duckdb': duckdb.__version__,
+        'cpus': os.cpu_count(),
+        'duckdb_profile': os.getenv('DUCKDB_PROFILE', 'default'),
+        'pipelined': pipelined,
+        'stages': stages,
+    }
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the ingest and ETL on synthetic data against a local S3 stand-in.")
+    parser.add_argument('--scale', type=int, default=1, help="Scale factor of the synthetic data (e.g. 1, 10, 100)")
+    parser.add_argument('--workdir', default=BENCH_DIR, help="Working directory for the generated data and outputs")
+    parser.add_argument('--baseline', default=BENCH_BASELINE_PATH, help="Baseline file to compare the results to")
+    parser.add_argument('--tolerance', type=float, default=BENCH_TOLERANCE, help="Relative increase reported as a regression")
+    parser.add_argument('--profile', help="DuckDB runtime profile of the pipeline (a key of config.DUCKDB_PROFILES)")
+    parser.add_argument('--pipelined', action='store_true', help="Run the ingest and ETL as one pipeline")
+    parser.add_argument('--output', help="File to write the results of the run to")
+    parser.add_argument('--save-baseline', action='store_true', help="Store the results as the baseline of this scale")
+    parser.add_argument('--check', action='store_true', help="Exit with an error if a stage regressed")
+    args = parser.parse_args(argv)
+
+    results = run_benchmark(args.scale, args.workdir, args.profile, args.pipelined)
+    logger.info(f"Benchmark results: {json.dumps(results, indent=2)}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    baselines = {}
+    if os.path.isfile(args.baseline):
+        with open(args.baseline) as f:
+            baselines = json.load(f)
+
+    regressions = []
+    if str(args.scale) in baselines:
+        regressions = compare(results, baselines[str(args.scale)], args.tolerance)
+    else:
+        logger.info(f"No baseline at scale {args.scale}x in {args.baseline}")
+
+    if args.save_baseline:
+        baselines[str(args.scale)] = results
+        os.makedirs(os.path.dirname(os.path.abspath(args.baseline)), exist_ok=True)
+        with open(args.baseline, 'w') as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+        logger.info(f"Saved the results as the {args.scale}x baseline in {args.baseline}")
+
+    if regressions and args.check:
+        logger.error(f"{len(regressions)} regressions over the baseline: {regressions}")
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,57 @@
+import os
+import sys
+import json
+import statistics
+import subprocess
+import pipeline
+from pipeline.utils import setup_logger
+
+# Set up logging
+logger = setup_logger(__name__)
+
+# Pipeline entry points whose import time is measured, by stage name
+ENTRY_POINTS = {
+    'startup_ingest': 'pipeline.ingest.run',
+    'startup_etl': 'pipeline.etl.run',
+}
+# Modules that must only be imported on first use, not when an entry point is imported
+DEFERRED_MODULES = ('boto3', 'botocore', 'fsspec', 's3fs')
+STARTUP_RUNS = 5
+
+def measure_import(module: str, runs: int = STARTUP_RUNS) -> dict:
+    """
+    Measure the time to import a module in a fresh interpreter, and which deferred modules it imports eagerly.
+
+    :param module: Name of the module to import.
+    :param runs: Number of fresh interpreters to time; the median is reported.
+    :return: Dictionary with the median import 'seconds' and the 'eager_imports' found.
+    """
+    script = (
+        "import sys, time, json; start = time.perf_counter(); "
+        f"import {module}; seconds = time.perf_counter() - start; "
+        f"print(json.dumps({{'seconds': seconds, 'eager_imports': [m for m in {list(DEFERRED_MODULES)} if m in sys.modules]}}))"
+    )
+    env = {**os.environ, 'PYTHONPATH': os.path.dirname(os.path.dirname(pipeline.__file__))}
+
+    samples = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, '-c', script], env=env, check=True, capture_output=True, text=True).stdout
+        samples.append(json.loads(output.strip().splitlines()[-1]))
+
+    result = {
+        'seconds': round(statistics.median(sample['seconds'] for sample in samples), 3),
+        'eager_imports': samples[-1]['eager_imports'],
+    }
+    if result['eager_imports']:
+        logger.warning(f"Importing {module} eagerly imports {result['eager_imports']}")
+    logger.info(f"Import of {module}: {result}")
+    return result
+
+def measure_startup(runs: int = STARTUP_RUNS) -> dict:
+    """
+    Measure the import time of every pipeline entry point.
+
+    :param runs: Number of fresh interpreters to time per entry point.
+    :return: Metrics of each entry point, by stage name (e.g. 'startup_etl').
+    """
+    return {stage: measure_import(module, runs) for stage, module in ENTRY_POINTS.items()}
@@ -1,18 +1,193 @@
+import os
+import glob
+import shutil
 import ibis
-from pipeline.utils import setup_logger
+import duckdb
+from pipeline.utils import setup_logger, s3_init, delete_s3_prefix
+from pipeline.config import (
+    MASTER_PARTITION_BY, MASTER_SORT_BY, MASTER_YEAR_BUCKET, MASTER_ROW_GROUP_SIZE,
+    MASTER_DB_MODE, MASTER_PRIMARY_KEY, MASTER_DB_INDEXES, MASTER_VALUE_TYPE
+)
 
 # Set up logging
 logger = setup_logger(__name__)
 
-def save_s3(table_exp: ibis.Expr, s3_path: str) -> None:
+def materialize(table_exp: ibis.Expr, con, table_name: str = 'master') -> ibis.Expr:
+    """
+    Compute the Ibis table expression once into a DuckDB table, so that several sinks can read the result without recomputing it.
+
+    :param table_exp: Ibis table expression to be materialized.
+    :param con: The Ibis-DuckDB backend connection where the table is created.
+    :param table_name: Name of the table holding the result.
+    :return: Ibis table expression over the materialized table.
+    """
+    try:
+        table = con.create_table(table_name, table_exp, overwrite=True)
+        logger.info(f"Table successfully materialized as '{table_name}'")
+        return table
+
+    except Exception as e:
+        logger.error(f"Error materializing table: {e}", exc_info=True)
+        raise
+
+# Tables of the 'star' master model, and the columns the fact table is sorted by
+STAR_TABLES = ('dim_indicator', 'dim_country', 'fact_master')
+FACT_SORT_BY = ('indicator_key', 'country_key', 'year')
+
+# Table of the master rows in the 'upsert' MASTER_DB_MODE, keyed by master_key behind the `master` view
+MASTER_ROWS_TABLE = 'master_rows'
+
+# Wide shape of the master table (MASTER_SCHEMA) rebuilt from the 'star' model tables
+STAR_MASTER_VIEW = """
+SELECT
+    c.country_id,
+    i.indicator_id,
+    CAST(f.year AS BIGINT) AS year,
+    CAST(f.value AS DOUBLE) AS value,
+    i.indicator_label,
+    CAST(f.database AS VARCHAR) AS database
+FROM fact_master f
+JOIN dim_indicator i USING (indicator_key)
+JOIN dim_country c USING (country_key)
+"""
+
+def build_star_schema(con, table_name: str = 'master') -> tuple:
+    """
+    Normalize the materialized master table into the tables of the 'star' model, in the DuckDB backend.
+
+    - dim_indicator: indicator_key (INTEGER), indicator_id, indicator_label and database, one row per
+      indicator of each database
+    - dim_country: country_key (INTEGER) and country_id
+    - fact_master: indicator_key, country_key, year (SMALLINT), value (MASTER_VALUE_TYPE) and database,
+      an ENUM of the source databases; sorted by FACT_SORT_BY
+
+    Labels and database names are stored once per indicator instead of once per row. Keys are assigned
+    in sorted order, so they only stay stable across runs while the set of indicators and countries does.
+
+    :param con: The Ibis-DuckDB backend connection holding the master table.
+    :param table_name: Name of the wide master table (or view).
+    :return: Names of the created tables (STAR_TABLES).
+    """
+    try:
+        databases = [row[0] for row in con.con.execute(f"SELECT DISTINCT database FROM {table_name} ORDER BY 1").fetchall()]
+        database_enum = database_enum_type(databases)
+        value_type = 'FLOAT' if MASTER_VALUE_TYPE == 'float32' else 'DOUBLE'
+
+        con.raw_sql(f"""
+            CREATE OR REPLACE TABLE dim_indicator AS
+            SELECT
+                CAST(row_number() OVER (ORDER BY database, indicator_id) AS INTEGER) AS indicator_key,
+                indicator_id,
+                indicator_label,
+                CAST(database AS {database_enum}) AS database
+            FROM (SELECT database, indicator_id, max(indicator_label) AS indicator_label FROM {table_name} GROUP BY ALL)
+        """)
+        con.raw_sql(f"""
+            CREATE OR REPLACE TABLE dim_country AS
+            SELECT CAST(row_number() OVER (ORDER BY country_id) AS INTEGER) AS country_key, country_id
+            FROM (SELECT DISTINCT country_id FROM {table_name})
+        """)
+        con.raw_sql(f"""
+            CREATE OR REPLACE TABLE fact_master AS
+            SELECT
+                i.indicator_key,
+                c.country_key,
+                CAST(m.year AS SMALLINT) AS year,
+                CAST(m.value AS {value_type}) AS value,
+                i.database
+            FROM {table_name} m
+            JOIN dim_indicator i ON CAST(m.database AS {database_enum}) = i.database AND m.indicator_id IS NOT DISTINCT FROM i.indicator_id
+            JOIN dim_country c ON m.country_id IS NOT DISTINCT FROM c.country_id
+            ORDER BY {", ".join(f"{column}" for column in FACT_SORT_BY)}
+        """)
+        logger.info(f"Master table normalized into {list(STAR_TABLES)}")
+        return STAR_TABLES
+
+    except Exception as e:
+        logger.error(f"Error normalizing the master table: {e}", exc_info=True)
+        raise
+
+def database_enum_type(databases: list) -> str:
+    """
+    DuckDB ENUM type of the database column.
+
+    :param databases: Values of the database column.
+    :return: The type, e.g. "ENUM('opri', 'sdg', 'wdi')".
+    """
+    return "ENUM({})".format(", ".join(f"'{database}'" for database in sorted(databases)))
+
+def partitioned_layout(table_exp: ibis.Expr, sort_by: tuple = MASTER_SORT_BY) -> ibis.Expr:
+    """
+    Prepare the master table for a partitioned write: add the year_bucket partition column and sort the rows.
+
+    :param table_exp: Ibis table expression of the master table.
+    :param sort_by: Columns the rows are sorted by.
+    :return: Ibis table expression with a year_bucket column, sorted by sort_by.
+    """
+    return (
+        table_exp
+        .mutate(year_bucket=(table_exp.year // MASTER_YEAR_BUCKET) * MASTER_YEAR_BUCKET)
+        .order_by(list(sort_by))
+    )
+
+def clear_partitions(path: str) -> None:
+    """
+    Delete the partition directories of a hive-partitioned dataset, locally or in S3.
+
+    Only the directories of the first partition column (e.g. database=*/) are deleted: other files of the
+    dataset directory, such as the snapshots of the master outputs, are kept.
+
+    :param path: The local or S3 directory of the dataset.
+    """
+    column = MASTER_PARTITION_BY[0]
+    if path.startswith('s3://'):
+        bucket_name, prefix = path.replace('s3://', '', 1).split('/', 1)
+        delete_s3_prefix(s3_init(), bucket_name, f"{prefix.rstrip('/')}/{column}=")
+    else:
+        for partition_dir in glob.glob(os.path.join(glob.escape(path), f'{column}=*')):
+            shutil.rmtree(partition_dir)
+
+def write_parquet(
+    table_exp: ibis.Expr, path: str, partitioned: bool = False, sort_by: tuple = MASTER_SORT_BY, filename_pattern: str = None,
+    overwrite: bool = True
+) -> None:
+    """
+    Write the Ibis table expression as a single Parquet file or as a hive-partitioned Parquet dataset.
+
+    :param table_exp: Ibis table expression to be written.
+    :param path: The Parquet file path, or the dataset directory if partitioned.
+    :param partitioned: Whether to partition by MASTER_PARTITION_BY, with rows sorted inside each file.
+    :param sort_by: Columns the rows of a partitioned dataset are sorted by.
+    :param filename_pattern: Name of the files of a partitioned dataset, with '{i}' for their number (DuckDB's
+                             default is 'data_{i}'), so that several writers can share a dataset directory.
+    :param overwrite: Whether a partitioned write replaces every partition of the dataset. If False, the files
+                      are added to the dataset (for writers that replace some partitions or share the directory).
+    """
+    if partitioned:
+        if overwrite:
+            # DuckDB only overwrites the files it writes: partitions or files absent from the new data would stay
+            clear_partitions(path)
+        options = {'filename_pattern': filename_pattern} if filename_pattern else {}
+        partitioned_layout(table_exp, sort_by=sort_by).to_parquet(
+            path,
+            partition_by=tuple(MASTER_PARTITION_BY),
+            row_group_size=MASTER_ROW_GROUP_SIZE,
+            overwrite_or_ignore=True,
+            **options
+        )
+    else:
+        table_exp.to_parquet(path)
+
+def save_s3(table_exp: ibis.Expr, s3_path: str, partitioned: bool = False) -> None:
     """
     Save the Ibis table expression to S3 as a Parquet file.
 
     :param table_exp: Ibis table expression to be saved.
-    :param s3_path: The full S3 path where the Parquet file will be saved.
+    :param s3_path: The full S3 path where the Parquet file (or partitioned dataset) will be saved.
+    :param partitioned: Whether to write a hive-partitioned dataset instead of a single file.
     """
     try:
-        table_exp.to_parquet(s3_path)
+        write_parquet(table_exp, s3_path, partitioned=partitioned)
         logger.info(f"Table successfully uploaded to {s3_path}")
 
     except Exception as e:
@@ -23,34 +198,350 @@ def save_duckdb(table_exp: ibis.Expr, local_db) -> None:
     """
     Save the Ibis table expression locally to a DuckDB database.
 
+    The result is streamed as Arrow record batches straight into the database, without a pandas round trip.
+
     :param table_exp: Ibis table expression to be saved.
     :param local_db: Connection to the local DuckDB database.
     """
+    if MASTER_DB_MODE == 'upsert':
+        upsert_duckdb(table_exp, local_db)
+        return
+
     try:
-        local_db.create_table(
-           'master', 
-            table_exp.execute(), 
-            overwrite=True
-        )
+        batches = table_exp.to_pyarrow_batches()
+        local_db.con.register('master_batches', batches)
+        try:
+            local_db.raw_sql("BEGIN TRANSACTION")
+            try:
+                drop_master(local_db.con)
+                local_db.raw_sql("CREATE TABLE master AS SELECT * FROM master_batches")
+                local_db.raw_sql("COMMIT")
+            except Exception:
+                rollback(local_db.con)
+                raise
+        finally:
+            local_db.con.unregister('master_batches')
         logger.info("Table successfully created in persistent DuckDB")
 
     except Exception as e:
         logger.error(f"Error creating table in DuckDB file: {e}", exc_info=True)
         raise
 
-def save_parquet(table_exp: ibis.Expr, local_path: str) -> None:
+def save_star_parquet(tables: dict, path: str, partitioned: bool = False) -> None:
+    """
+    Save the tables of the 'star' master model as Parquet files, locally or to S3.
+
+    Each table is written to '<path><table>.parquet'; with `partitioned`, the fact table is written as a
+    hive-partitioned dataset under '<path>fact_master/' instead.
+
+    :param tables: Ibis table expressions of the STAR_TABLES, by name.
+    :param path: The local or S3 directory of the master outputs (ending with '/').
+    :param partitioned: Whether to partition the fact table by MASTER_PARTITION_BY.
+    """
+    try:
+        for name, table_exp in tables.items():
+            if name == 'fact_master' and partitioned:
+                write_parquet(table_exp, f'{path}{name}/', partitioned=True, sort_by=FACT_SORT_BY)
+            elif name == 'fact_master':
+                # Explicit order: without preserve_insertion_order, a table scan may return its rows out of order
+                write_parquet(table_exp.order_by(list(FACT_SORT_BY)), f'{path}{name}.parquet')
+            else:
+                write_parquet(table_exp, f'{path}{name}.parquet')
+        logger.info(f"Tables {list(tables)} successfully saved to {path}")
+
+    except Exception as e:
+        logger.error(f"Error saving star model tables to {path}: {e}", exc_info=True)
+        raise
+
+def save_star_duckdb(tables: dict, local_db) -> None:
+    """
+    Save the tables of the 'star' master model to a local DuckDB database, with a `master` view of the wide shape.
+
+    The tables replace the previous ones (and a wide master table, if any) in one transaction.
+
+    :param tables: Ibis table expressions of the STAR_TABLES, by name.
+    :param local_db: Connection to the local DuckDB database.
+    """
+    con = local_db.con
+    try:
+        # Arrow has no ENUM type: the database column is cast back to the ENUM when stored
+        databases = tables['dim_indicator'].select('database').distinct().to_pyarrow()['database'].to_pylist()
+        database_enum = database_enum_type(databases)
+
+        con.execute("BEGIN TRANSACTION")
+        try:
+            drop_master(con)
+            for name, table_exp in tables.items():
+                con.register(f'{name}_batches', table_exp.to_pyarrow_batches())
+                try:
+                    cast = f" REPLACE (CAST(database AS {database_enum}) AS database)" if 'database' in table_exp.columns else ""
+                    con.execute(f"CREATE OR REPLACE TABLE {name} AS SELECT *{cast} FROM {name}_batches")
+                finally:
+                    con.unregister(f'{name}_batches')
+            con.execute(f"CREATE VIEW master AS {STAR_MASTER_VIEW}")
+            con.execute("COMMIT")
+        except Exception:
+            rollback(con)
+            raise
+
+        con.execute("CHECKPOINT")
+        logger.info(f"Tables {list(tables)} and the master view successfully created in persistent DuckDB")
+
+    except Exception as e:
+        logger.error(f"Error saving star model tables in DuckDB file: {e}", exc_info=True)
+        raise
+
+def rollback(con) -> None:
+    """
+    Roll back the open transaction of a DuckDB connection, if any: a failed COMMIT has already ended it.
+
+    :param con: DuckDB connection.
+    """
+    try:
+        con.execute("ROLLBACK")
+    except duckdb.TransactionException:
+        pass
+
+def drop_master(con) -> None:
+    """
+    Drop the master table or view of a local DuckDB database, and the 'star' model tables or the keyed
+    master rows if any, so that it can be rebuilt with another MASTER_MODEL or MASTER_DB_MODE.
+
+    :param con: DuckDB connection to the local database.
+    """
+    is_view = con.execute(
+        "SELECT count(*) FROM duckdb_views() WHERE view_name = 'master' AND schema_name = 'main'"
+    ).fetchone()[0]
+    con.execute("DROP VIEW IF EXISTS master" if is_view else "DROP TABLE IF EXISTS master")
+    for name in (*STAR_TABLES, MASTER_ROWS_TABLE):
+        con.execute(f"DROP TABLE IF EXISTS {name}")
+
+def save_parquet(table_exp: ibis.Expr, local_path: str, partitioned: bool = False) -> None:
     """
     Save the Ibis table expression locally as a Parquet file.
 
     :param table_exp: Ibis table expression to be saved.
-    :param local_path: The local file path where the Parquet file will be saved.
+    :param local_path: The local file path where the Parquet file (or partitioned dataset) will be saved.
+    :param partitioned: Whether to write a hive-partitioned dataset instead of a single file.
     """
     try:
-        table_exp.to_parquet(local_path)
+        write_parquet(table_exp, local_path, partitioned=partitioned)
         logger.info(f"Table successfully saved to local Parquet file: {local_path}")
 
     except Exception as e:
         logger.error(f"Error saving table to local Parquet file: {e}", exc_info=True)
-        return
+        raise
     
+def replace_s3_partitions(table_exp: ibis.Expr, s3_path: str, databases: list) -> None:
+    """
+    Replace the partitions of some databases in a partitioned master dataset in S3 with the rows of the Ibis table expression.
+
+    The database column must be the first of MASTER_PARTITION_BY, so that each database has its own directories.
+
+    :param table_exp: Ibis table expression holding the new rows of the replaced databases.
+    :param s3_path: The full S3 path of the partitioned dataset (ending with '/').
+    :param databases: Values of the database column whose partitions are replaced.
+    """
+    try:
+        bucket_name, prefix = s3_path.replace('s3://', '', 1).split('/', 1)
+        s3_client = s3_init()
+        for database in databases:
+            delete_s3_prefix(s3_client, bucket_name, f'{prefix}{MASTER_PARTITION_BY[0]}={database}/')
+
+        write_parquet(table_exp, s3_path, partitioned=True, overwrite=False)
+        logger.info(f"Partitions {databases} successfully replaced in {s3_path}")
+
+    except Exception as e:
+        logger.error(f"Error replacing partitions in S3: {e}", exc_info=True)
+        raise
+
+def replace_parquet_partitions(table_exp: ibis.Expr, local_path: str, databases: list) -> None:
+    """
+    Replace the partitions of some databases in a local partitioned master dataset with the rows of the Ibis table expression.
+
+    The database column must be the first of MASTER_PARTITION_BY, so that each database has its own directories.
+
+    :param table_exp: Ibis table expression holding the new rows of the replaced databases.
+    :param local_path: The local directory of the partitioned dataset.
+    :param databases: Values of the database column whose partitions are replaced.
+    """
+    try:
+        for database in databases:
+            shutil.rmtree(os.path.join(local_path, f'{MASTER_PARTITION_BY[0]}={database}'), ignore_errors=True)
+
+        write_parquet(table_exp, local_path, partitioned=True, overwrite=False)
+        logger.info(f"Partitions {databases} successfully replaced in {local_path}")
+
+    except Exception as e:
+        logger.error(f"Error replacing partitions in local Parquet dataset: {e}", exc_info=True)
+        raise
+
+def replace_duckdb_rows(table_exp: ibis.Expr, local_db, databases: list) -> None:
+    """
+    Replace the rows of the given databases in the master table of a local DuckDB database, in one transaction.
+
+    :param table_exp: Ibis table expression holding the new rows of the replaced databases.
+    :param local_db: Connection to the local DuckDB database.
+    :param databases: Values of the database column whose rows are replaced.
+    """
+    if MASTER_DB_MODE == 'upsert':
+        upsert_duckdb(table_exp, local_db, databases=databases)
+        return
+
+    if 'master' not in local_db.list_tables():
+        save_duckdb(table_exp, local_db)
+        return
+
+    try:
+        batches = table_exp.to_pyarrow_batches()
+        local_db.con.register('master_batches', batches)
+        try:
+            in_list = ", ".join(f"'{database}'" for database in databases)
+            local_db.raw_sql("BEGIN TRANSACTION")
+            local_db.raw_sql(f"DELETE FROM master WHERE database IN ({in_list})")
+            local_db.raw_sql("INSERT INTO master BY NAME SELECT * FROM master_batches")
+            local_db.raw_sql("COMMIT")
+        except Exception:
+            rollback(local_db.con)
+            raise
+        finally:
+            local_db.con.unregister('master_batches')
+        logger.info(f"Rows of {databases} successfully replaced in persistent DuckDB")
+
+    except Exception as e:
+        logger.error(f"Error replacing rows in DuckDB file: {e}", exc_info=True)
+        raise
+
+def master_key(table: str = None) -> str:
+    """
+    SQL expression of the master_key column: the MASTER_PRIMARY_KEY columns joined by a unit separator.
+
+    :param table: Name of the table the columns are read from (optional).
+    :return: The SQL expression.
+    """
+    prefix = f'{table}.' if table else ''
+    return "concat_ws(chr(31), {})".format(", ".join(f'{prefix}"{column}"' for column in MASTER_PRIMARY_KEY))
+
+def create_master_db_table(local_db, columns: dict, keep: str = None) -> None:
+    """
+    (Re)create the master table of a local DuckDB database with its primary key and point lookup indexes.
+
+    The rows are kept in MASTER_ROWS_TABLE, with a primary key on master_key, which holds the
+    MASTER_PRIMARY_KEY columns: DuckDB 1.1 crashes on INSERT OR REPLACE into large on-disk tables with a
+    primary key on several VARCHAR columns (see catalog_test.py). Each of MASTER_DB_INDEXES also gets an index. Readers query the `master`
+    view, which leaves out master_key.
+
+    :param local_db: Connection to the local DuckDB database.
+    :param columns: Column types of the master table, by column name, master_key included.
+    :param keep: SQL condition selecting the rows of the existing master table to carry over (default: none).
+    """
+    con = local_db.con
+    definitions = ", ".join(
+        f'"{column}" {column_type}' + (' PRIMARY KEY' if column == 'master_key' else '')
+        for column, column_type in columns.items()
+    )
+
+    con.execute("BEGIN TRANSACTION")
+    try:
+        con.execute(f"CREATE OR REPLACE TABLE master_upsert ({definitions})")
+        if keep and 'master' in local_db.list_tables():
+            existing = [column for column, _ in con.execute("SELECT column_name, column_type FROM (DESCRIBE master)").fetchall()]
+            carried = ", ".join(f'"{column}"' for column in columns if column in existing and column != 'master_key')
+            null_key = " OR ".join(f'"{column}" IS NULL' for column in MASTER_PRIMARY_KEY)
+            con.execute(f"""
+                INSERT INTO master_upsert BY NAME
+                SELECT {master_key()} AS master_key, {carried} FROM master
+                WHERE ({keep}) AND NOT ({null_key})
+                QUALIFY row_number() OVER (PARTITION BY master_key) = 1
+            """)
+        drop_master(con)
+        con.execute(f"ALTER TABLE master_upsert RENAME TO {MASTER_ROWS_TABLE}")
+        # Tables with indexes cannot be renamed, so the indexes are created last
+        for column in MASTER_DB_INDEXES:
+            con.execute(f'CREATE INDEX master_{column}_idx ON {MASTER_ROWS_TABLE} ("{column}")')
+        con.execute(f"CREATE VIEW master AS SELECT * EXCLUDE (master_key) FROM {MASTER_ROWS_TABLE}")
+        con.execute("COMMIT")
+    except Exception:
+        rollback(con)
+        raise
+
+    logger.info(f"Created the master table in persistent DuckDB with primary key {MASTER_PRIMARY_KEY}")
+
+def upsert_duckdb(table_exp: ibis.Expr, local_db, databases: list = None) -> None:
+    """
+    Apply the Ibis table expression to the master table of a local DuckDB database, rewriting only the rows of the given databases.
+
+    The master table has a primary key on MASTER_PRIMARY_KEY (see `create_master_db_table`). The rows of
+    the expression are written with INSERT OR REPLACE on that key, and the rows of its databases missing
+    from it are deleted, in one transaction: the rows of the other databases (e.g. the sources an
+    incremental run did not rebuild) are not touched. The table is created on first use, or recreated if
+    its columns changed, and a checkpoint at the end folds the write-ahead log into the database file.
+    Rows without a complete primary key, or repeating one, fail the load before anything is written.
+
+    :param table_exp: Ibis table expression holding the rows of the master table.
+    :param local_db: Connection to the local DuckDB database.
+    :param databases: If given, the expression only holds these values of the database column, and only
+                      their rows are updated; the other rows are left untouched.
+    :raises ValueError: If rows have a missing or duplicate primary key.
+    """
+    con = local_db.con
+    scope = "TRUE" if databases is None else "database IN ({})".format(", ".join(f"'{database}'" for database in databases))
+
+    try:
+        # Stage the result once: it is compared with the master table twice
+        batches = table_exp.to_pyarrow_batches()
+        con.register('master_batches', batches)
+        try:
+            con.execute(f"CREATE OR REPLACE TEMP TABLE master_staged AS SELECT {master_key()} AS master_key, * FROM master_batches")
+        finally:
+            con.unregister('master_batches')
+        columns = dict(con.execute("SELECT column_name, column_type FROM (DESCRIBE master_staged)").fetchall())
+
+        # Rows without a complete primary key, or repeating one, cannot be upserted
+        null_key = " OR ".join(f'"{column}" IS NULL' for column in MASTER_PRIMARY_KEY)
+        null_keys, duplicate_keys = con.execute(f"""
+            SELECT count(*) FILTER (WHERE {null_key}), count(*) FILTER (WHERE NOT ({null_key})) - count(DISTINCT master_key) FILTER (WHERE NOT ({null_key}))
+            FROM master_staged
+        """).fetchone()
+        if null_keys or duplicate_keys:
+            con.execute("DROP TABLE master_staged")
+            raise ValueError(
+                f"{null_keys} master rows have a missing and {duplicate_keys} a duplicate primary key {MASTER_PRIMARY_KEY}: "
+                f"they cannot be upserted (use MASTER_DB_MODE=replace to load them)"
+            )
+
+        existing = {}
+        if con.execute(f"SELECT count(*) FROM duckdb_tables() WHERE table_name = '{MASTER_ROWS_TABLE}' AND schema_name = 'main'").fetchone()[0]:
+            existing = dict(con.execute(f"SELECT column_name, column_type FROM (DESCRIBE {MASTER_ROWS_TABLE})").fetchall())
+        created = existing != columns
+        if created:
+            create_master_db_table(local_db, columns, keep=None if databases is None else f"NOT ({scope})")
+
+        column_list = ", ".join(f'"{column}"' for column in columns)
+        con.execute("BEGIN TRANSACTION")
+        try:
+            if created:
+                # The new table holds no rows in scope: there is nothing to compare with
+                deleted = 0
+                upserted = con.execute(f"INSERT INTO {MASTER_ROWS_TABLE} ({column_list}) SELECT {column_list} FROM master_staged").fetchone()[0]
+            else:
+                deleted = con.execute(f"""
+                    DELETE FROM {MASTER_ROWS_TABLE} WHERE {scope} AND master_key NOT IN (SELECT master_key FROM master_staged)
+                """).fetchone()[0]
+                upserted = con.execute(
+                    f"INSERT OR REPLACE INTO {MASTER_ROWS_TABLE} ({column_list}) SELECT {column_list} FROM master_staged"
+                ).fetchone()[0]
+            con.execute("COMMIT")
+        except Exception:
+            rollback(con)
+            raise
+
+        con.execute("DROP TABLE master_staged")
+        con.execute("CHECKPOINT")
+        logger.info(f"Master table upserted in persistent DuckDB: {upserted} rows inserted or updated, {deleted} deleted")
+
+    except Exception as e:
+        logger.error(f"Error upserting table in DuckDB file: {e}", exc_info=True)
+        raise
+
 # TODO: Function to save the data remotely to motherduck
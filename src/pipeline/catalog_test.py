@@ -0,0 +1,104 @@
+import os
+import sys
+import glob
+import subprocess
+import duckdb
+import ibis
+import pytest
+import pandas as pd
+import pipeline.catalog as catalog
+from pipeline.catalog import save_parquet, replace_parquet_partitions, save_duckdb, replace_duckdb_rows, build_star_schema, save_star_duckdb, STAR_TABLES
+
+def master_table(con, rows: list):
+    return con.create_table('master', pd.DataFrame(rows, columns=['country_id', 'indicator_id', 'year', 'value', 'indicator_label', 'database']), overwrite=True)
+
+def dataset_files(path: str) -> list:
+    return sorted(os.path.relpath(f, path) for f in glob.glob(f'{path}/**/*.parquet', recursive=True))
+
+def test_full_partitioned_rewrite_leaves_no_stale_files(tmp_path):
+    con = ibis.duckdb.connect()
+    path = str(tmp_path / 'master')
+    save_parquet(master_table(con, [('KEN', 'A', 2001, 1.0, 'a', 'wdi'), ('KEN', 'B', 1995, 2.0, 'b', 'sdg')]), path, partitioned=True)
+    # As left by a compaction, and by another writer: a renamed file, and a partition the next run does not write
+    os.rename(f'{path}/database=wdi/year_bucket=2000/data_0.parquet', f'{path}/database=wdi/year_bucket=2000/run_0.parquet')
+    os.makedirs(f'{tmp_path}/master/_snapshots')
+    open(f'{tmp_path}/master/_snapshots/keep.json', 'w').close()
+
+    save_parquet(master_table(con, [('KEN', 'A', 2001, 3.0, 'a', 'wdi')]), path, partitioned=True)
+
+    assert dataset_files(path) == ['database=wdi/year_bucket=2000/data_0.parquet']
+    assert con.read_parquet(f'{path}/**/*.parquet').count().execute() == 1
+    assert os.path.exists(f'{path}/_snapshots/keep.json')
+
+def test_partition_replace_keeps_other_databases(tmp_path):
+    con = ibis.duckdb.connect()
+    path = str(tmp_path / 'master')
+    save_parquet(master_table(con, [('KEN', 'A', 2001, 1.0, 'a', 'wdi'), ('KEN', 'B', 1995, 2.0, 'b', 'sdg')]), path, partitioned=True)
+
+    replace_parquet_partitions(master_table(con, [('NGA', 'A', 2011, 3.0, 'a', 'wdi')]), path, ['wdi'])
+
+    assert dataset_files(path) == ['database=sdg/year_bucket=1990/data_0.parquet', 'database=wdi/year_bucket=2010/data_0.parquet']
+
+def master_rows(local_db) -> list:
+    return sorted(local_db.con.execute("SELECT * FROM master").fetchall())
+
+def test_upsert_writes_changes_and_hides_the_surrogate_key(tmp_path):
+    con = ibis.duckdb.connect()
+    local_db = ibis.duckdb.connect(str(tmp_path / 'staging.db'))
+    save_duckdb(master_table(con, [('KEN', 'A', 2001, 1.0, 'a', 'wdi'), ('NGA', 'A', 2001, 2.0, 'a', 'wdi'), ('KEN', 'B', 1995, 3.0, 'b', 'sdg')]), local_db)
+
+    # NGA disappeared from wdi, KEN changed; sdg is out of scope
+    replace_duckdb_rows(master_table(con, [('KEN', 'A', 2001, 5.0, 'a', 'wdi')]), local_db, ['wdi'])
+
+    assert master_rows(local_db) == [('KEN', 'A', 2001, 5.0, 'a', 'wdi'), ('KEN', 'B', 1995, 3.0, 'b', 'sdg')]
+    assert 'master_key' not in local_db.table('master').columns
+
+def test_upsert_fails_on_duplicate_or_missing_keys(tmp_path):
+    con = ibis.duckdb.connect()
+    local_db = ibis.duckdb.connect(str(tmp_path / 'staging.db'))
+    save_duckdb(master_table(con, [('KEN', 'A', 2001, 1.0, 'a', 'wdi')]), local_db)
+
+    with pytest.raises(ValueError, match='1 master rows have a missing and 1 a duplicate primary key'):
+        save_duckdb(master_table(con, [('KEN', 'A', 2001, 1.0, 'a', 'wdi'), ('KEN', 'A', 2001, 2.0, 'a', 'wdi'), (None, 'A', 2002, 3.0, 'a', 'wdi')]), local_db)
+    assert master_rows(local_db) == [('KEN', 'A', 2001, 1.0, 'a', 'wdi')]
+
+def test_replace_mode_rewrites_the_rows_of_the_replaced_databases(tmp_path, monkeypatch):
+    monkeypatch.setattr(catalog, 'MASTER_DB_MODE', 'replace')
+    con = ibis.duckdb.connect()
+    local_db = ibis.duckdb.connect(str(tmp_path / 'staging.db'))
+    save_duckdb(master_table(con, [('KEN', 'A', 2001, 1.0, 'a', 'wdi'), ('NGA', 'A', 2001, 2.0, 'a', 'wdi'), ('KEN', 'B', 1995, 3.0, 'b', 'sdg')]), local_db)
+
+    replace_duckdb_rows(master_table(con, [('KEN', 'A', 2001, 5.0, 'a', 'wdi')]), local_db, ['wdi'])
+
+    assert master_rows(local_db) == [('KEN', 'A', 2001, 5.0, 'a', 'wdi'), ('KEN', 'B', 1995, 3.0, 'b', 'sdg')]
+
+def test_star_schema_master_view_returns_the_master_rows(tmp_path):
+    con = ibis.duckdb.connect()
+    rows = [('KEN', 'A', 2001, 1.0, 'a', 'wdi'), ('NGA', 'A', 2001, 2.0, 'a', 'wdi'), ('KEN', 'A', 1995, 3.0, 'a', 'sdg'), ('KEN', 'B', 1995, None, 'b', 'sdg')]
+    master_table(con, rows)
+    local_db = ibis.duckdb.connect(str(tmp_path / 'staging.db'))
+    save_duckdb(con.table('master'), local_db)
+
+    # Indicator labels are stored once per indicator of each database
+    tables = {name: con.table(name) for name in build_star_schema(con)}
+    assert tables['dim_indicator'].count().execute() == 3
+    save_star_duckdb(tables, local_db)
+
+    assert master_rows(local_db) == sorted(rows)
+    assert set(STAR_TABLES) <= set(local_db.list_tables())
+
+# Upserts of a table with a primary key on several VARCHAR columns, as MASTER_PRIMARY_KEY would need
+COMPOSITE_KEY_UPSERT = """
+import sys, duckdb
+con = duckdb.connect(sys.argv[1])
+con.execute("CREATE TABLE master (database VARCHAR, indicator_id VARCHAR, country_id VARCHAR, year BIGINT, value DOUBLE, PRIMARY KEY (database, indicator_id, country_id, year))")
+rows = "SELECT 'wdi', 'IND.' || (i // 10000), 'C' || (i % 200), 1960 + (i // 200) % 50, i::DOUBLE FROM range(300000) t(i)"
+con.execute(f"INSERT INTO master {rows}")
+con.execute(f"INSERT OR REPLACE INTO master {rows}")
+"""
+
+@pytest.mark.skipif(not duckdb.__version__.startswith('1.1.'), reason="Only DuckDB 1.1 is known to crash")
+def test_composite_varchar_primary_key_crashes_duckdb_upserts(tmp_path):
+    # The reason for the master_key column: if this starts passing, the primary key can go on MASTER_PRIMARY_KEY
+    result = subprocess.run([sys.executable, '-c', COMPOSITE_KEY_UPSERT, str(tmp_path / 'staging.db')], capture_output=True)
+    assert result.returncode < 0
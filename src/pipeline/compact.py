@@ -0,0 +1,367 @@
+import os
+import json
+import math
+import time
+import argparse
+import tempfile
+from botocore.exceptions import ClientError
+from pipeline.utils import (
+    setup_logger, set_duckdb_profile, duckdb_connect, s3_init, s3_filesystem, partition_values, snake_case,
+    landing_table_name
+)
+from pipeline.catalog import FACT_SORT_BY
+from pipeline.report import RunReport
+from pipeline.snapshots import SnapshotStore, new_snapshot_id
+from pipeline.ingest.run import get_ingest_profile
+from pipeline.ingest.manifest import IngestManifest
+from pipeline.etl.listing import LandingIndex
+from pipeline.etl.shard import SHARD_KEYS
+from pipeline.etl.sources import SOURCES
+import pipeline.config as config
+
+# Set up logging
+logger = setup_logger(__name__)
+
+# Parquet key-value metadata recording the layout a landing file was rewritten with
+LAYOUT_KEY = 'pipeline_layout'
+
+def landing_sort_columns(table_name: str) -> list:
+    """
+    Snake_case columns a landing table is sorted by: the columns its sources declare as holding the master key.
+
+    :param table_name: Name of the landing table (e.g. 'wdi_WDICSV').
+    :return: Columns in the order of SHARD_KEYS, e.g. ['indicator_code', 'country_code'].
+    """
+    for spec in SOURCES.values():
+        columns = [spec['shard_columns'].get(key, {}).get(table_name) for key in SHARD_KEYS]
+        if any(columns):
+            return [column for column in columns if column]
+    return []
+
+def parquet_source(paths: list) -> str:
+    """
+    DuckDB table function reading Parquet files without their hive partition columns, as they are stored.
+
+    :param paths: Paths of the files (local or 's3://').
+    :return: The `read_parquet` expression.
+    """
+    files = ", ".join(f"'{path}'" for path in paths)
+    return f"read_parquet([{files}], hive_partitioning = false)"
+
+class Compaction:
+    """
+    Maintenance of the Parquet layout of the landing area and of partitioned master datasets.
+
+    - Landing files hold one table each, so they are rewritten in place rather than merged: once per
+      ingested version, with the row groups and compression of the source's ingest profile and sorted by
+      the columns holding the master key. The layout is recorded in the file's metadata, so a file is only
+      rewritten again when the ingest replaces it or the layout changes.
+    - The files of each partition of a master dataset are merged into files of about COMPACT_TARGET_FILE_MB,
+      sorted and with MASTER_ROW_GROUP_SIZE row groups, when the partition has more files than its size needs
+      (e.g. one file per shard of a sharded run).
+
+    Every rewritten file is checked against its originals before it replaces them: same row count and
+    same checksum (the sum of the hashes of all rows, independent of their order). A landing file is
+    swapped in with a single object replacement, and the merged files of a snapshot-versioned dataset
+    by publishing a new snapshot.
+    """
+
+    def __init__(self, target_file_mb: float = None, dry_run: bool = False) -> None:
+        """
+        Initialize the compaction.
+
+        :param target_file_mb: Target size of the merged files of a partition (defaults to config.COMPACT_TARGET_FILE_MB).
+        :param dry_run: Only log the files that would be rewritten.
+        """
+        self.target_bytes = int((target_file_mb or config.COMPACT_TARGET_FILE_MB) * 1024 * 1024)
+        self.dry_run = dry_run
+        self.con = duckdb_connect()
+        self.con.register_filesystem(s3_filesystem())
+        self.report = RunReport('compact')
+
+    def checksum(self, paths: list) -> tuple:
+        """
+        Compute the row count and order-independent checksum of Parquet files.
+
+        :param paths: Paths of the files (local or 's3://').
+        :return: Tuple of (rows, sum of the hashes of the rows).
+        """
+        source = parquet_source(paths)
+        columns = ", ".join(f'"{row[0]}"' for row in self.con.execute(f"DESCRIBE SELECT * FROM {source}").fetchall())
+        rows, total = self.con.execute(f"SELECT count(*), coalesce(sum(hash({columns})), 0) FROM {source}").fetchone()
+        return int(rows), int(total)
+
+    def verify(self, originals: list, rewritten: list) -> int:
+        """
+        Check that rewritten files hold the same rows as their originals.
+
+        :param originals: Paths of the original files.
+        :param rewritten: Paths of the rewritten files.
+        :return: Number of rows.
+        :raises ValueError: If the row counts or checksums differ.
+        """
+        expected, actual = self.checksum(originals), self.checksum(rewritten)
+        if expected != actual:
+            raise ValueError(f"Rewritten files {rewritten} do not match {originals}: (rows, checksum) {actual} != {expected}")
+        return expected[0]
+
+    def landing_layout(self, source: str, table_name: str) -> dict:
+        """
+        Layout a landing file is rewritten with: the Parquet writer options of its source's ingest profile and its sort columns.
+
+        :param source: Source folder of the file (e.g. 'wdi').
+        :param table_name: Name of the landing table.
+        :return: Dictionary of row_group_size, compression, compression_level and sort_by.
+        """
+        profile = get_ingest_profile(source.split('/')[0])
+        return {
+            'row_group_size': profile['row_group_size'],
+            'compression': profile['compression'],
+            'compression_level': profile.get('compression_level'),
+            'sort_by': landing_sort_columns(table_name),
+        }
+
+    def compact_landing_file(self, source: str, name: str, metadata: dict) -> dict:
+        """
+        Rewrite a landing file with its layout, unless it already has it.
+
+        The file is written to a local temporary file and verified, then uploaded over the original with
+        a write conditioned on the original's ETag: a file the ingest replaced meanwhile is left as is.
+
+        :param source: Source folder of the file.
+        :param name: File name without extension.
+        :param metadata: Landing index metadata of the file (path, size, ETag).
+        :return: Outcome of the file: status ('compacted', 'skipped' or 'changed'), rows, sizes and new ETag.
+        """
+        path = metadata['path']
+        layout = self.landing_layout(source, landing_table_name(source, name))
+        stamp = json.dumps(layout, sort_keys=True)
+
+        current = self.con.execute(
+            f"SELECT decode(value) FROM parquet_kv_metadata('{path}') WHERE decode(key) = '{LAYOUT_KEY}'"
+        ).fetchone()
+        if current is not None and current[0] == stamp:
+            return {'status': 'skipped'}
+        if self.dry_run:
+            logger.info(f"Would rewrite {path} ({metadata['size']} bytes) with layout {stamp}")
+            return {'status': 'planned'}
+
+        columns = {snake_case(row[0]): row[0] for row in self.con.execute(f"DESCRIBE SELECT * FROM '{path}'").fetchall()}
+        order_by = ", ".join(f'"{columns[column]}"' for column in layout['sort_by'] if column in columns)
+        options = [
+            "FORMAT PARQUET",
+            f"ROW_GROUP_SIZE {layout['row_group_size']}",
+            f"COMPRESSION '{layout['compression']}'",
+            f"KV_METADATA {{{LAYOUT_KEY}: '{stamp}'}}",
+        ]
+        if layout['compression'].lower() == 'zstd' and layout['compression_level'] is not None:
+            options.append(f"COMPRESSION_LEVEL {layout['compression_level']}")
+
+        bucket, key = path[len('s3://'):].split('/', 1)
+        tmp_root = config.DUCKDB_PROFILES['default']['temp_directory']
+        os.makedirs(tmp_root, exist_ok=True)
+        with tempfile.TemporaryDirectory(dir=tmp_root) as tmp_dir:
+            tmp_path = os.path.join(tmp_dir, os.path.basename(key))
+            self.con.execute(f"""
+                COPY (SELECT * FROM {parquet_source([path])}{f' ORDER BY {order_by}' if order_by else ''})
+                TO '{tmp_path}' ({', '.join(options)})
+            """)
+            rows = self.verify([path], [tmp_path])
+
+            # Swap in: one write conditioned on the ETag the file was read with, which S3 rejects if the
+            # ingest replaced the file meanwhile
+            try:
+                with open(tmp_path, 'rb') as f:
+                    response = s3_init().put_object(Bucket=bucket, Key=key, Body=f, IfMatch=metadata['etag'])
+            except ClientError as e:
+                if e.response['Error']['Code'] not in ('PreconditionFailed', 'ConditionalRequestConflict'):
+                    raise
+                logger.warning(f"{path} was replaced during its compaction, leaving it as is")
+                return {'status': 'changed'}
+
+            return {
+                'status': 'compacted', 'rows': rows, 'bytes_before': metadata['size'],
+                'bytes_after': os.path.getsize(tmp_path), 'etag': response['ETag'].strip('"'),
+            }
+
+    def compact_landing(self) -> list:
+        """
+        Rewrite the landing files that do not have their layout yet.
+
+        The ingest manifest is updated with the new ETags: its new version makes every landing index run
+        a full listing, which picks up the replaced objects.
+
+        :return: Keys of the rewritten files.
+        """
+        compacted = {}
+        with self.report.stage('landing', con=self.con) as stage:
+            index = LandingIndex().refresh()
+            for source, files in index.file_metadata().items():
+                for name, metadata in files.items():
+                    start = time.perf_counter()
+                    try:
+                        outcome = self.compact_landing_file(source, name, metadata)
+                    except Exception as e:
+                        logger.error(f"Error compacting {metadata['path']}: {e}", exc_info=True)
+                        self.report.add({'stage': 'landing', 'source': metadata['path'], 'status': 'error', 'error': str(e)})
+                        raise
+
+                    if outcome['status'] != 'skipped':
+                        self.report.add({
+                            'stage': 'landing', 'source': metadata['path'], **outcome,
+                            'seconds': round(time.perf_counter() - start, 3),
+                        })
+                    if outcome['status'] == 'compacted':
+                        compacted[metadata['path'].split('/', 3)[3]] = outcome['etag']
+                        logger.info(f"Compacted {metadata['path']}: {outcome['bytes_before']} -> {outcome['bytes_after']} bytes")
+
+            if compacted:
+                manifest = IngestManifest(s3_init())
+                manifest.load()
+                for entry in manifest.entries.values():
+                    if entry.get('s3_key') in compacted:
+                        entry['etag'] = compacted[entry['s3_key']]
+                manifest.save()
+                index.refresh(full=True)
+
+            stage.update(files=len(compacted))
+
+        logger.info(f"Compacted {len(compacted)} landing files.")
+        return list(compacted)
+
+    def dataset_plan(self, files: dict) -> dict:
+        """
+        Find the partitions of a dataset with more files than their size needs.
+
+        :param files: Sizes of the dataset's files, by path relative to the dataset directory.
+        :return: Relative paths of the files to merge, by partition directory relative to the snapshot
+                 directory (e.g. 'database=wdi/year_bucket=2000' or 'fact_master/database=wdi/year_bucket=2000').
+        """
+        partitions = {}
+        for rel in files:
+            relative = SnapshotStore.relative(rel)
+            if partition_values(relative):
+                partitions.setdefault(os.path.dirname(relative), []).append(rel)
+
+        plan = {}
+        for partition, group in partitions.items():
+            needed = max(1, math.ceil(sum(files[rel] or 0 for rel in group) / self.target_bytes))
+            if len(group) > needed:
+                plan[partition] = sorted(group)
+        return plan
+
+    def compact_dataset(self, path: str) -> dict:
+        """
+        Merge the small files of each partition of a hive-partitioned Parquet dataset.
+
+        Only snapshot-versioned datasets (see `SnapshotStore`) are compacted: the merged files of every
+        partition are written and verified under a new snapshot, published with the files it leaves
+        unchanged, and the originals stay readable in the previous snapshots until they expire. Datasets
+        read by listing their directory are skipped, as their files cannot be swapped atomically.
+
+        :param path: Local or S3 directory of the dataset.
+        :return: Partitions compacted, mapped to the number of files before and after.
+        """
+        store = SnapshotStore(path)
+        fs, root = store.fs, store.root
+        url = store.url
+
+        with self.report.stage('dataset', con=self.con) as stage:
+            if not fs.exists(root):
+                logger.info(f"No dataset in {path}, nothing to compact.")
+                return {}
+            manifest = store.load()
+            if manifest is None:
+                logger.warning(f"{path} has no snapshot manifest, not compacting it (publish it with MASTER_PUBLISH=snapshot).")
+                return {}
+            entries = {entry['path']: entry for table in manifest['tables'].values() for entry in table['files']}
+            files = {rel: entry['bytes'] for rel, entry in entries.items()}
+            plan = self.dataset_plan(files)
+            if self.dry_run:
+                for partition, group in plan.items():
+                    logger.info(f"Would merge {len(group)} files of {path.rstrip('/')}/{partition}")
+                return {partition: (len(group), None) for partition, group in plan.items()}
+            if not plan:
+                logger.info(f"No partition of {path} needs compacting.")
+                return {}
+
+            snapshot_id = new_snapshot_id()
+            output_root = f'{config.MASTER_SNAPSHOT_DIR}/{snapshot_id}'
+            merged = {}
+            try:
+                for partition, group in plan.items():
+                    start = time.perf_counter()
+                    originals = [url(rel) for rel in group]
+                    columns = [row[0] for row in self.con.execute(f"DESCRIBE SELECT * FROM {parquet_source(originals)}").fetchall()]
+                    sort_by = next((sort for sort in (config.MASTER_SORT_BY, FACT_SORT_BY) if set(sort) <= set(columns)), ())
+                    order_by = f" ORDER BY {', '.join(sort_by)}" if sort_by else ""
+
+                    staged = f'{output_root}/{partition}'
+                    fs.makedirs(f'{root}/{staged}', exist_ok=True)
+                    self.con.execute(f"""
+                        COPY (SELECT * FROM {parquet_source(originals)}{order_by})
+                        TO '{url(staged)}' (
+                            FORMAT PARQUET, ROW_GROUP_SIZE {config.MASTER_ROW_GROUP_SIZE}, FILE_SIZE_BYTES {self.target_bytes},
+                            FILENAME_PATTERN '{self.report.run_id}_{{i}}'
+                        )
+                    """)
+                    fs.invalidate_cache(f'{root}/{staged}')
+                    new_files = sorted(file[len(root) + 1:] for file in fs.find(f'{root}/{staged}'))
+                    rows = self.verify(originals, [url(rel) for rel in new_files])
+                    merged[partition] = new_files
+
+                    self.report.add({
+                        'stage': 'dataset', 'source': f"{path.rstrip('/')}/{partition}", 'status': 'success',
+                        'rows': rows, 'files_before': len(group), 'files_after': len(new_files),
+                        'seconds': round(time.perf_counter() - start, 3),
+                    })
+
+                # Swap in: publish a snapshot listing the merged files instead of the originals
+                replaced = {rel for partition in merged for rel in plan[partition]}
+                store.commit(
+                    snapshot_id, self.con, [rel for new_files in merged.values() for rel in new_files],
+                    [entry for rel, entry in entries.items() if rel not in replaced],
+                    parent_id=manifest['snapshot_id'], operation='compact',
+                    properties={**manifest['properties'], 'compact_run_id': self.report.run_id},
+                )
+                store.expire()
+
+            except Exception:
+                store.discard(snapshot_id)
+                raise
+
+            stage.update(path=path, partitions=len(merged), files_before=len(replaced),
+                         files_after=sum(len(new_files) for new_files in merged.values()))
+
+        logger.info(f"Compacted {len(merged)} partitions of {path}.")
+        return {partition: (len(plan[partition]), len(new_files)) for partition, new_files in merged.items()}
+
+    def run(self, landing: bool = True, datasets: list = None) -> None:
+        """
+        Compact the landing area and the partitioned master datasets.
+
+        :param landing: Whether to rewrite the landing files.
+        :param datasets: Local or S3 directories of the partitioned datasets (defaults to the master folder of the S3 staging area).
+        """
+        try:
+            if landing:
+                self.compact_landing()
+            for path in datasets if datasets is not None else [config.MASTER_S3_DIR]:
+                self.compact_dataset(path)
+
+        finally:
+            if not self.dry_run:
+                self.report.save()
+            self.con.close()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compact the landing files and the partitioned master datasets.")
+    parser.add_argument('--no-landing', action='store_true', help="Leave the landing files as they are")
+    parser.add_argument('--dataset', action='append', help="Local or S3 directory of a partitioned dataset to compact, instead of the S3 master (repeatable)")
+    parser.add_argument('--target-mb', type=float, help="Target size of the merged files (defaults to COMPACT_TARGET_FILE_MB)")
+    parser.add_argument('--dry-run', action='store_true', help="Only log the files that would be rewritten")
+    parser.add_argument('--profile', help="DuckDB runtime profile (a key of config.DUCKDB_PROFILES, defaults to DUCKDB_PROFILE)")
+    args = parser.parse_args()
+    set_duckdb_profile(args.profile)
+
+    Compaction(args.target_mb, args.dry_run).run(landing=not args.no_landing, datasets=args.dataset)
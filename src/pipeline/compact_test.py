@@ -0,0 +1,84 @@
+import io
+import os
+import duckdb
+import pytest
+import pandas as pd
+import pipeline.config as config
+from pipeline.bench.local_s3 import local_s3
+from pipeline.compact import Compaction
+from pipeline.etl.listing import LandingIndex
+from pipeline.snapshots import SnapshotStore, new_snapshot_id
+
+def parquet(frame: pd.DataFrame) -> bytes:
+    buffer = io.BytesIO()
+    frame.to_parquet(buffer)
+    return buffer.getvalue()
+
+def wdi_rows() -> pd.DataFrame:
+    return pd.DataFrame({'Country Code': ['NGA', 'KEN', 'KEN'], 'Indicator Code': ['B', 'B', 'A'], '2001': [1.0, 2.0, 3.0]})
+
+def landing_file(tmp_path) -> dict:
+    index = LandingIndex(config.S3_BUCKET_NAME, config.LANDING_AREA_FOLDER, str(tmp_path / 'landing_index.json')).refresh()
+    return index.file_metadata()['wdi']['WDICSV']
+
+@pytest.fixture
+def client(tmp_path):
+    with local_s3(str(tmp_path / 's3')) as client:
+        client.put_object(Bucket=config.S3_BUCKET_NAME, Key='landing/wdi/WDICSV.parquet', Body=parquet(wdi_rows()))
+        yield client
+
+@pytest.fixture
+def compaction(tmp_path, monkeypatch, client):
+    monkeypatch.setitem(config.DUCKDB_PROFILES['default'], 'temp_directory', str(tmp_path / 'tmp'))
+    compaction = Compaction(target_file_mb=1)
+    compaction.report.enabled = False
+    yield compaction
+    compaction.con.close()
+
+def test_landing_file_is_rewritten_sorted_once(tmp_path, compaction):
+    outcome = compaction.compact_landing_file('wdi', 'WDICSV', landing_file(tmp_path))
+
+    assert (outcome['status'], outcome['rows']) == ('compacted', 3)
+    metadata = landing_file(tmp_path)
+    assert metadata['etag'] == outcome['etag']
+    rows = compaction.con.execute(f"SELECT \"Indicator Code\", \"Country Code\" FROM '{metadata['path']}'").fetchall()
+    assert rows == [('A', 'KEN'), ('B', 'KEN'), ('B', 'NGA')]
+    assert compaction.compact_landing_file('wdi', 'WDICSV', metadata) == {'status': 'skipped'}
+
+def test_landing_file_replaced_meanwhile_is_left_as_is(tmp_path, client, compaction):
+    metadata = landing_file(tmp_path)
+    client.put_object(Bucket=config.S3_BUCKET_NAME, Key='landing/wdi/WDICSV.parquet', Body=parquet(wdi_rows().head(1)))
+
+    assert compaction.compact_landing_file('wdi', 'WDICSV', metadata) == {'status': 'changed'}
+    assert compaction.con.execute(f"SELECT count(*) FROM '{metadata['path']}'").fetchone()[0] == 1
+
+def write_snapshot(path: str, files: int) -> SnapshotStore:
+    store = SnapshotStore(path)
+    snapshot_id = new_snapshot_id()
+    partition = f'{config.MASTER_SNAPSHOT_DIR}/{snapshot_id}/database=wdi/year_bucket=2000'
+    os.makedirs(f'{path}/{partition}')
+    for i in range(files):
+        pd.DataFrame({'indicator_id': [f'I{i}'], 'country_id': ['KEN'], 'year': [2001], 'value': [float(i)]}).to_parquet(f'{path}/{partition}/run_{i}.parquet')
+    store.commit(snapshot_id, duckdb.connect(), store.files(snapshot_id))
+    return store
+
+def test_dataset_partitions_are_merged_into_a_new_snapshot(tmp_path, compaction):
+    store = write_snapshot(str(tmp_path / 'master'), 3)
+    parent = store.load()
+
+    assert compaction.compact_dataset(str(tmp_path / 'master')) == {'database=wdi/year_bucket=2000': (3, 1)}
+
+    manifest = store.load()
+    assert (manifest['parent_id'], manifest['operation']) == (parent['snapshot_id'], 'compact')
+    assert manifest['tables']['master']['rows'] == 3
+    assert len(manifest['tables']['master']['files']) == 1
+    assert compaction.compact_dataset(str(tmp_path / 'master')) == {}
+
+def test_dataset_without_snapshots_is_not_compacted(tmp_path, compaction):
+    partition = tmp_path / 'master' / 'database=wdi' / 'year_bucket=2000'
+    os.makedirs(partition)
+    for i in range(3):
+        pd.DataFrame({'value': [float(i)]}).to_parquet(partition / f'run_{i}.parquet')
+
+    assert compaction.compact_dataset(str(tmp_path / 'master')) == {}
+    assert len(os.listdir(partition)) == 3
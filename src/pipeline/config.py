@@ -9,7 +9,7 @@ ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
     # RAW_DATA_DIR = os.path.join(ROOT_DIR, 'raw_data')
     # PROC_DATA_DIR = os.path.join(ROOT_DIR, 'processed')
 
-DATALAKE_DIR = os.path.join(ROOT_DIR, 'datalake')
+DATALAKE_DIR = os.getenv('DATALAKE_DIR', os.path.join(ROOT_DIR, 'datalake'))
 RAW_DATA_DIR = os.path.join(DATALAKE_DIR, 'raw')
 STAGING_DATA_DIR = os.path.join(DATALAKE_DIR, 'staging')
 MASTER_DATA_DIR = os.path.join(STAGING_DATA_DIR, 'master')
@@ -18,6 +18,194 @@ MASTER_DATA_DIR = os.path.join(STAGING_DATA_DIR, 'master')
 S3_BUCKET_NAME = 'poc-aug-2024'
 LANDING_AREA_FOLDER = 'landing'
 STAGING_AREA_PATH = 'staging'
+MASTER_S3_DIR = f's3://{S3_BUCKET_NAME}/{STAGING_AREA_PATH}/master/'
+S3_MAX_POOL_CONNECTIONS = int(os.getenv('S3_MAX_POOL_CONNECTIONS', 32))  # HTTP connections kept by the shared S3 client
+
+# Bulk downloads from S3 (download_s3_client): files are fetched in byte ranges of DOWNLOAD_PART_SIZE_MB,
+# DOWNLOAD_MAX_WORKERS at a time. Keep the workers at or below S3_MAX_POOL_CONNECTIONS.
+DOWNLOAD_MAX_WORKERS = int(os.getenv('DOWNLOAD_MAX_WORKERS', 16))
+DOWNLOAD_PART_SIZE_MB = float(os.getenv('DOWNLOAD_PART_SIZE_MB', 8))
+
+# Persisted listing of the landing area, refreshed with a full listing. Set LANDING_APPEND_ONLY only if landing
+# keys are never replaced or deleted, and new keys sort after the other keys of their folder: the index then only
+# lists the new keys of each folder, unless the ingest manifest changed or it is older than LANDING_INDEX_MAX_AGE seconds.
+LANDING_INDEX_PATH = os.path.join(DATALAKE_DIR, 'landing_index.json')
+LANDING_APPEND_ONLY = os.getenv('LANDING_APPEND_ONLY', 'false').lower() == 'true'
+LANDING_INDEX_MAX_AGE = int(os.getenv('LANDING_INDEX_MAX_AGE', 24 * 3600))
+
+# Local read-through cache of the landing files read by the ETL, validated by ETag and evicting the
+# least recently used files above LANDING_CACHE_MAX_GB
+LANDING_CACHE = os.getenv('LANDING_CACHE', 'false').lower() == 'true'
+LANDING_CACHE_DIR = os.getenv('LANDING_CACHE_DIR', os.path.join(DATALAKE_DIR, 'cache', 'landing'))
+LANDING_CACHE_MAX_GB = float(os.getenv('LANDING_CACHE_MAX_GB', 10))
+
+# DuckDB runtime profiles: settings applied to every DuckDB database the pipeline opens. Select one with the
+# DUCKDB_PROFILE env var or the --profile flag of the ingest and ETL entry points; profiles are applied on top
+# of 'default', and None keeps DuckDB's own default (all cores, 80% of the RAM). With a memory_limit and a
+# temp_directory, DuckDB spills joins, aggregations and sorts to disk, so inputs larger than RAM still complete.
+DUCKDB_PROFILE = os.getenv('DUCKDB_PROFILE', 'default')
+DUCKDB_PROFILES = {
+    'default': {
+        'threads': None,
+        'memory_limit': None,
+        'temp_directory': os.path.join(DATALAKE_DIR, '.tmp'),
+        'max_temp_directory_size': None,
+        'preserve_insertion_order': True,
+        'enable_object_cache': False,  # Cache Parquet metadata across the queries reading a file
+    },
+    # Shared 8 GB workers: leave cores and memory to the other jobs
+    'shared': {
+        'threads': 4,
+        'memory_limit': '3GB',
+        'preserve_insertion_order': False,
+        'enable_object_cache': True,
+    },
+    # Small memory budget, e.g. to check that a dataset larger than the memory limit still completes
+    'constrained': {
+        'threads': 2,
+        'memory_limit': '256MB',
+        'preserve_insertion_order': False,
+        'enable_object_cache': True,
+    },
+}
+
+# Local Parquet files of a pipelined ingest and ETL run (`just pipeline`), read by the ETL instead of
+# their S3 copies and removed at the end of the run
+PIPELINED_SPOOL_DIR = os.getenv('PIPELINED_SPOOL_DIR', os.path.join(DATALAKE_DIR, '.tmp', 'pipelined'))
+
+# Sharded ETL (`just etl-sharded`): each source is split into ETL_SHARDS slices by hash of ETL_SHARD_KEY, processed
+# by ETL_SHARD_WORKERS processes (or by several machines sharing the output directory) that each write their slice
+# of the partitioned master; a commit step then publishes the slices as a snapshot (see MASTER_PUBLISH). The shard key must be a
+# column of the master key ('indicator_id' or 'country_id'), so that duplicate keys never span two shards. The workers
+# share the threads and memory limit of the DuckDB runtime profile.
+ETL_SHARDS = int(os.getenv('ETL_SHARDS', 4))
+ETL_SHARD_KEY = os.getenv('ETL_SHARD_KEY', 'indicator_id')
+ETL_SHARD_WORKERS = int(os.getenv('ETL_SHARD_WORKERS', os.cpu_count() or 1))
+
+# Compaction (`just compact`): the files of each partition of a partitioned master dataset are merged into files of
+# about COMPACT_TARGET_FILE_MB when the partition has more files than its size needs, and landing files are rewritten
+# once per ingested version with their ingest profile's row groups, sorted by the columns holding the master key
+COMPACT_TARGET_FILE_MB = float(os.getenv('COMPACT_TARGET_FILE_MB', 256))
+
+# Publishing of the master outputs in S3: 'snapshot' writes the files of every run under master/snapshots/<snapshot id>/,
+# then publishes them at once by replacing the small pointer master/_current.json, which names the snapshot's manifest
+# (master/_snapshots/<snapshot id>.json: files, row counts and column statistics). The last MASTER_SNAPSHOT_RETENTION
+# snapshots stay readable. 'overwrite' writes the outputs in place (master/master.parquet), as readers of fixed keys expect.
+MASTER_PUBLISH = os.getenv('MASTER_PUBLISH', 'snapshot')
+MASTER_SNAPSHOT_RETENTION = int(os.getenv('MASTER_SNAPSHOT_RETENTION', 10))
+MASTER_SNAPSHOT_DIR = 'snapshots'
+MASTER_SNAPSHOT_MANIFEST_DIR = '_snapshots'
+MASTER_SNAPSHOT_POINTER = '_current.json'
+
+# Query service (pipeline.query): lookups of the current master snapshot on a local read-only DuckDB replica, sorted
+# by MASTER_SORT_BY, through a pool of QUERY_POOL_SIZE cursors. The pointer is checked at most every
+# QUERY_REFRESH_SECONDS; a new snapshot builds a new replica in the background, then swaps it in and clears the
+# LRU cache of results (QUERY_CACHE_MB, results over QUERY_CACHE_MAX_ROWS rows are not cached). A lookup waits up
+# to QUERY_POOL_TIMEOUT_SECONDS for a free cursor; streams hold theirs until they are consumed or deleted.
+QUERY_DB_DIR = os.getenv('QUERY_DB_DIR', os.path.join(DATALAKE_DIR, '.tmp', 'query'))
+QUERY_POOL_SIZE = int(os.getenv('QUERY_POOL_SIZE', 8))
+QUERY_POOL_TIMEOUT_SECONDS = float(os.getenv('QUERY_POOL_TIMEOUT_SECONDS', 30))
+QUERY_REFRESH_SECONDS = float(os.getenv('QUERY_REFRESH_SECONDS', 5))
+QUERY_CACHE_MB = float(os.getenv('QUERY_CACHE_MB', 256))
+QUERY_CACHE_MAX_ROWS = int(os.getenv('QUERY_CACHE_MAX_ROWS', 100000))
+QUERY_BATCH_ROWS = 65536  # Rows per Arrow record batch of streamed results
 
 # Local copy of master data
 LOCAL=True
+
+# Run report: per-stage and per-source metrics of each ingest and ETL run, written as JSON
+# to datalake/staging/reports/ and uploaded to the staging area in S3
+RUN_REPORT = os.getenv('RUN_REPORT', 'true').lower() == 'true'
+RUN_REPORT_DIR = os.path.join(STAGING_DATA_DIR, 'reports')
+RUN_REPORT_S3_PREFIX = f'{STAGING_AREA_PATH}/reports'
+# Embed DuckDB's JSON profile of the main query of each source, file and sink in the run report
+QUERY_PROFILING = os.getenv('QUERY_PROFILING', 'true').lower() == 'true'
+
+# Layout of the master output: 'single' writes one master.parquet file, 'partitioned' writes a
+# hive-partitioned dataset (master/database=<db>/year_bucket=<year>/) with rows sorted inside each file
+MASTER_LAYOUT = os.getenv('MASTER_LAYOUT', 'single')
+MASTER_PARTITION_BY = ('database', 'year_bucket')
+MASTER_SORT_BY = ('indicator_id', 'country_id', 'year')
+MASTER_YEAR_BUCKET = 10  # Years per year_bucket partition (1 partitions by year)
+MASTER_ROW_GROUP_SIZE = 61440  # Small enough for row group min/max statistics to prune on sorted keys
+
+# Data model of the master outputs: 'wide' writes the master table as is; 'star' writes an indicator dimension
+# (dim_indicator), a country dimension (dim_country) and a fact table with integer keys and a database ENUM
+# (fact_master), with a `master` view of the wide shape in staging.db. MASTER_VALUE_TYPE 'float32' halves the
+# size of the fact table's values, at the cost of precision beyond about 7 significant digits.
+MASTER_MODEL = os.getenv('MASTER_MODEL', 'wide')
+MASTER_VALUE_TYPE = os.getenv('MASTER_VALUE_TYPE', 'float64')
+
+# Persistence of the master table in staging.db: 'upsert' keeps a table with primary key MASTER_PRIMARY_KEY
+# and only rewrites the rows of the rebuilt sources (INSERT OR REPLACE), failing on rows with a missing or
+# duplicate key; 'replace' rewrites the whole table every run.
+# MASTER_DB_INDEXES are the columns indexed for point lookups, besides the primary key.
+MASTER_DB_MODE = os.getenv('MASTER_DB_MODE', 'upsert')
+MASTER_PRIMARY_KEY = ('database', 'indicator_id', 'country_id', 'year')
+MASTER_DB_INDEXES = ('indicator_id', 'country_id')
+
+# Incremental ETL: only rebuild the master table sources whose landing files or transform code changed.
+# Changed sources replace just their database= partitions when MASTER_LAYOUT is 'partitioned'.
+ETL_INCREMENTAL = os.getenv('ETL_INCREMENTAL', 'false').lower() == 'true'
+ETL_STATE_PATH = os.path.join(STAGING_DATA_DIR, 'etl_state.json')
+
+# Data-quality gate between transform and load: the rules are checked for every source (database) of the
+# master table in one aggregated scan. QUALITY_RULES holds per-source thresholds applied on top of 'default'.
+# Rates are fractions of the source's rows; None disables a bound. A source breaking a rule is handled by its
+# 'action': 'fail' stops the run, 'quarantine' writes its rows to QUALITY_QUARANTINE_DIR and leaves it out of
+# the outputs, 'warn' (the default) only logs the violation. Any rule can be overridden for a source with a
+# QUALITY_<SOURCE>_<RULE> env var, or for every source with QUALITY_DEFAULT_<RULE> (e.g. QUALITY_WDI_ACTION=fail,
+# QUALITY_DEFAULT_MAX_NULL_VALUE_RATE=0.1, or 'none' to disable a bound).
+QUALITY_GATE = os.getenv('QUALITY_GATE', 'true').lower() == 'true'
+QUALITY_QUARANTINE_DIR = os.path.join(STAGING_DATA_DIR, 'quarantine')
+QUALITY_RULES = {
+    'default': {
+        'action': 'warn',
+        'max_duplicate_key_rate': 0.0,  # Rows repeating a (database, indicator_id, country_id, year) key
+        'max_null_key_rate': 0.0,  # Rows with a null indicator_id, country_id or year
+        'max_null_value_rate': 0.05,
+        'max_non_finite_value_rate': 0.0,  # NaN and infinite values
+        'max_label_miss_rate': 0.05,  # Rows whose indicator found no label in the left join
+        'year_min': 1900,
+        'year_max': 2100,
+        'max_year_out_of_range_rate': 0.0,
+        'value_min': None,
+        'value_max': None,
+        'max_value_out_of_bounds_rate': 0.0,
+    },
+}
+
+# Number of master table sources processed at the same time
+TRANSFORM_MAX_WORKERS = int(os.getenv('TRANSFORM_MAX_WORKERS', 4))
+
+# Only extract the landing tables (and columns) used by the master table
+LAZY_EXTRACT = os.getenv('LAZY_EXTRACT', 'true').lower() == 'true'
+
+# Ingest concurrency (number of CSV files converted and uploaded at the same time)
+INGEST_MAX_WORKERS = int(os.getenv('INGEST_MAX_WORKERS', 4))
+
+# Incremental ingest: only convert raw files that are new or changed since the last run
+INGEST_INCREMENTAL = os.getenv('INGEST_INCREMENTAL', 'true').lower() == 'true'
+INGEST_MANIFEST_PATH = os.path.join(DATALAKE_DIR, 'ingest_manifest.json')
+INGEST_MANIFEST_S3_KEY = f'{LANDING_AREA_FOLDER}/_ingest_manifest.json'
+INGEST_SCHEMA_CACHE_PATH = os.path.join(DATALAKE_DIR, 'ingest_schemas.json')
+
+# Ingest conversion profiles by raw data subfolder, applied on top of the 'default' profile.
+# Profiles may override the DuckDB database settings of the runtime profile (memory_limit, temp_directory,
+# preserve_insertion_order...), so sources with different values are converted on separate DuckDB databases.
+# The remaining keys are Parquet writer options: row_group_size (rows), compression ('zstd', 'snappy', ...)
+# and compression_level (zstd only).
+INGEST_PROFILES = {
+    'default': {
+        # The other database settings come from the DuckDB runtime profile (DUCKDB_PROFILES)
+        'preserve_insertion_order': False,
+        'row_group_size': 122880,
+        'compression': 'zstd',
+        'compression_level': 3,
+    },
+    'wdi': {
+        # Very wide input (60+ year columns): smaller row groups keep the writer's buffers small
+        'memory_limit': '1GB',
+        'row_group_size': 30720,
+    },
+}
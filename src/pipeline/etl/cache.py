@@ -0,0 +1,165 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+from pipeline.utils import setup_logger, s3_init
+import pipeline.config as config
+
+# Set up logging
+logger = setup_logger(__name__)
+
+# Bytes read at once from the S3 response body when a file is cached
+DOWNLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+
+class LandingCache:
+    """
+    Local read-through cache of landing files, so DuckDB reads unchanged files from local disk instead of S3.
+
+    Files are cached whole, under a name made of their S3 path and ETag: a file whose ETag changed is
+    downloaded again and never served stale. The least recently used files are evicted to keep the cache
+    under its size cap; files served during the current run are never evicted, as DuckDB views read them.
+    """
+
+    def __init__(self, cache_dir: str = None, max_bytes: int = None) -> None:
+        """
+        Initialize the cache.
+
+        :param cache_dir: Directory holding the cached files (defaults to config.LANDING_CACHE_DIR).
+        :param max_bytes: Size cap of the cache in bytes (defaults to config.LANDING_CACHE_MAX_GB).
+        """
+        self.cache_dir = cache_dir or config.LANDING_CACHE_DIR
+        self.max_bytes = max_bytes if max_bytes is not None else int(config.LANDING_CACHE_MAX_GB * 1024 ** 3)
+        self.index_path = os.path.join(self.cache_dir, 'index.json')
+        self.entries = {}
+        self.pinned = set()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "bytes_downloaded": 0, "bytes_served": 0}
+        self.load()
+
+    def load(self) -> None:
+        """
+        Load the cache index, dropping the entries whose file is missing.
+        """
+        try:
+            if os.path.isfile(self.index_path):
+                with open(self.index_path) as f:
+                    entries = json.load(f)
+                self.entries = {
+                    path: entry for path, entry in entries.items()
+                    if os.path.isfile(os.path.join(self.cache_dir, entry["file"]))
+                }
+
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable landing cache index {self.index_path}: {e}")
+            self.entries = {}
+
+    def save(self) -> None:
+        """
+        Evict the files over the size cap that were not served in this run, and write the cache index to disk.
+        """
+        self.evict(0)
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp_path = f'{self.index_path}.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(self.entries, f, indent=2, sort_keys=True)
+            os.replace(tmp_path, self.index_path)
+
+        except Exception as e:
+            logger.error(f"Error saving landing cache index: {e}", exc_info=True)
+            raise
+
+    def size(self) -> int:
+        """Total size of the cached files, in bytes."""
+        return sum(entry["size"] for entry in self.entries.values())
+
+    def evict(self, needed: int) -> bool:
+        """
+        Evict the least recently used files not served in this run until `needed` more bytes fit under the cap.
+
+        :param needed: Number of bytes to make room for.
+        :return: Whether enough room could be made.
+        """
+        candidates = sorted(
+            (entry["last_access"], path) for path, entry in self.entries.items() if path not in self.pinned
+        )
+        total = self.size()
+        for _, path in candidates:
+            if total + needed <= self.max_bytes:
+                break
+            entry = self.entries.pop(path)
+            try:
+                os.remove(os.path.join(self.cache_dir, entry["file"]))
+            except FileNotFoundError:
+                pass
+            total -= entry["size"]
+            self.stats["evictions"] += 1
+            logger.info(f"Evicted {path} from the landing cache")
+
+        return total + needed <= self.max_bytes
+
+    def get(self, s3_path: str, etag: str, size: int) -> str:
+        """
+        Return a local path holding the current version of a landing file, downloading it on a miss.
+
+        :param s3_path: The full S3 path of the file.
+        :param etag: The file's current ETag (e.g. from the landing index).
+        :param size: The file's size in bytes.
+        :return: Local path of the cached file, or the S3 path if the file does not fit in the cache.
+        """
+        entry = self.entries.get(s3_path)
+        if entry is not None and entry["etag"] == etag:
+            entry["last_access"] = time.time()
+            self.pinned.add(s3_path)
+            self.stats["hits"] += 1
+            self.stats["bytes_served"] += entry["size"]
+            return os.path.join(self.cache_dir, entry["file"])
+
+        self.stats["misses"] += 1
+        if entry is not None:
+            # Stale version: the file changed in S3
+            self.entries.pop(s3_path)
+            try:
+                os.remove(os.path.join(self.cache_dir, entry["file"]))
+            except FileNotFoundError:
+                pass
+
+        if not self.evict(size):
+            logger.warning(f"{s3_path} ({size} bytes) does not fit in the landing cache, reading it from S3")
+            return s3_path
+
+        bucket, key = s3_path.replace('s3://', '', 1).split('/', 1)
+        file_name = f"{hashlib.sha256(s3_path.encode('utf-8')).hexdigest()[:16]}-{etag}{os.path.splitext(key)[1]}"
+        local_path = os.path.join(self.cache_dir, file_name)
+        tmp_path = f'{local_path}.part'
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        try:
+            # IfMatch fails the read if the object changed since it was listed (download_file does not accept it)
+            body = s3_init().get_object(Bucket=bucket, Key=key, IfMatch=etag)['Body']
+            with open(tmp_path, 'wb') as f:
+                shutil.copyfileobj(body, f, DOWNLOAD_CHUNK_SIZE)
+            os.replace(tmp_path, local_path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        self.entries[s3_path] = {"etag": etag, "size": size, "file": file_name, "last_access": time.time()}
+        self.pinned.add(s3_path)
+        self.stats["bytes_downloaded"] += size
+        self.stats["bytes_served"] += size
+        logger.info(f"Cached {s3_path} in {local_path}")
+        return local_path
+
+    def log_stats(self) -> None:
+        """
+        Log the hit and miss statistics of the cache.
+        """
+        lookups = self.stats["hits"] + self.stats["misses"]
+        hit_rate = self.stats["hits"] / lookups if lookups else 0.0
+        logger.info(
+            f"Landing cache: {self.stats['hits']} hits, {self.stats['misses']} misses ({hit_rate:.0%} hit rate), "
+            f"{self.stats['evictions']} evictions, {self.stats['bytes_downloaded'] / 1024 ** 2:.1f} MB downloaded, "
+            f"{self.size() / 1024 ** 2:.1f} MB cached"
+        )
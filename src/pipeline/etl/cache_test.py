@@ -0,0 +1,37 @@
+import os
+import pytest
+from botocore.exceptions import ClientError
+from pipeline.bench.local_s3 import local_s3
+from pipeline.etl.cache import LandingCache
+
+def put(client, key: str, body: bytes) -> str:
+    return client.put_object(Bucket='bucket', Key=key, Body=body)['ETag'].strip('"')
+
+def test_download_file_rejects_arguments_s3transfer_rejects(tmp_path):
+    with local_s3(str(tmp_path / 's3')) as client:
+        put(client, 'landing/a.parquet', b'a')
+        with pytest.raises(ValueError, match="Invalid extra_args key 'IfMatch'"):
+            client.download_file('bucket', 'landing/a.parquet', str(tmp_path / 'a'), ExtraArgs={'IfMatch': 'x'})
+
+def test_miss_stores_the_file_and_hit_serves_it(tmp_path):
+    with local_s3(str(tmp_path / 's3')) as client:
+        etag = put(client, 'landing/a.parquet', b'version 1')
+        cache = LandingCache(str(tmp_path / 'cache'), max_bytes=1024)
+
+        path = cache.get('s3://bucket/landing/a.parquet', etag, 9)
+        assert path.startswith(str(tmp_path / 'cache'))
+        with open(path, 'rb') as f:
+            assert f.read() == b'version 1'
+        assert cache.get('s3://bucket/landing/a.parquet', etag, 9) == path
+        assert (cache.stats['hits'], cache.stats['misses']) == (1, 1)
+
+def test_changed_object_is_not_cached_under_the_listed_etag(tmp_path):
+    with local_s3(str(tmp_path / 's3')) as client:
+        etag = put(client, 'landing/a.parquet', b'version 1')
+        put(client, 'landing/a.parquet', b'version 2')
+        cache = LandingCache(str(tmp_path / 'cache'), max_bytes=1024)
+
+        with pytest.raises(ClientError, match='PreconditionFailed'):
+            cache.get('s3://bucket/landing/a.parquet', etag, 9)
+        assert cache.entries == {}
+        assert [name for name in os.listdir(tmp_path / 'cache') if name.endswith('.part')] == []
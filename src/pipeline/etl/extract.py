@@ -1,55 +1,125 @@
 import ibis
-import ibis.selectors as s
-import fsspec
-from datetime import datetime, timezone
-from pipeline.utils import setup_logger, s3_init, get_s3_file_paths
-from pipeline.config import S3_BUCKET_NAME, LANDING_AREA_FOLDER
+from pipeline.utils import setup_logger, s3_filesystem, snake_case, landing_table_name
+from pipeline.etl.listing import LandingIndex
+from pipeline.etl.cache import LandingCache
+from pipeline.config import LANDING_CACHE
 
 # Set up logger
 logger = setup_logger(__name__)
 
-# Init the s3 client
-s3_client = s3_init()
-
-# set extracted_at timestamp
-time_now = datetime.now(timezone.utc)
-
 class DataLoader:
-    def __init__(self, connection) -> None:
+    def __init__(self, connection, index: LandingIndex = None, cache: bool = None) -> None:
         # Connect to DuckDB
         self.con = connection
 
-        # Register the S3 filesystem with DuckDB
-        self.s3 = fsspec.filesystem('s3')
+        # Register the shared S3 filesystem with DuckDB
+        self.s3 = s3_filesystem()
         self.con.register_filesystem(self.s3)
 
-        # Get file paths from S3
-        self.file_paths = get_s3_file_paths(S3_BUCKET_NAME, prefix=LANDING_AREA_FOLDER)
+        # Get file paths and object metadata from the landing index, refreshed from S3 unless one is given
+        # (e.g. by a sharded run, whose worker processes share the listing of their coordinator)
+        self.index = index or LandingIndex().refresh()
+        self.file_metadata = self.index.file_metadata()
+        self.file_paths = {
+            source: {name: metadata["path"] for name, metadata in files.items()}
+            for source, files in self.file_metadata.items()
+        }
+
+        # Optional local copy of the landing files, validated by ETag (defaults to config.LANDING_CACHE)
+        self.cache = LandingCache() if (LANDING_CACHE if cache is None else cache) else None
+
+    def modified_since(self, since) -> list:
+        """
+        Return the sources with a landing file modified after a point in time, from the landing index.
+
+        :param since: Timezone-aware datetime (e.g. the start of the last run).
+        :return: Sorted source folder paths.
+        """
+        return self.index.modified_since(since)
+
+    def open_table(self, table_name: str, path: str, columns: list = None) -> ibis.Expr:
+        """
+        Register a Parquet file as a DuckDB view, optionally projected to a subset of its columns.
+
+        The view is only bound to the file's footer: data is read when a query runs, and DuckDB pushes
+        the query's filters down to the Parquet scan so row groups are pruned using their statistics.
+
+        :param table_name: Name of the view to create.
+        :param path: Path of the Parquet file.
+        :param columns: snake_case names of the columns to keep (if None, all columns are kept).
+        :return: Ibis table expression over the view.
+        """
+        projection = "*"
+        if columns is not None:
+            schema = self.con.raw_sql(f"DESCRIBE SELECT * FROM read_parquet('{path}')").fetchall()
+            wanted = set(columns)
+            selected = [row[0] for row in schema if snake_case(row[0]) in wanted]
+            if not selected:
+                raise ValueError(f"None of the columns {columns} found in {path}")
+            projection = ", ".join(f'"{column}"' for column in selected)
+
+        self.con.raw_sql(f"CREATE OR REPLACE VIEW \"{table_name}\" AS SELECT {projection} FROM read_parquet('{path}')")
+        return self.con.table(table_name)
+
+    def read_path(self, metadata: dict) -> str:
+        """
+        Return the path DuckDB should read a landing file from: its local cached copy if the cache is on, else its S3 path.
+
+        :param metadata: The file's metadata in `file_metadata`.
+        :return: Local or S3 path of the file.
+        """
+        if self.cache is None:
+            return metadata["path"]
+
+        try:
+            return self.cache.get(metadata["path"], metadata["etag"], metadata["size"])
+        except Exception as e:
+            logger.warning(f"Reading {metadata['path']} from S3, as it could not be cached: {e}")
+            return metadata["path"]
 
-    def load_data(self) -> dict:
+    def load_data(self, tables: dict = None) -> dict:
         """
         Extract data from all sources found in S3 landing folder and load them into an ibis DuckDB backend.
 
+        In lazy mode (when `tables` is given) only the listed tables are registered, projected to the
+        columns their processor needs; the other landing files are recorded as deferred and never opened.
+
+        :param tables: Mapping of table names (`<source>_<file>`) to the snake_case columns to read, or None to read all columns.
+                       If None, every landing file is registered with all its columns.
         :return: Dictionary with metadata and any errors encountered during the process.
         """
         result = {}
-        for source, files in self.file_paths.items():
+        for source, files in self.file_metadata.items():
             result[source] = {}
-            for name, path in files.items():
+            for name, metadata in files.items():
+                path = metadata["path"]
+                table_name = landing_table_name(source, name)
+
+                if tables is not None and table_name not in tables:
+                    logger.info(f"Deferring unused file: {source}/{name}")
+                    result[source][name] = {
+                        "deferred": True,
+                        "description": f"Dataset: {source}, File: {name}",
+                        "source_path": path,
+                        "last_updated": metadata["last_modified"]
+                    }
+                    continue
+
                 try:
                     logger.info(f"Processing file: {source}/{name}")
 
-                    # Load the Parquet data from S3 into DuckDB ibis backend
-                    data = (
-                        self.con
-                        .read_parquet(path, table_name=f"{source}_{name}")
+                    # Register the Parquet data from S3 (or its cached copy) as a view in the DuckDB ibis backend
+                    data = self.open_table(
+                        table_name,
+                        self.read_path(metadata),
+                        columns=tables.get(table_name) if tables is not None else None
                     )
 
                     result[source][name] = {
                         "data": data,
                         "description": f"Dataset: {source}, File: {name}",
                         "source_path": path,
-                        "last_updated": time_now
+                        "last_updated": metadata["last_modified"]
                     }
 
                     logger.info(f"Successfully processed file: {source}/{name}")
@@ -61,9 +131,13 @@ class DataLoader:
                     result[source][name] = {
                         "error": str(e),
                         "source_path": path,
-                        "last_updated": time_now
+                        "last_updated": metadata["last_modified"]
                     }
 
+        if self.cache is not None:
+            self.cache.save()
+            self.cache.log_stats()
+
         # List all tables after loading
         tables = self.con.list_tables()
         logger.info(f"Tables loaded into DuckDB: {tables}")
@@ -0,0 +1,48 @@
+import ibis
+import pytest
+import pandas as pd
+from pipeline.etl.extract import DataLoader
+
+def landing_file(tmp_path, name: str) -> dict:
+    path = str(tmp_path / f'{name}.parquet')
+    pd.DataFrame({'Country Code': ['KEN', 'NGA'], 'Indicator Code': ['A', 'B'], '2001': [1.0, 2.0], 'Notes': ['x', 'y']}).to_parquet(path)
+    return {'path': path, 'last_modified': '2026-01-01T00:00:00+00:00'}
+
+def loader(tmp_path, names: list) -> DataLoader:
+    # Landing files read from local paths, without listing S3
+    data_loader = DataLoader.__new__(DataLoader)
+    data_loader.con = ibis.duckdb.connect()
+    data_loader.file_metadata = {'wdi': {name: landing_file(tmp_path, name) for name in names}}
+    data_loader.cache = None
+    return data_loader
+
+def test_only_the_columns_used_are_registered(tmp_path):
+    data_loader = loader(tmp_path, ['WDICSV'])
+
+    table = data_loader.open_table('wdi_WDICSV', data_loader.file_metadata['wdi']['WDICSV']['path'], ['country_code', '2001'])
+
+    assert list(table.columns) == ['Country Code', '2001']
+    assert table.count().execute() == 2
+
+def test_missing_columns_raise(tmp_path):
+    data_loader = loader(tmp_path, ['WDICSV'])
+
+    with pytest.raises(ValueError):
+        data_loader.open_table('wdi_WDICSV', data_loader.file_metadata['wdi']['WDICSV']['path'], ['indicator_name'])
+
+def test_unused_files_are_deferred(tmp_path):
+    data_loader = loader(tmp_path, ['WDICSV', 'WDISeries'])
+
+    result = data_loader.load_data({'wdi_WDICSV': ['country_code', 'indicator_code']})
+
+    assert result['wdi']['WDISeries']['deferred']
+    assert list(result['wdi']['WDICSV']['data'].columns) == ['Country Code', 'Indicator Code']
+    assert data_loader.con.list_tables() == ['wdi_WDICSV']
+
+def test_all_files_and_columns_are_registered_without_tables(tmp_path):
+    data_loader = loader(tmp_path, ['WDICSV', 'WDISeries'])
+
+    result = data_loader.load_data()
+
+    assert list(result['wdi']['WDISeries']['data'].columns) == ['Country Code', 'Indicator Code', '2001', 'Notes']
+    assert sorted(data_loader.con.list_tables()) == ['wdi_WDICSV', 'wdi_WDISeries']
@@ -0,0 +1,180 @@
+import os
+import json
+import time
+import datetime
+from pipeline.utils import setup_logger, s3_init, list_s3_objects, group_file_metadata
+import pipeline.config as config
+
+# Set up logging
+logger = setup_logger(__name__)
+
+class LandingIndex:
+    """
+    Persisted listing of the landing area: the key, size, ETag and last modified time of every object.
+
+    Refreshing it lists the whole landing area, since the ingest replaces files in place and deletes them: a
+    StartAfter listing only sees keys sorting after the listed ones. With config.LANDING_APPEND_ONLY, the
+    landing keys are guaranteed to only be added, each sorting after the other keys of its folder (e.g.
+    date-stamped file names), and never replaced or deleted. Refreshing then lists only the keys after the last
+    indexed one of each folder (S3's StartAfter), unless the ingest manifest changed since the last listing or
+    the index is older than config.LANDING_INDEX_MAX_AGE; new folders are only picked up by a full listing.
+    """
+
+    def __init__(self, bucket_name: str = None, prefix: str = None, local_path: str = None) -> None:
+        """
+        Initialize the landing index.
+
+        :param bucket_name: The name of the S3 bucket (defaults to config.S3_BUCKET_NAME).
+        :param prefix: The landing folder prefix (defaults to config.LANDING_AREA_FOLDER).
+        :param local_path: Local path of the index file (defaults to config.LANDING_INDEX_PATH).
+        """
+        self.bucket_name = bucket_name or config.S3_BUCKET_NAME
+        self.prefix = prefix or config.LANDING_AREA_FOLDER
+        self.local_path = local_path or config.LANDING_INDEX_PATH
+        self.objects = {}
+        self.listed_at = None
+        self.manifest_etag = None
+
+    def load(self) -> None:
+        """
+        Load the index from disk, ignoring it if it is unreadable or was built for another bucket or prefix.
+        """
+        try:
+            if os.path.isfile(self.local_path):
+                with open(self.local_path) as f:
+                    index = json.load(f)
+                if (index["bucket"], index["prefix"]) == (self.bucket_name, self.prefix):
+                    self.objects = index["objects"]
+                    self.listed_at = index["listed_at"]
+                    self.manifest_etag = index["manifest_etag"]
+                    logger.info(f"Loaded landing index of {len(self.objects)} objects from {self.local_path}")
+
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable landing index {self.local_path}: {e}")
+            self.objects = {}
+
+    def save(self) -> None:
+        """
+        Write the index to disk.
+        """
+        try:
+            os.makedirs(os.path.dirname(self.local_path), exist_ok=True)
+            tmp_path = f'{self.local_path}.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump({
+                    "bucket": self.bucket_name,
+                    "prefix": self.prefix,
+                    "listed_at": self.listed_at,
+                    "manifest_etag": self.manifest_etag,
+                    "objects": self.objects,
+                }, f, sort_keys=True)
+            os.replace(tmp_path, self.local_path)
+
+        except Exception as e:
+            logger.error(f"Error saving landing index: {e}", exc_info=True)
+            raise
+
+    def get_manifest_etag(self) -> str:
+        """
+        Get the ETag of the ingest manifest in S3.
+
+        :return: The ETag, or None if the manifest does not exist.
+        """
+        try:
+            return s3_init().head_object(Bucket=self.bucket_name, Key=config.INGEST_MANIFEST_S3_KEY)['ETag'].strip('"')
+        except Exception:
+            return None
+
+    def list(self, folder: str = None, start_after: str = None) -> dict:
+        """
+        List the landing objects, optionally only those of a folder and after a key.
+
+        :param folder: Only list the keys under this folder (defaults to the whole landing area).
+        :param start_after: Only list the keys after this one.
+        :return: Dictionary of object metadata (size, ETag and ISO last modified time) by key.
+        """
+        return {
+            obj["key"]: {"size": obj["size"], "etag": obj["etag"], "last_modified": obj["last_modified"].isoformat()}
+            for obj in list_s3_objects(s3_init(), self.bucket_name, f'{folder or self.prefix}/', start_after=start_after)
+        }
+
+    def list_new(self) -> dict:
+        """
+        List the keys added after the last indexed key of each folder, for append-only landing areas.
+
+        :return: Dictionary of object metadata by key.
+        """
+        last_keys = {}
+        for key in self.objects:
+            folder = key.rpartition('/')[0]
+            last_keys[folder] = max(last_keys.get(folder, key), key)
+        new_objects = {}
+        for folder, last_key in last_keys.items():
+            # The listing of a folder also holds its subfolders, which are listed on their own
+            new_objects.update(
+                (key, metadata) for key, metadata in self.list(folder=folder, start_after=last_key).items()
+                if key.rpartition('/')[0] == folder
+            )
+        return new_objects
+
+    def refresh(self, full: bool = None) -> 'LandingIndex':
+        """
+        Bring the index up to date with the landing area, and save it.
+
+        :param full: Force (True) or prevent (False) a full listing; by default a full listing runs unless the
+                     landing area is append-only, the index exists and is recent, and the ingest manifest is unchanged.
+        :return: The index itself.
+        """
+        try:
+            self.load()
+            manifest_etag = self.get_manifest_etag()
+
+            if full is None:
+                age = time.time() - datetime.datetime.fromisoformat(self.listed_at).timestamp() if self.listed_at else None
+                full = (
+                    not config.LANDING_APPEND_ONLY or age is None or age > config.LANDING_INDEX_MAX_AGE
+                    or manifest_etag != self.manifest_etag
+                )
+
+            listed_at = datetime.datetime.now(datetime.timezone.utc).isoformat()
+            if full:
+                self.objects = self.list()
+                logger.info(f"Listed {len(self.objects)} landing objects")
+            else:
+                new_objects = self.list_new()
+                self.objects.update(new_objects)
+                logger.info(f"Listed {len(new_objects)} new landing objects")
+
+            self.listed_at = listed_at
+            self.manifest_etag = manifest_etag
+            self.save()
+            return self
+
+        except Exception as e:
+            logger.error(f"Error refreshing landing index: {e}")
+            raise
+
+    def file_metadata(self) -> dict:
+        """
+        Return the indexed landing files by source folder and file name, as `get_s3_file_metadata` does.
+
+        :return: Dictionary of file metadata (path, size, ETag and last modified time) organized by source folder.
+        """
+        objects = (
+            {"key": key, **metadata, "last_modified": datetime.datetime.fromisoformat(metadata["last_modified"])}
+            for key, metadata in self.objects.items()
+        )
+        return group_file_metadata(self.bucket_name, self.prefix, objects)
+
+    def modified_since(self, since: datetime.datetime) -> list:
+        """
+        Return the sources with a file modified after a point in time.
+
+        :param since: Timezone-aware point in time (e.g. the start of the last run).
+        :return: Sorted source folder paths.
+        """
+        return sorted({
+            source
+            for source, files in self.file_metadata().items()
+            if any(metadata["last_modified"] > since for metadata in files.values())
+        })
@@ -0,0 +1,56 @@
+import pipeline.config as config
+from pipeline.bench.local_s3 import local_s3
+from pipeline.etl.listing import LandingIndex
+
+def put(client, key: str, body: bytes) -> str:
+    return client.put_object(Bucket='bucket', Key=key, Body=body)['ETag'].strip('"')
+
+def landing_index(tmp_path) -> LandingIndex:
+    return LandingIndex('bucket', 'landing', str(tmp_path / 'index.json'))
+
+def test_refresh_lists_replaced_deleted_and_earlier_keys(tmp_path):
+    with local_s3(str(tmp_path / 's3')) as client:
+        put(client, 'landing/wdi/b.parquet', b'b')
+        put(client, 'landing/wdi/c.parquet', b'c')
+        landing_index(tmp_path).refresh()
+
+        etag = put(client, 'landing/wdi/b.parquet', b'b, replaced')
+        client.delete_object(Bucket='bucket', Key='landing/wdi/c.parquet')
+        put(client, 'landing/wdi/a.parquet', b'a')
+        index = landing_index(tmp_path).refresh()
+
+        assert sorted(index.objects) == ['landing/wdi/a.parquet', 'landing/wdi/b.parquet']
+        assert index.objects['landing/wdi/b.parquet']['etag'] == etag
+
+def test_append_only_refresh_lists_the_keys_after_each_folder(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'LANDING_APPEND_ONLY', True)
+    with local_s3(str(tmp_path / 's3')) as client:
+        put(client, 'landing/wdi/2026-01.parquet', b'wdi')
+        put(client, 'landing/edu/sdg/2026-01.parquet', b'sdg')
+        landing_index(tmp_path).refresh()
+
+        put(client, 'landing/wdi/2026-02.parquet', b'wdi')
+        put(client, 'landing/edu/sdg/2026-02.parquet', b'sdg')
+        put(client, 'landing/opri/2026-01.parquet', b'opri')
+        index = landing_index(tmp_path).refresh()
+
+        # A new folder is only picked up by a full listing
+        assert sorted(index.objects) == [
+            'landing/edu/sdg/2026-01.parquet', 'landing/edu/sdg/2026-02.parquet',
+            'landing/wdi/2026-01.parquet', 'landing/wdi/2026-02.parquet'
+        ]
+        assert 'landing/opri/2026-01.parquet' in landing_index(tmp_path).refresh(full=True).objects
+
+def test_append_only_refresh_is_full_when_the_ingest_manifest_changed(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'LANDING_APPEND_ONLY', True)
+    with local_s3(str(tmp_path / 's3')) as client:
+        put(client, 'landing/wdi/b.parquet', b'b')
+        landing_index(tmp_path).refresh()
+
+        put(client, 'landing/wdi/a.parquet', b'a')
+        put(client, config.INGEST_MANIFEST_S3_KEY, b'{}')
+        client.delete_object(Bucket='bucket', Key='landing/wdi/b.parquet')
+
+        index = landing_index(tmp_path).refresh()
+
+        assert [key for key in index.objects if key.startswith('landing/wdi/')] == ['landing/wdi/a.parquet']
@@ -0,0 +1,222 @@
+import os
+import ibis
+from pipeline.utils import setup_logger
+import pipeline.config as config
+
+# Set up logging
+logger = setup_logger(__name__)
+
+# Columns of the master table's key, besides database
+KEY_COLUMNS = ('indicator_id', 'country_id', 'year')
+
+# Rates checked against the 'max_<rate>' thresholds of the rules, and the counts they are computed from
+RATES = {
+    'duplicate_key_rate': 'duplicate_keys',
+    'null_key_rate': 'null_keys',
+    'null_value_rate': 'null_values',
+    'non_finite_value_rate': 'non_finite_values',
+    'label_miss_rate': 'label_misses',
+    'year_out_of_range_rate': 'years_out_of_range',
+    'value_out_of_bounds_rate': 'values_out_of_bounds',
+}
+
+def rule_overrides(name: str, rules: dict) -> dict:
+    """
+    Read the overrides of the rules of a source (or of 'default') from QUALITY_<NAME>_<RULE> env vars,
+    e.g. QUALITY_WDI_MAX_NULL_VALUE_RATE=0.1 or QUALITY_DEFAULT_ACTION=fail. 'none' disables a bound.
+
+    :param name: The source's database value, or 'default'.
+    :param rules: The rules that can be overridden.
+    :return: Dictionary with the overridden rules.
+    """
+    overrides = {}
+    for key in rules:
+        value = os.getenv(f'QUALITY_{name.upper()}_{key.upper()}')
+        if value is None:
+            continue
+        if key == 'action':
+            overrides[key] = value.lower()
+        else:
+            overrides[key] = None if value.lower() == 'none' else float(value)
+    return overrides
+
+def get_quality_rules(source: str) -> dict:
+    """
+    Get the data-quality rules of a source: its entry in config.QUALITY_RULES applied on top of the default rules,
+    each with the overrides of its env vars (see `rule_overrides`).
+
+    :param source: The source's database value (e.g. 'wdi').
+    :return: Dictionary with the thresholds and action of the source.
+    """
+    rules = dict(config.QUALITY_RULES['default'])
+    for name in dict.fromkeys(('default', source)):
+        rules.update(config.QUALITY_RULES.get(name, {}))
+        rules.update(rule_overrides(name, rules))
+    return rules
+
+def sql_literal(value) -> str:
+    """SQL literal of a rule's bound (NULL for None)."""
+    return 'NULL' if value is None else repr(value)
+
+class QualityGate:
+    """
+    Data-quality gate of the master table, run between transform and load.
+
+    Every rule of every source is computed by a single aggregation over the master table, grouped by
+    database: only one row of counts per source leaves DuckDB.
+    """
+
+    def __init__(self, con=None) -> None:
+        """
+        Initialize the gate.
+
+        :param con: The Ibis-DuckDB backend connection holding the source tables (not needed to `evaluate` metrics).
+        """
+        self.con = con
+
+    @staticmethod
+    def rates(metrics: dict) -> dict:
+        """
+        Add the rates checked by the rules to the metrics of a source, from its counts.
+
+        :param metrics: Metrics of a source, with its 'rows' and the counts of RATES.
+        :return: The metrics, with the rates.
+        """
+        for rate, count in RATES.items():
+            metrics[rate] = round(metrics[count] / metrics['rows'], 6) if metrics['rows'] else 0.0
+        return metrics
+
+    @staticmethod
+    def combine(slices: list) -> dict:
+        """
+        Combine the metrics of a source computed on disjoint slices of its rows (e.g. the shards of a sharded run).
+
+        Counts are summed, so duplicate keys are only all counted if no key spans two slices, as with
+        slices split on a key column.
+
+        :param slices: Metrics of each slice, as computed by `metrics`.
+        :return: Metrics of the whole source.
+        """
+        combined = {'rows': sum(metrics['rows'] for metrics in slices)}
+        for count in RATES.values():
+            combined[count] = sum(metrics[count] for metrics in slices)
+        for bound, pick in (('min_year', min), ('max_year', max), ('min_value', min), ('max_value', max)):
+            values = [metrics[bound] for metrics in slices if metrics.get(bound) is not None]
+            combined[bound] = pick(values) if values else None
+        return QualityGate.rates(combined)
+
+    def per_source(self, key: str, sources: list) -> str:
+        """
+        SQL expression of a rule's bound for the source of each row, for bounds that differ between sources.
+
+        :param key: The rule (e.g. 'year_min').
+        :param sources: The source names.
+        :return: A CASE expression on the database column.
+        """
+        cases = " ".join(f"WHEN '{source}' THEN {sql_literal(get_quality_rules(source)[key])}" for source in sources)
+        return f"CASE database {cases} ELSE {sql_literal(get_quality_rules('default')[key])} END"
+
+    def metrics(self, master: ibis.Expr, sources: list) -> dict:
+        """
+        Compute the quality metrics of each source in one scan of the master table.
+
+        :param master: The master table expression.
+        :param sources: The source names, for their per-source bounds.
+        :return: Metrics (counts, observed ranges and rates) by source.
+        """
+        key = ", ".join(KEY_COLUMNS)
+        null_key = " OR ".join(f"{column} IS NULL" for column in KEY_COLUMNS)
+        query = f"""
+            WITH master AS ({self.con.compile(master)})
+            SELECT
+                database,
+                count(*) AS rows,
+                count(*) - count(DISTINCT ({key})) AS duplicate_keys,
+                count(*) FILTER (WHERE {null_key}) AS null_keys,
+                count(*) FILTER (WHERE value IS NULL) AS null_values,
+                count(*) FILTER (WHERE isnan(value) OR isinf(value)) AS non_finite_values,
+                count(*) FILTER (WHERE indicator_label IS NULL) AS label_misses,
+                count(*) FILTER (
+                    WHERE year < {self.per_source('year_min', sources)} OR year > {self.per_source('year_max', sources)}
+                ) AS years_out_of_range,
+                count(*) FILTER (
+                    WHERE value < {self.per_source('value_min', sources)} OR value > {self.per_source('value_max', sources)}
+                ) AS values_out_of_bounds,
+                min(year) AS min_year,
+                max(year) AS max_year,
+                min(value) FILTER (WHERE NOT (isnan(value) OR isinf(value))) AS min_value,
+                max(value) FILTER (WHERE NOT (isnan(value) OR isinf(value))) AS max_value
+            FROM master
+            GROUP BY database
+        """
+        cursor = self.con.con.execute(query)
+        columns = [description[0] for description in cursor.description]
+
+        metrics = {}
+        for row in cursor.fetchall():
+            source_metrics = dict(zip(columns, row))
+            source = source_metrics.pop('database')
+            metrics[source] = self.rates(source_metrics)
+        return metrics
+
+    def violations(self, source: str, metrics: dict) -> list:
+        """
+        List the rules a source breaks.
+
+        :param source: The source name.
+        :param metrics: The source's metrics, as computed by `metrics`.
+        :return: Descriptions of the broken rules (empty if the source passes).
+        """
+        rules = get_quality_rules(source)
+        return [
+            f"{rate} {metrics[rate]:.4%} > {rules[f'max_{rate}']:.4%}"
+            for rate in RATES
+            if rules.get(f'max_{rate}') is not None and metrics[rate] > rules[f'max_{rate}']
+        ]
+
+    def check(self, master: ibis.Expr, sources: list) -> dict:
+        """
+        Check every source of the master table against its rules.
+
+        :param master: The master table expression.
+        :param sources: Names of the sources in the master table.
+        :return: For each source, its 'metrics', 'violations' and the resulting 'status'
+                 ('passed', 'warned', 'quarantined' or 'failed').
+        """
+        return self.evaluate(self.metrics(master, sources), sources)
+
+    def evaluate(self, metrics: dict, sources: list) -> dict:
+        """
+        Check already computed metrics against the rules of their sources.
+
+        :param metrics: Metrics by source, as computed by `metrics` (or combined by `combine`).
+        :param sources: Names of the sources in the master table.
+        :return: For each source, its 'metrics', 'violations' and 'status', as returned by `check`.
+        """
+        results = {}
+        for source in sources:
+            source_metrics = metrics.get(source, {'rows': 0})
+            violations = self.violations(source, source_metrics) if source_metrics['rows'] else []
+            status = 'passed'
+            if violations:
+                status = {'fail': 'failed', 'quarantine': 'quarantined'}.get(get_quality_rules(source)['action'], 'warned')
+                logger.warning(f"Source '{source}' broke data-quality rules ({status}): {'; '.join(violations)}")
+            results[source] = {'status': status, 'violations': violations, 'metrics': source_metrics}
+
+        summary = ", ".join(f"{source} {result['status']}" for source, result in results.items())
+        logger.info(f"Data-quality gate: {summary}")
+        return results
+
+    def quarantine(self, source: str, run_id: str) -> str:
+        """
+        Write the rows of a quarantined source to QUALITY_QUARANTINE_DIR for inspection.
+
+        :param source: The source name; its rows are read from its materialized table `source_<name>`.
+        :param run_id: Identifier of the run, naming the quarantine folder.
+        :return: Path of the quarantined Parquet file.
+        """
+        path = os.path.join(config.QUALITY_QUARANTINE_DIR, run_id, f'{source}.parquet')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.con.con.execute(f"COPY \"source_{source}\" TO '{path}' (FORMAT PARQUET)")
+        logger.info(f"Rows of source '{source}' quarantined in {path}")
+        return path
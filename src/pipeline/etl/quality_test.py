@@ -0,0 +1,75 @@
+import os
+import ibis
+import pytest
+import pandas as pd
+import pipeline.config as config
+from pipeline.etl.quality import QualityGate, get_quality_rules
+from pipeline.etl.run import ETL
+from pipeline.report import RunReport
+
+def source_rows(database: str, values: list) -> pd.DataFrame:
+    return pd.DataFrame({
+        'country_id': ['KEN'] * len(values),
+        'indicator_id': ['A'] * len(values),
+        'year': [2000 + i for i in range(len(values))],
+        'value': values,
+        'indicator_label': ['a'] * len(values),
+        'database': [database] * len(values),
+    })
+
+def etl_with_sources() -> tuple:
+    # sdg has half of its values missing, above the default max_null_value_rate
+    con = ibis.duckdb.connect()
+    con.create_table('source_wdi', source_rows('wdi', [1.0, 2.0]))
+    con.create_table('source_sdg', source_rows('sdg', [3.0, None]))
+    etl = ETL(con)
+    etl.report = RunReport('etl', enabled=False)
+    etl.processed_sources = ['wdi', 'sdg']
+    return etl, ibis.union(con.table('source_wdi'), con.table('source_sdg'))
+
+def test_violations_only_warn_by_default():
+    etl, master = etl_with_sources()
+
+    assert etl.validate(master).count().execute() == 4
+    assert etl.processed_sources == ['wdi', 'sdg']
+
+def test_fail_action_stops_the_run(monkeypatch):
+    monkeypatch.setenv('QUALITY_SDG_ACTION', 'fail')
+    etl, master = etl_with_sources()
+
+    with pytest.raises(ValueError, match="Sources \\['sdg'\\] failed"):
+        etl.validate(master)
+
+def test_quarantined_sources_are_written_out_and_left_out(tmp_path, monkeypatch):
+    monkeypatch.setenv('QUALITY_SDG_ACTION', 'quarantine')
+    monkeypatch.setattr(config, 'QUALITY_QUARANTINE_DIR', str(tmp_path))
+    etl, master = etl_with_sources()
+
+    master = etl.validate(master)
+
+    assert master.database.value_counts().execute().to_dict('records') == [{'database': 'wdi', 'database_count': 2}]
+    assert etl.processed_sources == ['wdi']
+    path = os.path.join(tmp_path, etl.report.run_id, 'sdg.parquet')
+    assert pd.read_parquet(path)['value'].isna().sum() == 1
+
+def test_every_source_quarantined_stops_the_run(tmp_path, monkeypatch):
+    monkeypatch.setenv('QUALITY_DEFAULT_ACTION', 'quarantine')
+    monkeypatch.setenv('QUALITY_DEFAULT_MAX_NULL_VALUE_RATE', '0')
+    monkeypatch.setattr(config, 'QUALITY_QUARANTINE_DIR', str(tmp_path))
+    etl, master = etl_with_sources()
+    etl.con.raw_sql("UPDATE source_wdi SET value = NULL WHERE year = 2000")
+
+    with pytest.raises(ValueError, match="Every source was quarantined"):
+        etl.validate(master)
+
+def test_env_vars_override_the_rules_of_a_source(monkeypatch):
+    monkeypatch.setenv('QUALITY_DEFAULT_ACTION', 'FAIL')
+    monkeypatch.setenv('QUALITY_WDI_ACTION', 'warn')
+    monkeypatch.setenv('QUALITY_SDG_MAX_NULL_VALUE_RATE', '0.5')
+    monkeypatch.setenv('QUALITY_SDG_YEAR_MAX', 'none')
+
+    assert get_quality_rules('wdi')['action'] == 'warn'
+    assert get_quality_rules('sdg')['action'] == 'fail'
+    assert get_quality_rules('sdg')['year_max'] is None
+    etl, master = etl_with_sources()
+    assert QualityGate(etl.con).check(master, ['wdi', 'sdg'])['sdg']['status'] == 'passed'
@@ -1,8 +1,22 @@
 import ibis
+import argparse
+from concurrent.futures import ThreadPoolExecutor
 from pipeline.etl import DataLoader, DataTransformer
-from pipeline.utils import setup_logger
-from pipeline.catalog import save_s3, save_duckdb, save_parquet
-from pipeline.config import MASTER_DATA_DIR, S3_BUCKET_NAME, STAGING_AREA_PATH, LOCAL
+from pipeline.utils import setup_logger, set_duckdb_profile, ibis_connect, s3_filesystem
+from pipeline.etl.state import ETLState
+from pipeline.etl.quality import QualityGate
+from pipeline.etl.sources import source_tables
+from pipeline.report import RunReport, output_size
+from pipeline.snapshots import SnapshotStore, new_snapshot_id
+from pipeline.catalog import (
+    materialize, save_s3, save_duckdb, save_parquet,
+    replace_s3_partitions, replace_parquet_partitions, replace_duckdb_rows,
+    build_star_schema, save_star_parquet, save_star_duckdb
+)
+from pipeline.config import (
+    MASTER_DATA_DIR, MASTER_S3_DIR, LOCAL, LAZY_EXTRACT, MASTER_LAYOUT, MASTER_MODEL, MASTER_PARTITION_BY, MASTER_PUBLISH,
+    MASTER_SORT_BY, ETL_INCREMENTAL, QUALITY_GATE
+)
 
 # Set up logging
 logger = setup_logger(__name__)
@@ -19,17 +33,34 @@ class ETL:
         :param con: The Ibis-DuckDB backend connection
         """
         self.con = con
+        self.data_loader = None
+        self.processed_sources = []
+        self.report = RunReport('etl')
 
     # 1. EXTRACT - LOAD THE DATA
-    def extract(self):
+    def extract(self, sources: list = None):
         """
         Extract data from the data sources.
+
+        With LAZY_EXTRACT, only the tables and columns used by the master table are read.
+
+        :param sources: Names of the master table sources to extract for (defaults to all of them).
         """
         try:
-            data_loader = DataLoader(self.con)
-            result = data_loader.load_data()
-            if not isinstance(result, dict):
-                raise ValueError("Data loader did not return a dictionary")
+            with self.report.stage('extract', con=self.con.con) as stage:
+                data_loader = self.data_loader = self.data_loader or DataLoader(self.con)
+
+                result = data_loader.load_data(tables=source_tables(sources) if LAZY_EXTRACT else None)
+                if not isinstance(result, dict):
+                    raise ValueError("Data loader did not return a dictionary")
+
+                loaded = [(source, name) for source, files in result.items() for name, entry in files.items() if "data" in entry]
+                stage.update(
+                    tables=len(loaded),
+                    s3_input_bytes=sum(data_loader.file_metadata[source][name]["size"] for source, name in loaded),
+                )
+                if data_loader.cache is not None:
+                    stage['cache'] = dict(data_loader.cache.stats)
             logger.info("Data successfully loaded.")
 
         except Exception as e:
@@ -37,13 +68,19 @@ class ETL:
             raise ValueError("Data loading failed") from e
     
     # 2. TRANSFORM - CREATE MASTER TABLE
-    def transform(self):
+    def transform(self, sources: list = None, arrivals=None):
         """
         Transform the data into the master table.
+
+        :param sources: Names of the master table sources to build (defaults to all of them).
+        :param arrivals: Queue of landing tables registered while the transform runs, for pipelined runs
+                         (see `SourceScheduler.run`); by default every table was extracted beforehand.
         """
         try:
-            data_transformer = DataTransformer(self.con)
-            master = data_transformer.create_master_table()
+            with self.report.stage('transform', con=self.con.con) as stage:
+                data_transformer = DataTransformer(self.con, report=self.report)
+                master = data_transformer.create_master_table(sources, arrivals=arrivals)
+                self.processed_sources = stage['sources'] = data_transformer.processed_sources
             logger.info("Master table successfully created.")
             return master
         
@@ -51,50 +88,258 @@ class ETL:
             logger.error(f"Failed to create master table: {e}")
             raise
 
-    # 3. LOAD - SAVE MASTER TABLE
-    def load(self, master):
+    # 3. VALIDATE - CHECK THE MASTER TABLE
+    def validate(self, master):
+        """
+        Check the master table against the data-quality rules of each source, in one aggregated scan.
+
+        Sources breaking a rule with the 'fail' action stop the run; those with the 'quarantine' action are
+        written to the quarantine folder and left out of the master table (and of processed_sources, so an
+        incremental run retries them). The metrics of every source are recorded in the run report.
+
+        :param master: The master table expression.
+        :return: The master table expression, without the quarantined sources.
+        :raises ValueError: If a source failed the checks, or every source was quarantined.
+        """
+        if not QUALITY_GATE:
+            return master
+
+        with self.report.stage('validate', con=self.con.con) as stage:
+            gate = QualityGate(self.con)
+            results = gate.check(master, self.processed_sources)
+            stage['sources'] = {source: result['status'] for source, result in results.items()}
+            for source, result in results.items():
+                self.report.add({'stage': 'validate', 'source': source, **result})
+
+            failed = [source for source, result in results.items() if result['status'] == 'failed']
+            if failed:
+                raise ValueError(f"Sources {failed} failed the data-quality checks")
+
+            quarantined = [source for source, result in results.items() if result['status'] == 'quarantined']
+            if quarantined:
+                for source in quarantined:
+                    gate.quarantine(source, self.report.run_id)
+                self.processed_sources = [source for source in self.processed_sources if source not in quarantined]
+                if not self.processed_sources:
+                    raise ValueError("Every source was quarantined by the data-quality checks")
+                master = ibis.union(*[self.con.table(f'source_{source}') for source in self.processed_sources])
+
+        logger.info("Master table passed the data-quality checks.")
+        return master
+
+    # 4. LOAD - SAVE MASTER TABLE
+    def run_sink(self, sink, table_name, **kwargs) -> None:
+        """
+        Run a catalog save function on its own DuckDB cursor, reading the materialized master table.
+
+        The sink is recorded in the run report, with the size of its output and the query profile of its write.
+
+        :param sink: The catalog function to run (e.g. save_s3).
+        :param table_name: Name of the materialized master table, or names of the tables passed to the
+                           sink as `tables` (e.g. the 'star' model tables).
+        :param kwargs: Keyword arguments passed to the sink, besides the table expression.
+        """
+        output_path = kwargs.get('s3_path') or kwargs.get('local_path') or kwargs.get('path') or kwargs.get('local_db_path')
+        cursor = self.con.con.cursor()
+        try:
+            with self.report.source('load', sink.__name__, con=cursor) as record:
+                backend = ibis.duckdb.from_connection(cursor)
+                if isinstance(table_name, str):
+                    kwargs['table_exp'] = backend.table(table_name)
+                else:
+                    kwargs['tables'] = {name: backend.table(name) for name in table_name}
+                if 'local_db_path' in kwargs:
+                    local_db = ibis_connect(kwargs.pop('local_db_path'))
+                    try:
+                        sink(local_db=local_db, **kwargs)
+                    finally:
+                        local_db.disconnect()
+                else:
+                    sink(**kwargs)
+                record['bytes_written'] = output_size(output_path)
+        finally:
+            cursor.close()
+
+    def load(self, master, replace: list = None):
         """
         Load the master table to S3 and local storage (parquet and DuckDB files).
+
+        The master table is computed and sorted once into a table, then written to every sink concurrently. With the
+        'partitioned' MASTER_LAYOUT, the Parquet outputs are hive-partitioned datasets under master/.
+        With the 'star' MASTER_MODEL, the master table is normalized into dimension and fact tables first,
+        and those are written instead (see `build_star_schema`).
+        With the 'snapshot' MASTER_PUBLISH, the S3 outputs are written under a new snapshot, published once
+        every sink succeeded (see `SnapshotStore`).
+
+        :param master: The master table expression.
+        :param replace: If given, the master table only holds these databases, and only their partitions
+                        (and their rows in staging.db) are replaced. Requires the 'partitioned' layout.
         """
+        store = SnapshotStore(MASTER_S3_DIR) if MASTER_PUBLISH == 'snapshot' else None
+        snapshot_id = new_snapshot_id() if store is not None else None
         try:
-            if LOCAL:
-                logger.info("Saving master table to S3 and local storage.")
-                save_s3(
-                    table_exp=master,
-                    s3_path=f's3://{S3_BUCKET_NAME}/{STAGING_AREA_PATH}/master/master.parquet'
-                )
-                save_parquet(
-                    table_exp=master,
-                    local_path=f'{MASTER_DATA_DIR}/master.parquet'
-                )
-                local_db = ibis.duckdb.connect(f'{MASTER_DATA_DIR}/staging.db')
-                save_duckdb(table_exp=master, local_db=local_db)
-                local_db.disconnect()
-            else:
-                logger.info("Saving master table only to S3.")
-                save_s3(
-                    table_exp=master,
-                    s3_path=f's3://{S3_BUCKET_NAME}/{STAGING_AREA_PATH}/master/master.parquet'
-                )
+            with self.report.stage('load', con=self.con.con) as stage:
+                # Compute the union and its sort once into a table that every sink reads. The partitioned writes still
+                # order their rows: DuckDB's partitioned COPY does not keep the scan order, but its input is then presorted
+                materialize(master.order_by(list(MASTER_SORT_BY)), self.con, table_name='master')
+                stage['rows'] = self.con.con.execute("SELECT count(*) FROM master").fetchone()[0]
+
+                partitioned = MASTER_LAYOUT == 'partitioned'
+                file_name = '' if partitioned else 'master.parquet'
+                if store is not None:
+                    parent = store.load()
+                    s3_dir = store.data_path(snapshot_id)
+                else:
+                    s3_dir = MASTER_S3_DIR
+                s3_path = f'{s3_dir}{file_name}'
+                local_path = f'{MASTER_DATA_DIR}/{file_name}'
+                local_db_path = f'{MASTER_DATA_DIR}/staging.db'
+                table_name = 'master'
+
+                if MASTER_MODEL == 'star':
+                    table_name = build_star_schema(self.con, table_name='master')
+                    logger.info("Saving the star model of the master table to S3 and local storage.")
+                    sinks = [(save_star_parquet, {"path": s3_dir, "partitioned": partitioned})]
+                    if LOCAL:
+                        sinks += [
+                            (save_star_parquet, {"path": f'{MASTER_DATA_DIR}/', "partitioned": partitioned}),
+                            (save_star_duckdb, {"local_db_path": local_db_path}),
+                        ]
+                elif replace is not None:
+                    logger.info(f"Replacing partitions {replace} of the master table.")
+                    # A snapshot only holds the new partitions, and keeps the others of its parent
+                    if store is not None:
+                        sinks = [(save_s3, {"s3_path": s3_path, "partitioned": True})]
+                    else:
+                        sinks = [(replace_s3_partitions, {"s3_path": s3_path, "databases": replace})]
+                    if LOCAL:
+                        sinks += [
+                            (replace_parquet_partitions, {"local_path": local_path, "databases": replace}),
+                            (replace_duckdb_rows, {"local_db_path": local_db_path, "databases": replace}),
+                        ]
+                elif LOCAL:
+                    logger.info("Saving master table to S3 and local storage.")
+                    sinks = [
+                        (save_s3, {"s3_path": s3_path, "partitioned": partitioned}),
+                        (save_parquet, {"local_path": local_path, "partitioned": partitioned}),
+                        (save_duckdb, {"local_db_path": local_db_path}),
+                    ]
+                else:
+                    logger.info("Saving master table only to S3.")
+                    sinks = [(save_s3, {"s3_path": s3_path, "partitioned": partitioned})]
+
+                with ThreadPoolExecutor(max_workers=len(sinks)) as executor:
+                    futures = [
+                        executor.submit(self.run_sink, sink, table_name, **kwargs)
+                        for sink, kwargs in sinks
+                    ]
+                    for future in futures:
+                        future.result()
+
+                if store is not None:
+                    kept = [] if replace is None else [
+                        entry for entry in parent['tables']['master']['files'] if entry['columns']['database']['min'] not in replace
+                    ]
+                    self.con.con.register_filesystem(s3_filesystem())
+                    store.commit(
+                        snapshot_id, self.con.con, store.files(snapshot_id), kept,
+                        parent_id=parent['snapshot_id'] if parent else None,
+                        properties={'run_id': self.report.run_id, 'model': MASTER_MODEL, 'layout': MASTER_LAYOUT, 'replaced': replace},
+                    )
+                    store.expire()
+                    stage['snapshot_id'] = snapshot_id
+
         except Exception as e:
             logger.error(f"Error saving master table: {str(e)}")
+            if store is not None:
+                store.discard(snapshot_id)
             raise
     
-    def run(self):
+    def run(self, incremental: bool = None):
         """
-        Run the entire ETL process: extract, transform, and load.
+        Run the entire ETL process: extract, transform, validate and load.
+
+        In incremental mode, only the sources whose landing files or transform code changed since the
+        last run are rebuilt. With the 'partitioned' layout, they replace just their own partitions;
+        otherwise the full master table is rebuilt whenever any source changed. It is also rebuilt in full
+        when the output settings (layout, model, partitioning...) differ from those of the last run.
+        The run report, with the metrics of each stage, source and sink, is saved at the end of the run.
+
+        :param incremental: Whether to run incrementally (defaults to config.ETL_INCREMENTAL).
         """
+        incremental = ETL_INCREMENTAL if incremental is None else incremental
         try:
-            self.extract()
-            master = self.transform()
-            self.load(master)
+            state = ETLState()
+            state.load()
+
+            if not incremental:
+                self.extract()
+                master = self.validate(self.transform())
+                self.load(master)
+
+                # Recorded so that a later incremental run knows what the outputs were built from
+                state.reset()
+                state.record({
+                    name: state.fingerprint(DataTransformer.SOURCES[name], self.data_loader.file_metadata)
+                    for name in self.processed_sources
+                })
+                state.save()
+                return
+
+            self.data_loader = DataLoader(self.con)
+            fingerprints = {
+                name: state.fingerprint(spec, self.data_loader.file_metadata)
+                for name, spec in DataTransformer.SOURCES.items()
+            }
+            changed = state.changed_sources(fingerprints)
+            if not state.same_layout():
+                logger.info("The output settings changed since the last run, rebuilding the full master table.")
+                changed = list(DataTransformer.SOURCES)
+            if not changed:
+                logger.info("No source changed since the last run, nothing to rebuild.")
+                return
+
+            # The star model's keys span every source, so it is always rebuilt in full. The outputs of
+            # the unchanged sources are only kept if they were written with the same output settings, in
+            # partitions of their own.
+            partial = (
+                MASTER_LAYOUT == 'partitioned' and MASTER_MODEL == 'wide' and MASTER_PARTITION_BY[0] == 'database'
+                and state.same_layout()
+                and set(state.sources) >= set(DataTransformer.SOURCES)
+            )
+            if partial and MASTER_PUBLISH == 'snapshot':
+                # The partitions of the unchanged sources are kept from the current snapshot
+                current = SnapshotStore(MASTER_S3_DIR).load()
+                partial = (
+                    current is not None and list(current['tables']) == ['master']
+                    and current['tables']['master']['partition_by'] == list(MASTER_PARTITION_BY)
+                )
+            if not partial:
+                logger.info(f"Sources {changed} changed, rebuilding the full master table.")
+                changed = list(DataTransformer.SOURCES)
+
+            logger.info(f"Rebuilding sources {changed}.")
+            self.extract(changed)
+            master = self.validate(self.transform(changed))
+            self.load(master, replace=self.processed_sources if partial else None)
+
+            if not partial:
+                state.reset()
+            state.record({name: fingerprints[name] for name in self.processed_sources})
+            state.save()
 
         finally:
+            self.report.save()
             self.con.disconnect()
 
 if __name__ == '__main__':
-    # Create an in-memory Ibis-DuckDB connection
-    con = ibis.duckdb.connect(':memory:')
+    parser = argparse.ArgumentParser(description="Build the master table from the landing area and load it to the staging area.")
+    parser.add_argument('--profile', help="DuckDB runtime profile (a key of config.DUCKDB_PROFILES, defaults to DUCKDB_PROFILE)")
+    args = parser.parse_args()
+    set_duckdb_profile(args.profile)
+
+    # Create an in-memory Ibis-DuckDB connection, configured with the runtime profile
+    con = ibis_connect(':memory:')
 
     # Instantiate and run the ETL process
     etl_process = ETL(con)
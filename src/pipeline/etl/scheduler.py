@@ -0,0 +1,162 @@
+import ibis
+import queue
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from pipeline.etl.sources.registry import SOURCES
+from pipeline.report import RunReport
+from pipeline.utils import setup_logger
+from pipeline.config import TRANSFORM_MAX_WORKERS
+
+# Set up logging
+logger = setup_logger(__name__)
+
+class SourceScheduler:
+    """
+    Run the processors of the registered sources as a dependency graph.
+
+    Independent sources are processed and materialized concurrently, each on its own DuckDB cursor,
+    into tables named `source_<name>`. The table catalog is fetched once for the whole run.
+    """
+
+    def __init__(self, con, max_workers: int = None, report: RunReport = None) -> None:
+        """
+        Initialize the scheduler.
+
+        :param con: The Ibis-DuckDB backend connection.
+        :param max_workers: Maximum number of sources processed at the same time (defaults to config.TRANSFORM_MAX_WORKERS).
+        :param report: Run report recording each source (if None, sources are not recorded).
+        """
+        self.con = con
+        self.max_workers = max(1, max_workers or TRANSFORM_MAX_WORKERS)
+        self.report = report or RunReport('transform', enabled=False)
+
+    def dependencies(self, names: list) -> dict:
+        """
+        Build the dependency graph of the given sources, including the sources they depend on.
+
+        :param names: Names of the sources to run.
+        :return: Mapping of each source to the set of sources it depends on.
+        """
+        graph = {}
+        to_visit = list(names)
+        while to_visit:
+            name = to_visit.pop()
+            if name in graph:
+                continue
+            if name not in SOURCES:
+                raise ValueError(f"Unknown source '{name}'")
+            graph[name] = set(SOURCES[name]['depends_on'])
+            to_visit.extend(graph[name])
+        return graph
+
+    def run_source(self, name: str, available_tables: set) -> str:
+        """
+        Process a source on its own DuckDB cursor and materialize it as `source_<name>`.
+
+        :param name: Name of the source.
+        :param available_tables: Tables present in the DuckDB database.
+        :return: Name of the materialized table, or None if the source could not be processed.
+        """
+        spec = SOURCES[name]
+        missing = [table for table in spec['tables'] if table not in available_tables]
+        if missing:
+            logger.error(f"Skipping source '{name}' as tables {missing} do not exist.")
+            self.report.add({'stage': 'transform', 'source': name, 'status': 'error', 'error': f"Missing tables {missing}"})
+            return None
+
+        cursor = self.con.con.cursor()
+        try:
+            with self.report.source('transform', name, con=cursor) as record:
+                backend = ibis.duckdb.from_connection(cursor)
+                table = spec['processor'](connection=backend, available_tables=available_tables, **spec['kwargs'])
+                if table is None:
+                    record.update(status='error', error="Processor returned no table")
+                    return None
+
+                # Enforce the output contract: column names, order and types
+                output = spec['output']
+                table = table.select(*output).cast(output)
+
+                # A single CREATE TABLE AS, so that it is the query profiled in the run report
+                record['rows'] = cursor.execute(
+                    f'CREATE OR REPLACE TABLE "source_{name}" AS {backend.compile(table)}'
+                ).fetchone()[0]
+
+            logger.info(f"Source '{name}' successfully materialized.")
+            return f'source_{name}'
+
+        except Exception as e:
+            logger.exception(f"Error processing source '{name}': {e}")
+            return None
+
+        finally:
+            cursor.close()
+
+    def run(self, names: list, arrivals: queue.Queue = None) -> dict:
+        """
+        Run the given sources (and the sources they depend on), in dependency order.
+
+        With `arrivals`, the landing tables are still being loaded: a source only starts once all the tables
+        it reads have arrived, so sources start as soon as their own input is ready. The queue receives sets
+        of newly available table names, and None once no more tables will arrive; sources still missing
+        tables then fail as they would in a batch run.
+
+        :param names: Names of the sources to run.
+        :param arrivals: Queue of newly available tables, for runs that overlap with the loading of the tables.
+        :return: Mapping of each source to its materialized Ibis table, or None if it could not be processed.
+        """
+        pending = self.dependencies(names)
+        available_tables = set(self.con.list_tables())
+        streaming = arrivals is not None
+        results = {}
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            running = {}
+
+            def submit_ready():
+                progress = True
+                while progress:
+                    progress = False
+                    for name, depends_on in list(pending.items()):
+                        if not depends_on <= set(results):
+                            continue
+                        if streaming and not set(SOURCES[name]['tables']) <= available_tables:
+                            continue
+                        del pending[name]
+                        progress = True
+                        failed = [dep for dep in depends_on if results[dep] is None]
+                        if failed:
+                            logger.error(f"Skipping source '{name}' as its dependencies {failed} failed.")
+                            results[name] = None
+                            continue
+                        tables = available_tables | {results[dep] for dep in depends_on}
+                        future = executor.submit(self.run_source, name, tables)
+                        running[future] = name
+                        if streaming:
+                            # Completed sources are reported on the arrivals queue, so one blocking get waits for both
+                            future.add_done_callback(arrivals.put)
+
+            submit_ready()
+            while running or streaming:
+                if not streaming:
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                else:
+                    event = arrivals.get()
+                    done = []
+                    if isinstance(event, Future):
+                        done = [event]
+                    elif event is None:
+                        streaming = False
+                    else:
+                        available_tables |= set(event)
+                for future in done:
+                    results[running.pop(future)] = future.result()
+                submit_ready()
+
+        if pending:
+            raise ValueError(f"Dependency cycle between sources {list(pending)}")
+
+        return {
+            name: self.con.table(table_name) if table_name is not None else None
+            for name, table_name in results.items()
+            if name in names
+        }
@@ -0,0 +1,61 @@
+import ibis
+import pytest
+import pandas as pd
+import pipeline.etl.scheduler as scheduler
+from pipeline.etl.scheduler import SourceScheduler
+from pipeline.etl.sources.registry import MASTER_SCHEMA
+
+def landing_rows(connection, table, available_tables, **kwargs):
+    return connection.table(table).mutate(database=ibis.literal(table))
+
+def labelled(connection, available_tables, **kwargs):
+    # Reads the output of the source it depends on
+    return connection.table('source_raw').mutate(indicator_label=ibis.literal('labelled'))
+
+def failing(connection, available_tables, **kwargs):
+    return None
+
+def source(processor, tables=(), depends_on=(), **kwargs) -> dict:
+    return {'processor': processor, 'kwargs': kwargs, 'tables': dict.fromkeys(tables), 'depends_on': list(depends_on), 'output': MASTER_SCHEMA}
+
+def connection():
+    con = ibis.duckdb.connect()
+    con.create_table('landing', pd.DataFrame({
+        'country_id': ['KEN'], 'indicator_id': ['A'], 'year': [2001], 'value': [1.0], 'indicator_label': ['a']
+    }))
+    return con
+
+def test_sources_read_the_output_of_their_dependencies(monkeypatch):
+    monkeypatch.setattr(scheduler, 'SOURCES', {
+        'raw': source(landing_rows, tables=['landing'], table='landing'),
+        'labelled': source(labelled, depends_on=['raw']),
+    })
+
+    results = SourceScheduler(connection(), max_workers=2).run(['labelled'])
+
+    assert list(results) == ['labelled']
+    assert results['labelled'].execute().to_dict('records') == [{
+        'country_id': 'KEN', 'indicator_id': 'A', 'year': 2001, 'value': 1.0, 'indicator_label': 'labelled', 'database': 'landing'
+    }]
+
+def test_sources_are_skipped_when_tables_or_dependencies_are_missing(monkeypatch):
+    monkeypatch.setattr(scheduler, 'SOURCES', {
+        'raw': source(landing_rows, tables=['missing'], table='missing'),
+        'labelled': source(labelled, depends_on=['raw']),
+        'empty': source(failing),
+        'ok': source(landing_rows, tables=['landing'], table='landing'),
+    })
+
+    results = SourceScheduler(connection(), max_workers=2).run(['raw', 'labelled', 'empty', 'ok'])
+
+    assert {name for name, table in results.items() if table is None} == {'raw', 'labelled', 'empty'}
+    assert results['ok'].count().execute() == 1
+
+def test_dependency_cycles_raise(monkeypatch):
+    monkeypatch.setattr(scheduler, 'SOURCES', {
+        'a': source(failing, depends_on=['b']),
+        'b': source(failing, depends_on=['a']),
+    })
+
+    with pytest.raises(ValueError):
+        SourceScheduler(connection()).run(['a'])
@@ -0,0 +1,360 @@
+import os
+import json
+import time
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from pipeline.utils import (
+    setup_logger, set_duckdb_profile, ibis_connect, duckdb_connect, split_duckdb_settings, snake_case, get_filesystem,
+    partition_values
+)
+from pipeline.catalog import write_parquet
+from pipeline.report import RunReport
+from pipeline.snapshots import SnapshotStore, new_snapshot_id
+from pipeline.etl.extract import DataLoader
+from pipeline.etl.listing import LandingIndex
+from pipeline.etl.quality import QualityGate
+from pipeline.etl.sources import SOURCES, source_tables
+import pipeline.config as config
+
+# Set up logging
+logger = setup_logger(__name__)
+
+# Folder of the shard outputs of each run, under the master dataset directory
+SHARD_DIR = '_shards'
+# Columns of the master key a source can be sharded on
+SHARD_KEYS = ('indicator_id', 'country_id')
+
+def run_shard(source: str, shard: int, shards: int, run_id: str, output_dir: str, key: str = None,
+              index: LandingIndex = None, profile: str = None, settings: dict = None) -> dict:
+    """
+    Build one shard of a source and write it to the run's shard directory, with its data-quality metrics.
+
+    The shard holds the rows whose hash of the shard key, modulo the number of shards, is the shard number.
+    The landing tables declared in the source's `shard_columns` are filtered the same way before the
+    processor runs, so that each shard only reshapes and joins its own share of the input.
+    It runs on its own in-memory DuckDB database, so that it can run in a worker process or on another
+    machine: its only outputs are its Parquet files and a '_results/<source>-<shard>.json' file.
+
+    :param source: Name of the source in SOURCES.
+    :param shard: Number of the shard, from 0 to shards - 1.
+    :param shards: Number of shards of the source.
+    :param run_id: Identifier of the sharded run.
+    :param output_dir: Local or S3 directory of the partitioned master dataset.
+    :param key: Column the rows are sharded on (defaults to config.ETL_SHARD_KEY).
+    :param index: Landing index to read the files from (refreshed from S3 if None).
+    :param profile: DuckDB runtime profile of the shard's database.
+    :param settings: Database settings overriding the profile's (e.g. the worker's share of its threads and memory).
+    :return: Result of the shard: its source, shard, rows, quality metrics and seconds.
+    """
+    start = time.perf_counter()
+    key = key or config.ETL_SHARD_KEY
+    if key not in SHARD_KEYS:
+        raise ValueError(f"Shard key '{key}' must be one of {SHARD_KEYS}")
+    spec = SOURCES[source]
+    if spec['depends_on']:
+        raise ValueError(f"Source '{source}' reads other sources and cannot be sharded")
+
+    set_duckdb_profile(profile)
+    con = ibis_connect(':memory:', settings=settings)
+    try:
+        # Worker processes would race on the landing cache index, so they read the landing files directly
+        DataLoader(con, index=index, cache=False).load_data(tables=source_tables([source]))
+
+        # Filter the input tables holding the shard key, so each shard only processes its own rows
+        for table_name, column in spec['shard_columns'].get(key, {}).items():
+            name = next(name for name in con.table(table_name).columns if snake_case(name) == column)
+            con.raw_sql(f'ALTER VIEW "{table_name}" RENAME TO "{table_name}_all"')
+            con.raw_sql(f"""
+                CREATE VIEW "{table_name}" AS
+                SELECT * FROM "{table_name}_all" WHERE hash(CAST("{name}" AS VARCHAR)) % {shards} = {shard}
+            """)
+
+        table = spec['processor'](connection=con, available_tables=set(con.list_tables()), **spec['kwargs'])
+        if table is None:
+            raise ValueError(f"Processor of source '{source}' returned no table")
+        table = table.select(*spec['output']).cast(spec['output'])
+
+        # The output is filtered too: rows whose key comes from an unfiltered table still land in one shard only
+        rows = con.con.execute(f"""
+            CREATE TABLE "source_{source}" AS
+            SELECT * FROM ({con.compile(table)}) WHERE hash("{key}") % {shards} = {shard}
+        """).fetchone()[0]
+        slice_table = con.table(f'source_{source}')
+
+        run_dir = f"{output_dir.rstrip('/')}/{SHARD_DIR}/{run_id}"
+        fs, root = get_filesystem(run_dir)
+        fs.makedirs(root, exist_ok=True)
+        metrics = QualityGate(con).metrics(slice_table, [source]).get(source) or QualityGate.combine([])
+        if rows:
+            write_parquet(slice_table, f'{run_dir}/', partitioned=True, filename_pattern=f'{run_id}_{source}_{shard}_{{i}}',
+                          overwrite=False)
+
+        result = {
+            'source': source, 'shard': shard, 'shards': shards, 'key': key, 'rows': rows, 'metrics': metrics,
+            'seconds': round(time.perf_counter() - start, 3),
+        }
+        fs.pipe_file(f'{root}/_results/{source}-{shard}.json', json.dumps(result, default=str).encode('utf-8'))
+        logger.info(f"Shard {shard}/{shards} of source '{source}' written: {rows} rows")
+        return result
+
+    except Exception as e:
+        logger.error(f"Error building shard {shard}/{shards} of source '{source}': {e}", exc_info=True)
+        raise
+
+    finally:
+        con.disconnect()
+
+class ShardedETL:
+    """
+    Sharded execution of the ETL, scaling with the number of worker processes (and machines) instead of one database.
+
+    Every source is split into `shards` slices by hash of a master key column. Each (source, shard) task
+    runs `run_shard` in a worker process, writing its slice of the partitioned master under
+    '<output>/_shards/<run id>/'. The tasks of a run can also be spread over several machines sharing
+    the output directory (e.g. the S3 staging area): each runs some shards with `run_shards`, and one
+    of them then runs `commit`. The commit checks the combined data-quality metrics of every source, and
+    publishes the shard files as a new snapshot of the dataset (see `SnapshotStore`).
+    """
+
+    def __init__(self, output_dir: str = None, shards: int = None, key: str = None, workers: int = None,
+                 sources: list = None, profile: str = None, run_id: str = None) -> None:
+        """
+        Initialize the sharded run.
+
+        :param output_dir: Local or S3 directory of the partitioned master dataset (defaults to the master folder of the S3 staging area).
+        :param shards: Number of shards of each source (defaults to config.ETL_SHARDS).
+        :param key: Column the rows are sharded on (defaults to config.ETL_SHARD_KEY).
+        :param workers: Number of worker processes (defaults to config.ETL_SHARD_WORKERS; 1 runs the shards in this process).
+        :param sources: Names of the sources to build (defaults to every source in SOURCES).
+        :param profile: DuckDB runtime profile of the workers' databases.
+        :param run_id: Identifier of the run, shared by the machines running its shards (defaults to a new one).
+        """
+        self.output_dir = output_dir or config.MASTER_S3_DIR
+        self.shards = shards or config.ETL_SHARDS
+        self.key = key or config.ETL_SHARD_KEY
+        self.workers = max(1, workers or config.ETL_SHARD_WORKERS)
+        self.sources = list(sources or SOURCES)
+        self.profile = profile
+        self.report = RunReport('etl')
+        self.run_id = run_id or self.report.run_id
+
+    def tasks(self, shard_ids: list = None) -> list:
+        """
+        List the (source, shard) tasks of the run.
+
+        :param shard_ids: Shards to list (defaults to all of them).
+        :return: List of (source, shard) tuples.
+        """
+        return [(source, shard) for source in self.sources for shard in (shard_ids or range(self.shards))]
+
+    def run_shards(self, shard_ids: list = None) -> list:
+        """
+        Build shards of every source on the pool of worker processes.
+
+        The landing area is listed once, and its listing shared with the workers. The threads and memory
+        limit of the DuckDB profile are divided between the workers (see `split_duckdb_settings`).
+
+        :param shard_ids: Shards to build on this machine (defaults to all of them).
+        :return: Results of the shards, as returned by `run_shard`.
+        """
+        tasks = self.tasks(shard_ids)
+        results = []
+        with self.report.stage('shard') as stage:
+            index = LandingIndex().refresh()
+            workers = max(1, min(self.workers, len(tasks)))
+            settings = split_duckdb_settings(workers, self.profile)
+            logger.info(f"Each of the {workers} workers runs DuckDB with {settings}")
+            arguments = [
+                (source, shard, self.shards, self.run_id, self.output_dir, self.key, index, self.profile, settings)
+                for source, shard in tasks
+            ]
+
+            if self.workers == 1:
+                results = [run_shard(*args) for args in arguments]
+            else:
+                # Spawned workers, as forking a process that runs DuckDB threads is not safe
+                executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'))
+                try:
+                    futures = [executor.submit(run_shard, *args) for args in arguments]
+                    for future in as_completed(futures):
+                        results.append(future.result())
+                finally:
+                    executor.shutdown(cancel_futures=True)
+
+            for result in results:
+                self.report.add({
+                    'stage': 'shard', 'source': f"{result['source']}-{result['shard']}", 'status': 'success',
+                    'rows': result['rows'], 'seconds': result['seconds'],
+                })
+            stage.update(run_id=self.run_id, tasks=len(tasks), workers=self.workers, rows=sum(result['rows'] for result in results))
+
+        logger.info(f"Built {len(tasks)} shards of run {self.run_id} with {self.workers} workers.")
+        return results
+
+    def commit(self) -> dict:
+        """
+        Commit the shards of the run into the partitioned master dataset, as a new snapshot.
+
+        The data-quality gate checks the metrics of each source combined over its shards: a failed source
+        stops the commit, and the files of a quarantined source are copied to the quarantine folder and left
+        out (the snapshot keeps its files from the previous snapshot). The files of the other sources are
+        moved into the snapshot's directory, then the snapshot is published (see `SnapshotStore.commit`):
+        readers see either the previous or the new files. Expired snapshots are deleted last.
+
+        :return: The manifest of the snapshot.
+        :raises RuntimeError: If a shard of the run is missing.
+        :raises ValueError: If a source failed the data-quality checks.
+        """
+        store = SnapshotStore(self.output_dir)
+        fs, root = store.fs, store.root
+        run_root = f'{root}/{SHARD_DIR}/{self.run_id}'
+        with self.report.stage('commit') as stage:
+            results = {}
+            missing = []
+            for source, shard in self.tasks():
+                path = f'{run_root}/_results/{source}-{shard}.json'
+                if fs.exists(path):
+                    results[(source, shard)] = json.loads(fs.cat_file(path))
+                else:
+                    missing.append(f'{source}-{shard}')
+            if missing:
+                raise RuntimeError(f"Shards {missing} of run {self.run_id} are missing, not committing")
+
+            sources = list(self.sources)
+            if config.QUALITY_GATE:
+                metrics = {
+                    source: QualityGate.combine([result['metrics'] for (name, _), result in results.items() if name == source])
+                    for source in sources
+                }
+                checks = QualityGate().evaluate(metrics, sources)
+                for source, check in checks.items():
+                    self.report.add({'stage': 'validate', 'source': source, **check})
+
+                failed = [source for source, check in checks.items() if check['status'] == 'failed']
+                if failed:
+                    raise ValueError(f"Sources {failed} failed the data-quality checks")
+
+                quarantined = [source for source, check in checks.items() if check['status'] == 'quarantined']
+                for source in quarantined:
+                    local_dir = os.path.join(config.QUALITY_QUARANTINE_DIR, self.run_id, source)
+                    partition = f'{run_root}/{config.MASTER_PARTITION_BY[0]}={source}'
+                    if fs.exists(partition):
+                        fs.get(f'{partition}/', f'{local_dir}/', recursive=True)
+                    logger.info(f"Rows of source '{source}' quarantined in {local_dir}")
+                sources = [source for source in sources if source not in quarantined]
+                if not sources:
+                    raise ValueError("Every source was quarantined by the data-quality checks")
+
+            # The partitions of the other sources are kept from the previous snapshot
+            parent = store.load()
+            kept = []
+            if parent is not None and 'master' in parent['tables']:
+                for entry in parent['tables']['master']['files']:
+                    database = entry['columns'].get('database', {})
+                    if database.get('min') == database.get('max') and database.get('min') not in sources:
+                        kept.append(entry)
+            previous_sources = parent['properties'].get('sources', {}) if parent is not None else {}
+            kept_sources = sorted({entry['columns']['database']['min'] for entry in kept})
+
+            # Move the new files into the snapshot: their names are unique to the run, so nothing is overwritten
+            snapshot_id = new_snapshot_id()
+            data_dir = f'{root}/{config.MASTER_SNAPSHOT_DIR}/{snapshot_id}'
+            new_files = [
+                path[len(run_root) + 1:] for path in fs.find(run_root)
+                if partition_values(path[len(run_root) + 1:]).get('database') in sources
+            ]
+            def move(rel):
+                fs.makedirs(os.path.dirname(f'{data_dir}/{rel}'), exist_ok=True)
+                fs.mv(f'{run_root}/{rel}', f'{data_dir}/{rel}')
+
+            con = duckdb_connect()
+            try:
+                with ThreadPoolExecutor(max_workers=config.DOWNLOAD_MAX_WORKERS) as executor:
+                    list(executor.map(move, new_files))
+
+                if self.output_dir.startswith('s3://'):
+                    con.register_filesystem(fs)
+                manifest = store.commit(
+                    snapshot_id, con, store.files(snapshot_id), kept,
+                    parent_id=parent['snapshot_id'] if parent else None, operation='etl-sharded',
+                    properties={
+                        'run_id': self.run_id,
+                        'sources': {
+                            **{source: entry for source, entry in previous_sources.items() if source in kept_sources},
+                            **{
+                                source: {
+                                    'run_id': self.run_id, 'shards': self.shards, 'shard_key': self.key,
+                                    'rows': sum(result['rows'] for (name, _), result in results.items() if name == source),
+                                }
+                                for source in sources
+                            },
+                        },
+                    },
+                )
+
+            except Exception:
+                store.discard(snapshot_id)
+                raise
+
+            finally:
+                con.close()
+
+            store.expire()
+            fs.rm(run_root, recursive=True)
+            stage.update(run_id=self.run_id, snapshot_id=snapshot_id, sources=sources, files=len(new_files) + len(kept))
+
+        logger.info(f"Committed run {self.run_id} to {self.output_dir} as snapshot {snapshot_id}: sources {sources}, {len(new_files)} new files.")
+        return manifest
+
+    def run(self) -> dict:
+        """
+        Build every shard on this machine and commit them.
+
+        :return: The manifest.
+        """
+        try:
+            self.run_shards()
+            return self.commit()
+
+        except Exception:
+            # Nothing was committed: drop the shards of the failed run
+            fs, root = get_filesystem(self.output_dir)
+            run_root = f'{root}/{SHARD_DIR}/{self.run_id}'
+            if fs.exists(run_root):
+                fs.rm(run_root, recursive=True)
+            raise
+
+        finally:
+            self.report.save()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run the ETL sharded across processes or machines, and commit the shards with a manifest.")
+    parser.add_argument('--output', help="Local or S3 directory of the partitioned master (defaults to the S3 staging area)")
+    parser.add_argument('--shards', type=int, help="Number of shards of each source (defaults to ETL_SHARDS)")
+    parser.add_argument('--key', choices=SHARD_KEYS, help="Column the rows are sharded on (defaults to ETL_SHARD_KEY)")
+    parser.add_argument('--workers', type=int, help="Number of worker processes (defaults to ETL_SHARD_WORKERS)")
+    parser.add_argument('--sources', nargs='+', help="Sources to build (defaults to all of them)")
+    parser.add_argument('--profile', help="DuckDB runtime profile (a key of config.DUCKDB_PROFILES, defaults to DUCKDB_PROFILE)")
+    parser.add_argument('--run-id', help="Identifier of a run spread over several machines")
+    parser.add_argument('--shard', type=int, action='append', help="Only build this shard, without committing (repeatable)")
+    parser.add_argument('--commit', action='store_true', help="Only commit the shards of --run-id")
+    args = parser.parse_args()
+    if args.commit and not args.run_id:
+        parser.error("--commit requires the --run-id of the shards to commit")
+    set_duckdb_profile(args.profile)
+
+    etl = ShardedETL(args.output, args.shards, args.key, args.workers, args.sources, args.profile, args.run_id)
+    if args.commit:
+        try:
+            etl.commit()
+        finally:
+            etl.report.save()
+    elif args.shard:
+        try:
+            etl.run_shards(args.shard)
+            logger.info(f"Commit with --commit --run-id {etl.run_id} once every shard is built.")
+        finally:
+            etl.report.save()
+    else:
+        etl.run()
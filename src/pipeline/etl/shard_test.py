@@ -0,0 +1,80 @@
+import io
+import os
+import ibis
+import pytest
+import pandas as pd
+import pipeline.config as config
+from pipeline.bench.local_s3 import local_s3
+from pipeline.etl.shard import ShardedETL
+from pipeline.snapshots import SnapshotStore
+
+def put_table(client, key: str, frame: pd.DataFrame) -> None:
+    buffer = io.BytesIO()
+    frame.to_parquet(buffer)
+    client.put_object(Bucket=config.S3_BUCKET_NAME, Key=f'{config.LANDING_AREA_FOLDER}/{key}', Body=buffer.getvalue())
+
+def put_landing(client, wdi_value: float = 1.0, wdi_label: str = 'A') -> None:
+    put_table(client, 'wdi/WDICSV.parquet', pd.DataFrame({
+        'Country Code': ['KEN', 'NGA', 'KEN'], 'Indicator Code': ['A', 'A', 'B'], '2001': [wdi_value, 2.0, 3.0]
+    }))
+    put_table(client, 'wdi/WDISeries.parquet', pd.DataFrame({'Series Code': [wdi_label, 'B'], 'Indicator Name': ['a', 'b']}))
+    put_table(client, 'edu/SDG_DATA_NATIONAL.parquet', pd.DataFrame({
+        'indicator_id': ['S', 'T'], 'country_id': ['KEN', 'KEN'], 'year': [2001, 2002], 'value': [4.0, 5.0]
+    }))
+    put_table(client, 'edu/SDG_LABEL.parquet', pd.DataFrame({'indicator_id': ['S', 'T'], 'indicator_label_en': ['s', 't']}))
+
+def committed_rows(output_dir: str) -> list:
+    master = SnapshotStore(output_dir).read(ibis.duckdb.connect())
+    return sorted(master.select('database', 'indicator_id', 'country_id', 'year', 'value').execute().itertuples(index=False, name=None))
+
+@pytest.fixture
+def landing(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'LANDING_INDEX_PATH', str(tmp_path / 'landing_index.json'))
+    monkeypatch.setattr(config, 'QUALITY_QUARANTINE_DIR', str(tmp_path / 'quarantine'))
+    with local_s3(str(tmp_path / 's3')) as client:
+        put_landing(client)
+        yield client
+
+def sharded_etl(tmp_path, sources: list, **kwargs) -> ShardedETL:
+    etl = ShardedETL(str(tmp_path / 'master'), shards=2, workers=1, sources=sources, **kwargs)
+    etl.report.enabled = False
+    return etl
+
+def test_commit_publishes_the_shards_and_keeps_the_other_sources(tmp_path, landing):
+    sharded_etl(tmp_path, ['wdi', 'sdg']).run()
+    assert committed_rows(str(tmp_path / 'master')) == [
+        ('sdg', 'S', 'KEN', 2001, 4.0), ('sdg', 'T', 'KEN', 2002, 5.0),
+        ('wdi', 'A', 'KEN', 2001, 1.0), ('wdi', 'A', 'NGA', 2001, 2.0), ('wdi', 'B', 'KEN', 2001, 3.0),
+    ]
+
+    put_landing(landing, wdi_value=9.0)
+    sharded_etl(tmp_path, ['wdi']).run()
+
+    assert committed_rows(str(tmp_path / 'master')) == [
+        ('sdg', 'S', 'KEN', 2001, 4.0), ('sdg', 'T', 'KEN', 2002, 5.0),
+        ('wdi', 'A', 'KEN', 2001, 9.0), ('wdi', 'A', 'NGA', 2001, 2.0), ('wdi', 'B', 'KEN', 2001, 3.0),
+    ]
+    assert os.listdir(tmp_path / 'master' / '_shards') == []
+
+def test_commit_fails_while_a_shard_is_missing(tmp_path, landing):
+    etl = sharded_etl(tmp_path, ['wdi'])
+    etl.run_shards([0])
+
+    with pytest.raises(RuntimeError, match=r"Shards \['wdi-1'\]"):
+        sharded_etl(tmp_path, ['wdi'], run_id=etl.run_id).commit()
+
+    sharded_etl(tmp_path, ['wdi'], run_id=etl.run_id).run_shards([1])
+    sharded_etl(tmp_path, ['wdi'], run_id=etl.run_id).commit()
+    assert len(committed_rows(str(tmp_path / 'master'))) == 3
+
+def test_quarantined_source_is_left_out_of_the_commit(tmp_path, landing, monkeypatch):
+    # Indicator A of wdi finds no label: 2 of its 3 rows miss one, above the default max_label_miss_rate
+    monkeypatch.setenv('QUALITY_WDI_ACTION', 'quarantine')
+    put_landing(landing, wdi_label='Z')
+    etl = sharded_etl(tmp_path, ['wdi', 'sdg'])
+
+    etl.run()
+
+    assert [row[0] for row in committed_rows(str(tmp_path / 'master'))] == ['sdg', 'sdg']
+    quarantined = pd.read_parquet(os.path.join(tmp_path, 'quarantine', etl.run_id, 'wdi'))
+    assert len(quarantined) == 3
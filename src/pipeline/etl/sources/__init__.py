@@ -1,2 +1,4 @@
 from pipeline.etl.sources.wdi import process_wdi_data
-from pipeline.etl.sources.edu import process_edu_data
\ No newline at end of file
+from pipeline.etl.sources.edu import process_edu_data
+from pipeline.etl.sources.reshape import wide_to_long
+from pipeline.etl.sources.registry import SOURCES, MASTER_SCHEMA, register_source, source_tables
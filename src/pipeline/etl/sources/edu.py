@@ -3,9 +3,10 @@ import logging
 
 logger = logging.getLogger(__name__)
 
-def process_edu_data(connection, data, label, dataset_name):
+def process_edu_data(connection, data, label, dataset_name, available_tables=None):
     """Process EDU data (e.g., OPRI or SDG) and return the transformed Ibis table."""
-    if data not in connection.list_tables() or label not in connection.list_tables():
+    tables = connection.list_tables() if available_tables is None else available_tables
+    if data not in tables or label not in tables:
         logger.error(f"Skipping {dataset_name.upper()} processing as one or both tables do not exist.")
         return None
     
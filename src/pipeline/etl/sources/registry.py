@@ -0,0 +1,107 @@
+from pipeline.etl.sources.wdi import process_wdi_data
+from pipeline.etl.sources.edu import process_edu_data
+
+# Output contract of every source processor: the columns (and types) of the master table
+MASTER_SCHEMA = {
+    'country_id': 'string',
+    'indicator_id': 'string',
+    'year': 'int64',
+    'value': 'float64',
+    'indicator_label': 'string',
+    'database': 'string',
+}
+
+# Sources of the master table. Each source declares:
+# - processor: function building the source's table, called with `connection` and `kwargs`
+# - kwargs: arguments of the processor
+# - tables: landing tables read by the processor, with the snake_case columns it needs
+#           (None keeps every column; DuckDB still only reads the columns a query references)
+# - depends_on: other sources whose output the processor reads, as tables named `source_<name>`
+# - output: the schema the processor's table must have
+# - shard_columns: for each master key column, the snake_case columns of the landing tables whose values
+#                  become that column unchanged; a sharded run filters these tables instead of the output
+SOURCES = {}
+
+def register_source(name: str, processor, kwargs: dict, tables: dict, depends_on: list = None, output: dict = None,
+                    shard_columns: dict = None) -> None:
+    """
+    Register a source of the master table.
+
+    :param name: Name of the source, also used as its `database` value (e.g. 'wdi').
+    :param processor: Function building the source's Ibis table.
+    :param kwargs: Arguments of the processor, besides the connection.
+    :param tables: Landing tables read by the processor, mapped to the snake_case columns it needs (or None for all).
+    :param depends_on: Names of the sources whose output the processor reads.
+    :param output: Schema of the processor's table (defaults to MASTER_SCHEMA).
+    :param shard_columns: Landing table columns holding each master key column, e.g.
+                          {'indicator_id': {'wdi_WDICSV': 'indicator_code'}}.
+    """
+    SOURCES[name] = {
+        'processor': processor,
+        'kwargs': kwargs,
+        'tables': tables,
+        'depends_on': list(depends_on or []),
+        'output': output or MASTER_SCHEMA,
+        'shard_columns': shard_columns or {},
+    }
+
+register_source(
+    'wdi',
+    processor=process_wdi_data,
+    kwargs={
+        'table': 'wdi_WDICSV',
+        'label': 'wdi_WDISeries',
+        'year_start': 2000,  # Keep only >= 2000 years
+        'native': True,  # Unpivot with DuckDB's UNPIVOT
+        'drop_nulls': True  # Drop years without a value while unpivoting
+    },
+    tables={
+        'wdi_WDICSV': None,
+        'wdi_WDISeries': ['series_code', 'indicator_name'],
+    },
+    shard_columns={
+        'indicator_id': {'wdi_WDICSV': 'indicator_code', 'wdi_WDISeries': 'series_code'},
+        'country_id': {'wdi_WDICSV': 'country_code'},
+    }
+)
+
+register_source(
+    'opri',
+    processor=process_edu_data,
+    kwargs={'data': 'edu_OPRI_DATA_NATIONAL', 'label': 'edu_OPRI_LABEL', 'dataset_name': 'opri'},
+    tables={
+        'edu_OPRI_DATA_NATIONAL': ['indicator_id', 'country_id', 'year', 'value'],
+        'edu_OPRI_LABEL': ['indicator_id', 'indicator_label_en'],
+    },
+    shard_columns={
+        'indicator_id': {'edu_OPRI_DATA_NATIONAL': 'indicator_id', 'edu_OPRI_LABEL': 'indicator_id'},
+        'country_id': {'edu_OPRI_DATA_NATIONAL': 'country_id'},
+    }
+)
+
+register_source(
+    'sdg',
+    processor=process_edu_data,
+    kwargs={'data': 'edu_SDG_DATA_NATIONAL', 'label': 'edu_SDG_LABEL', 'dataset_name': 'sdg'},
+    tables={
+        'edu_SDG_DATA_NATIONAL': ['indicator_id', 'country_id', 'year', 'value'],
+        'edu_SDG_LABEL': ['indicator_id', 'indicator_label_en'],
+    },
+    shard_columns={
+        'indicator_id': {'edu_SDG_DATA_NATIONAL': 'indicator_id', 'edu_SDG_LABEL': 'indicator_id'},
+        'country_id': {'edu_SDG_DATA_NATIONAL': 'country_id'},
+    }
+)
+
+def source_tables(names: list = None) -> dict:
+    """
+    Return the landing tables read by the given sources, with the columns they need.
+
+    :param names: Names of the sources (defaults to every registered source).
+    :return: Mapping of table names to the snake_case columns to read (None for all columns).
+    """
+    tables = {}
+    for name, spec in SOURCES.items():
+        if names is None or name in names:
+            tables.update(spec['tables'])
+    return tables
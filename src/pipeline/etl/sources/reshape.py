@@ -0,0 +1,41 @@
+import ibis
+import logging
+
+logger = logging.getLogger(__name__)
+
+def year_columns(columns, year_start: int = None) -> list:
+    """Return the columns named after a year (e.g. '1960'), keeping only years >= year_start if given."""
+    return [
+        column for column in columns
+        if column.strip().isdigit() and (year_start is None or int(column) >= year_start)
+    ]
+
+def wide_to_long(connection, table, id_columns, value_columns, names_to="name", values_to="value", native=False, drop_nulls=False):
+    """
+    Reshape a wide table into a long one, reading only the id and value columns.
+
+    The Ibis path uses `pivot_longer`; the native path runs DuckDB's `UNPIVOT`, which drops nulls while
+    reshaping instead of building and then filtering out the null rows.
+    Columns are referenced by their names in `table`, before any renaming.
+    """
+    if not value_columns:
+        raise ValueError(f"No value columns to unpivot in table '{table}'")
+
+    if native:
+        quote = lambda column: '"' + column.replace('"', '""') + '"'
+        nulls = "" if drop_nulls else " INCLUDE NULLS"
+        query = f"""
+            SELECT * FROM (SELECT {", ".join(quote(c) for c in [*id_columns, *value_columns])} FROM {quote(table)})
+            UNPIVOT{nulls} ({quote(values_to)} FOR {quote(names_to)} IN ({", ".join(quote(c) for c in value_columns)}))
+        """
+        return connection.sql(query)
+
+    long = (
+        connection.table(table)
+        .select(*id_columns, *value_columns)
+        .pivot_longer(value_columns, names_to=names_to, values_to=values_to)
+    )
+    if drop_nulls:
+        long = long.filter(long[values_to].notnull())
+
+    return long
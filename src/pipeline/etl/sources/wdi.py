@@ -1,28 +1,41 @@
 import ibis
-from ibis import _
-import ibis.selectors as s
 import logging
+from pipeline.etl.sources.reshape import wide_to_long, year_columns
+from pipeline.utils import snake_case
 
 logger = logging.getLogger(__name__)
 
-def process_wdi_data(connection, table, label, year_start):
-    """Process WDI data and return the transformed Ibis table."""
-    if table not in connection.list_tables() or label not in connection.list_tables():
+def process_wdi_data(connection, table, label, year_start, native=False, drop_nulls=False, available_tables=None):
+    """
+    Process WDI data and return the transformed Ibis table.
+
+    Only the year columns >= year_start are unpivoted. With `native`, the reshape runs as a DuckDB
+    UNPIVOT; with `drop_nulls`, years without a value are dropped during the reshape.
+    `available_tables` avoids listing the connection's tables when the caller already knows them.
+    """
+    tables = connection.list_tables() if available_tables is None else available_tables
+    if table not in tables or label not in tables:
         logger.error(f"Skipping WDI processing as one or more tables do not exist.")
         return None
     
     try:
+        columns = connection.table(table).columns
+        id_columns = [column for column in columns if snake_case(column) in ("country_code", "indicator_code")]
+
         wdi_data = (
-            connection.table(table)
-            .rename("snake_case")
-            .pivot_longer(
-                s.r["1960":],
+            wide_to_long(
+                connection,
+                table,
+                id_columns=id_columns,
+                value_columns=year_columns(columns, year_start),
                 names_to="year",
-                values_to="value"
+                values_to="value",
+                native=native,
+                drop_nulls=drop_nulls
             )
-            .cast({"year": "int64"})
-            .filter(_.year >= year_start)
+            .rename("snake_case")
             .rename(country_id="country_code", indicator_id="indicator_code")
+            .cast({"year": "int64"})
         )
 
         wdi_label = (
@@ -36,7 +49,6 @@ def process_wdi_data(connection, table, label, year_start):
             .join(wdi_label, wdi_data.indicator_id == wdi_label.indicator_id, how="left")
             .select("country_id", "indicator_id", "year", "value", "indicator_label")
             .mutate(database=ibis.literal("wdi"))
-            .cast({"year": "int64"})
         )
 
         logger.info(f"WDI data from table '{table}' successfully processed.")
@@ -0,0 +1,43 @@
+import ibis
+import pandas as pd
+from pipeline.etl.sources.wdi import process_wdi_data
+
+def wdi_tables():
+    con = ibis.duckdb.connect()
+    con.create_table('wdi_WDICSV', pd.DataFrame({
+        'Country Code': ['KEN', 'NGA'],
+        'Indicator Code': ['A', 'B'],
+        '1999': [1.0, 2.0],
+        '2000': [3.0, None],
+        '2001': [None, 4.0]
+    }))
+    con.create_table('wdi_WDISeries', pd.DataFrame({'Series Code': ['A', 'B'], 'Indicator Name': ['a', 'b']}))
+    return con
+
+def rows(con, **kwargs) -> list:
+    wdi = process_wdi_data(con, 'wdi_WDICSV', 'wdi_WDISeries', year_start=2000, **kwargs)
+    result = wdi.execute()
+    return sorted(result.astype(object).where(result.notna(), None).itertuples(index=False, name=None), key=str)
+
+def test_only_years_from_year_start_are_unpivoted():
+    assert rows(wdi_tables()) == sorted([
+        ('KEN', 'A', 2000, 3.0, 'a', 'wdi'), ('KEN', 'A', 2001, None, 'a', 'wdi'),
+        ('NGA', 'B', 2000, None, 'b', 'wdi'), ('NGA', 'B', 2001, 4.0, 'b', 'wdi')
+    ], key=str)
+
+def test_null_values_are_dropped_during_the_reshape():
+    expected = [('KEN', 'A', 2000, 3.0, 'a', 'wdi'), ('NGA', 'B', 2001, 4.0, 'b', 'wdi')]
+
+    assert rows(wdi_tables(), drop_nulls=True) == expected
+    assert rows(wdi_tables(), native=True, drop_nulls=True) == expected
+
+def test_native_unpivot_matches_ibis():
+    con = wdi_tables()
+
+    assert rows(con, native=True) == rows(con)
+
+def test_missing_tables_are_skipped():
+    con = wdi_tables()
+    con.drop_table('wdi_WDISeries')
+
+    assert process_wdi_data(con, 'wdi_WDICSV', 'wdi_WDISeries', year_start=2000) is None
@@ -0,0 +1,177 @@
+import os
+import sys
+import json
+import inspect
+import hashlib
+from pipeline.utils import setup_logger, landing_table_name
+import pipeline.config as config
+
+# Set up logging
+logger = setup_logger(__name__)
+
+# Package of the source processors: the modules of a processor that are part of it count as its code
+SOURCES_PACKAGE = 'pipeline.etl.sources'
+
+def source_modules(processor) -> list:
+    """
+    List the modules holding the code of a source processor: its own module, the modules of the sources
+    package it imports (directly or not, e.g. the shared reshape helpers) and the source registry.
+
+    The imports of the registry, i.e. the other processors, are not followed.
+
+    :param processor: The source's processor function.
+    :return: The modules, sorted by name.
+    """
+    registry = sys.modules[f'{SOURCES_PACKAGE}.registry']
+    modules = {registry.__name__: registry}
+    pending = [inspect.getmodule(processor)]
+    while pending:
+        module = pending.pop()
+        if module.__name__ in modules:
+            continue
+        modules[module.__name__] = module
+        for value in vars(module).values():
+            name = value.__name__ if inspect.ismodule(value) else getattr(value, '__module__', None)
+            if isinstance(name, str) and name.startswith(f'{SOURCES_PACKAGE}.') and name in sys.modules:
+                pending.append(sys.modules[name])
+    return [modules[name] for name in sorted(modules)]
+
+def code_fingerprint(spec: dict) -> str:
+    """
+    Fingerprint the transform code of a master table source: the source of its processor's modules
+    (see `source_modules`), its arguments and its registry declaration (input tables and output schema).
+
+    :param spec: The source's entry in the source registry (pipeline.etl.sources.SOURCES).
+    :return: SHA-256 hex digest of the processor code and arguments.
+    """
+    module_sources = "\n".join(inspect.getsource(module) for module in source_modules(spec['processor']))
+    arguments = json.dumps(
+        {key: spec.get(key) for key in ('kwargs', 'tables', 'depends_on', 'output')}, sort_keys=True, default=str
+    )
+    return hashlib.sha256(f"{module_sources}\n{arguments}".encode('utf-8')).hexdigest()
+
+def output_layout() -> dict:
+    """
+    The settings that decide the shape and location of the master outputs, recorded with the ETL state:
+    the outputs of an incremental run can only be merged with outputs written with the same settings.
+
+    :return: The layout, model, partitioning, publishing and persistence settings.
+    """
+    return {
+        'layout': config.MASTER_LAYOUT,
+        'model': config.MASTER_MODEL,
+        'partition_by': list(config.MASTER_PARTITION_BY),
+        'year_bucket': config.MASTER_YEAR_BUCKET,
+        'publish': config.MASTER_PUBLISH,
+        'db_mode': config.MASTER_DB_MODE,
+        'local': config.LOCAL,
+    }
+
+class ETLState:
+    """
+    Persisted record of the inputs and transform code each master table source was last built from,
+    and of the output settings (`output_layout`) the master outputs were written with.
+
+    Used by the incremental ETL to rebuild only the sources whose landing files or code changed.
+    """
+
+    def __init__(self, local_path: str = None) -> None:
+        """
+        Initialize the ETL state.
+
+        :param local_path: Local path of the state file (defaults to config.ETL_STATE_PATH).
+        """
+        self.local_path = local_path or config.ETL_STATE_PATH
+        self.layout = None
+        self.sources = {}
+
+    def load(self) -> dict:
+        """
+        Load the ETL state from disk.
+
+        A state file written before the output settings were recorded loads with no layout, so the next
+        incremental run rebuilds the full master table.
+
+        :return: The recorded fingerprint of each source.
+        """
+        try:
+            if os.path.isfile(self.local_path):
+                with open(self.local_path) as f:
+                    state = json.load(f)
+                if 'sources' in state and 'layout' in state:
+                    self.layout, self.sources = state['layout'], state['sources']
+                else:
+                    self.layout, self.sources = None, state
+                logger.info(f"Loaded ETL state for sources {list(self.sources)} from {self.local_path}")
+
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable ETL state {self.local_path}: {e}")
+            self.layout, self.sources = None, {}
+
+        return self.sources
+
+    def save(self) -> None:
+        """
+        Write the ETL state to disk.
+        """
+        try:
+            os.makedirs(os.path.dirname(self.local_path), exist_ok=True)
+            tmp_path = f'{self.local_path}.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump({"layout": self.layout, "sources": self.sources}, f, indent=2, sort_keys=True)
+            os.replace(tmp_path, self.local_path)
+
+        except Exception as e:
+            logger.error(f"Error saving ETL state: {e}", exc_info=True)
+            raise
+
+    def fingerprint(self, spec: dict, file_metadata: dict) -> dict:
+        """
+        Compute the current fingerprint of a source from the landing objects it reads and its transform code.
+
+        :param spec: The source's entry in the source registry (pipeline.etl.sources.SOURCES).
+        :param file_metadata: Landing file metadata by source folder and file name, as returned by `LandingIndex.file_metadata`.
+        :return: Dictionary with the ETag and size of each input table and the code fingerprint.
+        """
+        objects = {
+            landing_table_name(folder, name): metadata
+            for folder, files in file_metadata.items()
+            for name, metadata in files.items()
+        }
+        inputs = {
+            table: {"etag": objects[table]["etag"], "size": objects[table]["size"]} if table in objects else None
+            for table in spec['tables']
+        }
+        return {"inputs": inputs, "code": code_fingerprint(spec)}
+
+    def changed_sources(self, fingerprints: dict) -> list:
+        """
+        Return the sources whose fingerprint differs from the recorded one.
+
+        :param fingerprints: Current fingerprint of each source, as returned by `fingerprint`.
+        :return: Names of the sources that need to be rebuilt.
+        """
+        return [name for name, fingerprint in fingerprints.items() if self.sources.get(name) != fingerprint]
+
+    def same_layout(self) -> bool:
+        """
+        Whether the master outputs were last written with the current output settings.
+
+        :return: False if any setting of `output_layout` changed, or if no layout was recorded.
+        """
+        return self.layout == output_layout()
+
+    def reset(self) -> None:
+        """
+        Forget every recorded source, and record the current output settings: for a run rewriting the full master outputs.
+        """
+        self.layout = output_layout()
+        self.sources = {}
+
+    def record(self, fingerprints: dict) -> None:
+        """
+        Record the fingerprints of successfully rebuilt sources.
+
+        :param fingerprints: Fingerprint of each rebuilt source.
+        """
+        self.sources.update(fingerprints)
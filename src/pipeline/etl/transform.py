@@ -1,5 +1,6 @@
 import ibis
-from pipeline.etl.sources import process_wdi_data, process_edu_data
+from pipeline.etl.sources import SOURCES
+from pipeline.etl.scheduler import SourceScheduler
 from pipeline.utils import setup_logger
 
 # Set up logging
@@ -7,47 +8,38 @@ logger = setup_logger(__name__)
 
 class DataTransformer:
     """A class to handle dataset transformations."""
+
+    # Sources of the master table, as declared in the source registry
+    SOURCES = SOURCES
     
-    def __init__(self, con) -> None:
+    def __init__(self, con, report=None) -> None:
         """
         Initialize the DataTransformer class.
 
         :param con: The connection object to the DuckDB instance.
+        :param report: Run report recording each source (optional).
         """
         self.connection = con
+        self.report = report
+        self.processed_sources = []
     
-    def create_master_table(self) -> ibis.Expr:
+    def create_master_table(self, sources: list = None, arrivals=None) -> ibis.Expr:
         """
-        Create and return the master table by unioning WDI, OPRI, and SDG datasets.
+        Create and return the master table by unioning the datasets of the registered sources (WDI, OPRI, and SDG).
 
+        :param sources: Names of the sources to include (defaults to every source in SOURCES).
+        :param arrivals: Queue of landing tables made available while the sources run (see `SourceScheduler.run`).
         :return: A unioned Ibis table expression containing data from all valid datasets.
         :raises ValueError: If no valid datasets are found.
         """
-        
-        wdi = process_wdi_data(
-            connection=self.connection,
-            table='wdi_WDICSV',
-            label='wdi_WDISeries',
-            year_start=2000 # Keep only >= 2000 years
-        )
-
-        opri = process_edu_data(
-            connection=self.connection,
-            data='edu_OPRI_DATA_NATIONAL', 
-            label='edu_OPRI_LABEL', 
-            dataset_name='opri'
-        )
-
-        sdg = process_edu_data(
-            connection=self.connection,
-            data='edu_SDG_DATA_NATIONAL', 
-            label='edu_SDG_LABEL', 
-            dataset_name='sdg'
-        )
+        sources = sources or list(self.SOURCES)
+
+        # Process (and materialize) independent sources concurrently
+        datasets = SourceScheduler(self.connection, report=self.report).run(sources, arrivals=arrivals)
 
         # Only union the datasets that were processed successfully
-        datasets = [wdi, opri, sdg]
-        valid_datasets = [ds for ds in datasets if ds is not None]
+        self.processed_sources = [name for name, ds in datasets.items() if ds is not None]
+        valid_datasets = [datasets[name] for name in self.processed_sources]
 
         if not valid_datasets:
             logger.error("No valid datasets available to create the master table.")
@@ -55,4 +47,4 @@ class DataTransformer:
 
         # Union only the valid datasets
         master = ibis.union(*valid_datasets)
-        return master
\ No newline at end of file
+        return master
@@ -0,0 +1,179 @@
+from __future__ import annotations
+
+import os
+import json
+import hashlib
+from typing import TYPE_CHECKING
+from pipeline.utils import setup_logger
+import pipeline.config as config
+
+if TYPE_CHECKING:
+    import boto3
+
+# Setup
+logger = setup_logger(__name__)
+
+def file_fingerprint(local_file_path: str, with_hash: bool = True) -> dict:
+    """
+    Compute the fingerprint of a local file: size, modification time and (optionally) a SHA-256 content hash.
+
+    :param local_file_path: Path to the local file.
+    :param with_hash: Whether to read the file and compute its content hash.
+    :return: Dictionary with the size, mtime and sha256 of the file.
+    """
+    stat = os.stat(local_file_path)
+    fingerprint = {"size": stat.st_size, "mtime": stat.st_mtime, "sha256": None}
+
+    if with_hash:
+        digest = hashlib.sha256()
+        with open(local_file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+        fingerprint["sha256"] = digest.hexdigest()
+
+    return fingerprint
+
+class IngestManifest:
+    """
+    Persisted record of the raw files already ingested, stored locally and mirrored next to the landing prefix.
+
+    Entries are keyed by the raw file path relative to the raw data directory (e.g. 'edu/OPRI_LABEL.csv').
+    Entries loaded from the S3 mirror, i.e. recorded by another machine, are marked as inherited until the
+    file is found in this machine's raw data directory: their landing objects are never removed as deleted.
+    """
+
+    def __init__(self, s3_client: boto3.client = None, local_path: str = None, s3_key: str = None) -> None:
+        """
+        Initialize the manifest.
+
+        :param s3_client: The boto3 S3 client used to mirror the manifest (if None, the manifest is only kept locally).
+        :param local_path: Local path of the manifest file (defaults to config.INGEST_MANIFEST_PATH).
+        :param s3_key: S3 key of the mirrored manifest (defaults to config.INGEST_MANIFEST_S3_KEY).
+        """
+        self.s3_client = s3_client
+        self.local_path = local_path or config.INGEST_MANIFEST_PATH
+        self.s3_key = s3_key or config.INGEST_MANIFEST_S3_KEY
+        self.entries = {}
+
+    def load(self) -> dict:
+        """
+        Load the manifest from the local file, falling back to the copy mirrored in S3.
+
+        :return: The manifest entries.
+        """
+        try:
+            if os.path.isfile(self.local_path):
+                with open(self.local_path) as f:
+                    self.entries = json.load(f)
+                logger.info(f"Loaded ingest manifest with {len(self.entries)} entries from {self.local_path}")
+
+            elif self.s3_client is not None:
+                response = self.s3_client.get_object(Bucket=config.S3_BUCKET_NAME, Key=self.s3_key)
+                self.entries = {
+                    rel_path: {**entry, "inherited": True}
+                    for rel_path, entry in json.loads(response['Body'].read()).items()
+                }
+                logger.info(f"Loaded ingest manifest with {len(self.entries)} entries from s3://{config.S3_BUCKET_NAME}/{self.s3_key}")
+
+        except Exception as e:
+            logger.warning(f"No usable ingest manifest found, all files will be ingested: {e}")
+            self.entries = {}
+
+        return self.entries
+
+    def save(self) -> None:
+        """
+        Write the manifest to the local file and mirror it to S3.
+        """
+        try:
+            body = json.dumps(self.entries, indent=2, sort_keys=True)
+
+            os.makedirs(os.path.dirname(self.local_path), exist_ok=True)
+            tmp_path = f'{self.local_path}.tmp'
+            with open(tmp_path, 'w') as f:
+                f.write(body)
+            os.replace(tmp_path, self.local_path)
+
+            if self.s3_client is not None:
+                self.s3_client.put_object(Bucket=config.S3_BUCKET_NAME, Key=self.s3_key, Body=body.encode('utf-8'))
+
+            logger.info(f"Saved ingest manifest with {len(self.entries)} entries.")
+
+        except Exception as e:
+            logger.error(f"Error saving ingest manifest: {e}", exc_info=True)
+            raise
+
+    def check(self, rel_path: str, local_file_path: str) -> tuple:
+        """
+        Check whether a raw file changed since it was last ingested.
+
+        Size and mtime are compared first; the content is only hashed when they differ, so that
+        touched-but-identical files are not re-ingested.
+
+        :param rel_path: Path of the file relative to the raw data directory.
+        :param local_file_path: Path to the local file.
+        :return: Tuple of (changed, fingerprint).
+        """
+        entry = self.entries.get(rel_path)
+        fingerprint = file_fingerprint(local_file_path, with_hash=False)
+
+        if entry and entry["size"] == fingerprint["size"] and entry["mtime"] == fingerprint["mtime"]:
+            fingerprint["sha256"] = entry["sha256"]
+            entry.pop("inherited", None)
+            return False, fingerprint
+
+        fingerprint = file_fingerprint(local_file_path)
+        if entry and entry["size"] == fingerprint["size"] and entry["sha256"] == fingerprint["sha256"]:
+            # Same content, only the mtime moved: refresh it so the next run skips hashing
+            entry["mtime"] = fingerprint["mtime"]
+            entry.pop("inherited", None)
+            return False, fingerprint
+
+        return True, fingerprint
+
+    def landed(self, rel_path: str, landing: dict) -> bool:
+        """
+        Check whether the landing object of an ingested file is still the one the ingest wrote.
+
+        :param rel_path: Path of the file relative to the raw data directory.
+        :param landing: ETags of the objects of the landing area, by key.
+        :return: Whether the object exists, with the recorded ETag (if one was recorded).
+        """
+        entry = self.entries.get(rel_path)
+        if entry is None or entry.get("s3_key") not in landing:
+            return False
+        return entry.get("etag") is None or landing[entry["s3_key"]] == entry["etag"]
+
+    def record(self, rel_path: str, fingerprint: dict, s3_key: str, etag: str = None) -> None:
+        """
+        Record a successfully ingested file.
+
+        :param rel_path: Path of the file relative to the raw data directory.
+        :param fingerprint: Fingerprint of the raw file, as returned by `file_fingerprint`.
+        :param s3_key: S3 key of the output Parquet file.
+        :param etag: ETag of the output Parquet file.
+        """
+        self.entries[rel_path] = {**fingerprint, "s3_key": s3_key, "etag": etag}
+
+    def deleted(self, rel_paths) -> dict:
+        """
+        Return the entries whose raw file no longer exists, among those recorded on this machine.
+
+        Inherited entries are left out: a raw file ingested by another machine may just be missing here.
+
+        :param rel_paths: Relative paths of the raw files currently present.
+        :return: Dictionary of the manifest entries for deleted raw files.
+        """
+        present = set(rel_paths)
+        return {
+            rel_path: entry for rel_path, entry in self.entries.items()
+            if rel_path not in present and not entry.get("inherited")
+        }
+
+    def remove(self, rel_path: str) -> None:
+        """
+        Remove an entry from the manifest.
+
+        :param rel_path: Path of the file relative to the raw data directory.
+        """
+        self.entries.pop(rel_path, None)
@@ -0,0 +1,90 @@
+import io
+import json
+import hashlib
+import pipeline.config as config
+from pipeline.ingest.manifest import IngestManifest
+from pipeline.ingest.run import Ingest
+
+class FakeS3:
+    """Objects of the S3 bucket held in memory, for the calls made by the manifest and the removal of deleted files."""
+
+    def __init__(self) -> None:
+        self.objects = {}
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        body = Body.encode('utf-8') if isinstance(Body, str) else Body
+        self.objects[Key] = body
+        return {'ETag': f'"{hashlib.md5(body).hexdigest()}"'}
+
+    def get_object(self, Bucket, Key, **kwargs):
+        return {'Body': io.BytesIO(self.objects[Key])}
+
+    def delete_object(self, Bucket, Key, **kwargs):
+        self.objects.pop(Key, None)
+
+def landing_keys(client) -> list:
+    return sorted(key for key in client.objects if key != config.INGEST_MANIFEST_S3_KEY)
+
+def landed(client, rel_path: str) -> dict:
+    key = f"{config.LANDING_AREA_FOLDER}/{rel_path.rsplit('.', 1)[0]}.parquet"
+    etag = client.put_object(Bucket=config.S3_BUCKET_NAME, Key=key, Body=b'parquet')['ETag'].strip('"')
+    return {"size": 1, "mtime": 0.0, "sha256": "x", "s3_key": key, "etag": etag}
+
+def record(manifest: IngestManifest, rel_path: str, entry: dict) -> None:
+    manifest.record(rel_path, {key: entry[key] for key in ("size", "mtime", "sha256")}, entry["s3_key"], entry["etag"])
+
+def ingest_with(client, manifest: IngestManifest) -> Ingest:
+    # Only the S3 client and the manifest are used to remove deleted files
+    ingest = Ingest.__new__(Ingest)
+    ingest.s3_client = client
+    ingest.manifest = manifest
+    return ingest
+
+def test_entries_mirrored_by_another_machine_are_not_deleted(tmp_path):
+    client = FakeS3()
+    entries = {"edu/SDG.csv": landed(client, "edu/SDG.csv"), "wdi/WDICSV.csv": landed(client, "wdi/WDICSV.csv")}
+    client.put_object(Bucket=config.S3_BUCKET_NAME, Key=config.INGEST_MANIFEST_S3_KEY, Body=json.dumps(entries))
+
+    # Fresh checkout: no local manifest, and only the edu raw files
+    manifest = IngestManifest(client, local_path=str(tmp_path / 'manifest.json'))
+    manifest.load()
+    ingest_with(client, manifest).remove_deleted_files(["edu/SDG.csv"])
+
+    assert landing_keys(client) == ["landing/edu/SDG.parquet", "landing/wdi/WDICSV.parquet"]
+    assert set(manifest.entries) == {"edu/SDG.csv", "wdi/WDICSV.csv"}
+
+def test_entries_recorded_locally_are_deleted_with_their_raw_file(tmp_path):
+    client = FakeS3()
+    manifest = IngestManifest(client, local_path=str(tmp_path / 'manifest.json'))
+    for rel_path in ("edu/SDG.csv", "wdi/WDICSV.csv"):
+        record(manifest, rel_path, landed(client, rel_path))
+    manifest.save()
+
+    manifest = IngestManifest(client, local_path=str(tmp_path / 'manifest.json'))
+    manifest.load()
+    ingest_with(client, manifest).remove_deleted_files(["edu/SDG.csv"])
+
+    assert landing_keys(client) == ["landing/edu/SDG.parquet"]
+    assert set(manifest.entries) == {"edu/SDG.csv"}
+
+def test_nothing_is_deleted_without_raw_files(tmp_path):
+    client = FakeS3()
+    manifest = IngestManifest(client, local_path=str(tmp_path / 'manifest.json'))
+    record(manifest, "edu/SDG.csv", landed(client, "edu/SDG.csv"))
+
+    ingest_with(client, manifest).remove_deleted_files([])
+
+    assert landing_keys(client) == ["landing/edu/SDG.parquet"]
+    assert set(manifest.entries) == {"edu/SDG.csv"}
+
+def test_landing_object_must_still_be_the_one_ingested(tmp_path):
+    client = FakeS3()
+    manifest = IngestManifest(local_path=str(tmp_path / 'manifest.json'))
+    entry = landed(client, "edu/SDG.csv")
+    record(manifest, "edu/SDG.csv", entry)
+
+    assert manifest.landed("edu/SDG.csv", {entry["s3_key"]: entry["etag"]})
+    # Rewritten or deleted outside the ingest, or never ingested
+    assert not manifest.landed("edu/SDG.csv", {entry["s3_key"]: "another etag"})
+    assert not manifest.landed("edu/SDG.csv", {})
+    assert not manifest.landed("wdi/WDICSV.csv", {entry["s3_key"]: entry["etag"]})
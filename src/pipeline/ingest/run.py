@@ -1,29 +1,62 @@
 import os
 import re
+import time
+import queue
+import argparse
+import threading
 import duckdb
-from pipeline.utils import setup_logger, s3_init
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pipeline.utils import (
+    setup_logger, s3_init, DUCKDB_SETTINGS, get_duckdb_profile, set_duckdb_profile, configure_duckdb, duckdb_connect,
+    split_duckdb_settings
+)
+from pipeline.ingest.manifest import IngestManifest
+from pipeline.ingest.schema import SchemaCache, read_header, read_csv_options
+from pipeline.report import RunReport
 import pipeline.config as config
 
 # Setup
 logger = setup_logger(__name__)
 
+def get_ingest_profile(source: str) -> dict:
+    """
+    Get the conversion profile of a source, i.e. its entry in config.INGEST_PROFILES applied on top of the default
+    profile, itself applied on top of the DuckDB runtime profile.
+
+    :param source: The raw data subfolder of the source (e.g. 'wdi').
+    :return: Dictionary with the database settings and Parquet writer options of the source.
+    """
+    return {**get_duckdb_profile(), **config.INGEST_PROFILES['default'], **config.INGEST_PROFILES.get(source, {})}
+
 class Ingest:
     def __init__(self):
         """
         Initialize the IngestProcess with S3 session and DuckDB connection.
         """
         self.s3_client, self.session = s3_init(return_session=True)
-        self.con = duckdb.connect()
+        self.con = duckdb_connect()
+        self.manifest = IngestManifest(self.s3_client)
+        self.schema_cache = SchemaCache()
+        self.report = RunReport('ingest')
+
+        # Configured DuckDB databases, keyed by the database settings of the profiles using them, and the
+        # number of them a batch opens side by side
+        self.connections = {}
+        self.connections_lock = threading.Lock()
+        self.databases = 1
 
-    def setup_s3_secret(self):
+    def setup_s3_secret(self, con=None):
         """
         Set up the S3 secret in DuckDB for S3 access.
+
+        :param con: DuckDB connection to set the secret up on (defaults to the main connection).
         """
+        con = con or self.con
         try:
             region = self.session.region_name
             credentials = self.session.get_credentials().get_frozen_credentials()
 
-            self.con.sql(f"""
+            con.sql(f"""
             CREATE SECRET my_s3_secret (
                 TYPE S3,
                 KEY_ID '{credentials.access_key}',
@@ -37,22 +70,80 @@ class Ingest:
             logger.error(f"Error setting up S3 secret: {e}")
             raise
 
-    def convert_csv_to_parquet_and_upload(self, local_file_path: str, s3_file_path: str):
+    def get_connection(self, profile: dict):
+        """
+        Get the DuckDB connection configured with the database settings of a profile.
+
+        DuckDB settings apply to a whole database, so each distinct combination of settings (memory limit,
+        spill directory, insertion order...) gets its own database (with its own S3 secret). The main
+        connection is used for the first combination requested. The threads and memory limit of each
+        database are divided by the number of databases of the batch (see `database_settings`), so that
+        together they stay within the profiles' limits.
+
+        :param profile: Ingest profile, as returned by `get_ingest_profile`.
+        :return: A configured DuckDB connection.
+        """
+        key = self.database_settings(profile)
+        with self.connections_lock:
+            if key not in self.connections:
+                if self.connections:
+                    con = duckdb.connect()
+                    self.setup_s3_secret(con)
+                else:
+                    con = self.con
+
+                settings = dict(zip(DUCKDB_SETTINGS, key))
+                if self.databases > 1:
+                    settings.update(split_duckdb_settings(self.databases, settings=settings))
+                configure_duckdb(con, settings)
+
+                logger.info(f"Configured DuckDB for ingest with settings: {settings}")
+                self.connections[key] = con
+
+            return self.connections[key]
+
+    @staticmethod
+    def database_settings(profile: dict) -> tuple:
+        """
+        :param profile: Ingest profile, as returned by `get_ingest_profile`.
+        :return: The DuckDB database settings of the profile, in the order of DUCKDB_SETTINGS.
+        """
+        return tuple(profile.get(setting) for setting in DUCKDB_SETTINGS)
+
+    def convert_csv_to_parquet_and_upload(self, local_file_path: str, s3_file_path: str, con=None, profile: dict = None, csv_options: str = 'header = true'):
         """
         Convert a CSV file to Parquet and upload it to S3.
 
+        The CSV is streamed through DuckDB, spilling to the profile's temp directory when it exceeds the
+        memory limit, and written with the profile's row group size and compression.
+
         :param local_file_path: Path to the local CSV file.
         :param s3_file_path: The S3 file path for the output Parquet file.
+        :param con: DuckDB connection or cursor to run the conversion on (defaults to the main connection).
+        :param profile: Ingest profile with the Parquet writer options (defaults to the default profile).
+        :param csv_options: Named arguments passed to `read_csv` (defaults to auto-detection with a header row).
+        :return: Number of rows written.
         """
+        con = con or self.con
+        profile = profile or get_ingest_profile('default')
         try:
-            self.con.sql(f"""
-                COPY (SELECT * FROM read_csv('{local_file_path}', header = true))
+            options = [
+                "FORMAT PARQUET",
+                f"ROW_GROUP_SIZE {profile['row_group_size']}",
+                f"COMPRESSION '{profile['compression']}'",
+            ]
+            if profile['compression'].lower() == 'zstd' and profile.get('compression_level') is not None:
+                options.append(f"COMPRESSION_LEVEL {profile['compression_level']}")
+
+            rows = con.execute(f"""
+                COPY (SELECT * FROM read_csv('{local_file_path}', {csv_options}))
                 TO '{s3_file_path}'
-                (FORMAT PARQUET)
+                ({', '.join(options)})
                 """
-            )
+            ).fetchone()[0]
 
             logger.info(f"Successfully converted and uploaded {local_file_path} to {s3_file_path}")
+            return rows
 
         except Exception as e:
             logger.error(f"Error converting and uploading {local_file_path} to S3: {e}", exc_info=True)
@@ -92,43 +183,313 @@ class Ingest:
         return file_to_s3_folder_mapping
 
 
-    def convert_and_upload_files(self):
+    def convert_with_cached_schema(self, local_file_path: str, s3_file_path: str, con, profile: dict) -> None:
+        """
+        Convert and upload a CSV file reading it with its cached schema, detecting and caching the schema first if needed.
+
+        If the cached schema no longer fits the data (e.g. a column now holds wider values), DuckDB fails the
+        read with a conversion or invalid input error: the schema is then detected again and the conversion
+        retried once. Other errors (S3, permissions, disk) are raised as they are.
+
+        :param local_file_path: Path to the local CSV file.
+        :param s3_file_path: The S3 file path for the output Parquet file.
+        :param con: DuckDB connection or cursor to run the conversion on.
+        :param profile: Ingest profile with the Parquet writer options.
+        :return: Number of rows written.
+        """
+        rel_path = os.path.relpath(local_file_path, config.RAW_DATA_DIR)
+        header = read_header(local_file_path)
+
+        entry = self.schema_cache.get(rel_path, header)
+        if entry is None:
+            entry = self.schema_cache.sniff(con, rel_path, local_file_path, header)
+            return self.convert_csv_to_parquet_and_upload(local_file_path, s3_file_path, con=con, profile=profile, csv_options=read_csv_options(entry))
+
+        try:
+            return self.convert_csv_to_parquet_and_upload(local_file_path, s3_file_path, con=con, profile=profile, csv_options=read_csv_options(entry))
+
+        except (duckdb.ConversionException, duckdb.InvalidInputException) as e:
+            logger.warning(f"Cached schema of {rel_path} does not fit its data anymore, detecting it again: {e}")
+            entry = self.schema_cache.sniff(con, rel_path, local_file_path, header)
+            return self.convert_csv_to_parquet_and_upload(local_file_path, s3_file_path, con=con, profile=profile, csv_options=read_csv_options(entry))
+
+    def convert_file(self, local_file_path: str, s3_file_path: str, source: str = 'default', spool_path: str = None) -> dict:
+        """
+        Convert and upload a single file on its own DuckDB cursor, capturing the outcome instead of raising.
+
+        The cursor shares the database (and therefore the S3 secret) configured for the source's profile.
+        The conversion is recorded in the run report, with the query profile of its COPY.
+
+        :param local_file_path: Path to the local CSV file.
+        :param s3_file_path: The S3 file path for the output Parquet file.
+        :param source: The raw data subfolder of the file, used to pick its ingest profile.
+        :param spool_path: If given, the Parquet file is written to this local path and uploaded from there,
+                           so that it can also be read locally (e.g. by a pipelined ETL).
+        :return: Dictionary with the status, elapsed seconds, input bytes, rows, output ETag and size, local
+                 Parquet path (with `spool_path`) and error (if any) of the conversion.
+        """
+        result = {
+            "s3_file_path": s3_file_path, "local_path": None, "bytes": 0, "rows": None, "s3_bytes": None,
+            "seconds": 0.0, "etag": None, "error": None
+        }
+        start = time.perf_counter()
+        profile = get_ingest_profile(source)
+        cursor = None
+        try:
+            cursor = self.get_connection(profile).cursor()
+            rel_path = os.path.relpath(local_file_path, config.RAW_DATA_DIR)
+            with self.report.source('ingest', rel_path, con=cursor) as record:
+                result["bytes"] = os.path.getsize(local_file_path)
+                if spool_path is None:
+                    result["rows"] = self.convert_with_cached_schema(local_file_path, s3_file_path, con=cursor, profile=profile)
+                else:
+                    os.makedirs(os.path.dirname(spool_path), exist_ok=True)
+                    result["rows"] = self.convert_with_cached_schema(local_file_path, spool_path, con=cursor, profile=profile)
+                    bucket, key = s3_file_path.replace('s3://', '', 1).split('/', 1)
+                    self.s3_client.upload_file(spool_path, bucket, key)
+                    result["local_path"] = spool_path
+                metadata = self.get_object_metadata(s3_file_path)
+                result["etag"], result["s3_bytes"] = metadata["etag"], metadata["size"]
+                record.update(rows=result["rows"], bytes_read=result["bytes"], s3_bytes_written=result["s3_bytes"])
+            result["status"] = "success"
+
+        except Exception as e:
+            result["status"] = "error"
+            result["error"] = str(e)
+
+        finally:
+            if cursor is not None:
+                cursor.close()
+            result["seconds"] = time.perf_counter() - start
+
+        return result
+
+    def get_object_metadata(self, s3_file_path: str) -> dict:
+        """
+        Get the ETag and size of an uploaded S3 object.
+
+        :param s3_file_path: The full S3 path of the object.
+        :return: Dictionary with the object's 'etag' and 'size' (None if they cannot be retrieved).
+        """
+        if self.s3_client is None:
+            return {"etag": None, "size": None}
+
+        bucket, key = s3_file_path.replace('s3://', '', 1).split('/', 1)
+        try:
+            response = self.s3_client.head_object(Bucket=bucket, Key=key)
+            return {"etag": response['ETag'].strip('"'), "size": response['ContentLength']}
+        except Exception as e:
+            logger.warning(f"Could not retrieve ETag for {s3_file_path}: {e}")
+            return {"etag": None, "size": None}
+
+    def landing_etags(self) -> dict:
+        """
+        List the objects of the landing area.
+
+        :return: ETags of the landing objects, by key (None without an S3 client).
+        """
+        if self.s3_client is None:
+            return None
+
+        etags = {}
+        paginator = self.s3_client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=config.S3_BUCKET_NAME, Prefix=f'{config.LANDING_AREA_FOLDER}/'):
+            for obj in page.get('Contents', []):
+                etags[obj['Key']] = obj['ETag'].strip('"')
+        return etags
+
+    def deleted_files(self, rel_paths) -> dict:
+        """
+        Return the manifest entries of the landing objects `remove_deleted_files` removes.
+
+        None are returned if no raw file was found: the raw data directory is then missing or not
+        populated on this machine, rather than emptied on purpose.
+
+        :param rel_paths: Relative paths of the raw files currently present.
+        :return: Dictionary of the manifest entries for deleted raw files.
+        """
+        rel_paths = list(rel_paths)
+        return self.manifest.deleted(rel_paths) if rel_paths else {}
+
+    def remove_deleted_files(self, rel_paths) -> None:
+        """
+        Delete the landing objects whose raw source file no longer exists, and drop them from the manifest.
+
+        :param rel_paths: Relative paths of the raw files currently present.
+        """
+        rel_paths = list(rel_paths)
+        if not rel_paths:
+            logger.warning(f"No raw file found in {config.RAW_DATA_DIR}: no landing object is removed")
+            return
+
+        for rel_path, entry in self.deleted_files(rel_paths).items():
+            try:
+                if self.s3_client is not None:
+                    self.s3_client.delete_object(Bucket=config.S3_BUCKET_NAME, Key=entry["s3_key"])
+                self.manifest.remove(rel_path)
+                logger.info(f"Removed s3://{config.S3_BUCKET_NAME}/{entry['s3_key']} as its source {rel_path} was deleted")
+
+            except Exception as e:
+                logger.error(f"Error removing landing object for deleted source {rel_path}: {e}")
+
+    def convert_and_upload_files(self, max_workers: int = None, incremental: bool = None, publish: queue.Queue = None, spool_dir: str = None) -> dict:
         """
-        Convert CSV files to Parquet and upload them to S3.
+        Convert CSV files to Parquet and upload them to S3 on a bounded pool of workers.
+
+        A failing file does not abort the batch: every file is attempted and its outcome is reported.
+        The batch and each file are recorded in the run report.
+        In incremental mode, only files that are new or changed according to the ingest manifest are
+        converted, along with those whose landing object was deleted or rewritten outside the ingest, and
+        landing objects whose source file was deleted are removed.
+
+        With `publish`, the progress of the batch is put on the queue as it happens, for a consumer running
+        alongside the ingest (e.g. a pipelined ETL): first {'event': 'planned', 's3_keys': [...], 'deleted_keys': [...]}
+        with the landing keys about to be written and those about to be removed, then {'event': 'file', 's3_key': ..., **outcome} as each file
+        finishes, and always {'event': 'done'} at the end, even if the batch failed.
+
+        :param max_workers: Maximum number of files converted at the same time (defaults to config.INGEST_MAX_WORKERS).
+        :param incremental: Whether to skip unchanged files (defaults to config.INGEST_INCREMENTAL).
+        :param publish: Queue receiving the progress of the batch.
+        :param spool_dir: If given, Parquet files are also kept locally under this directory (see `convert_file`).
+        :return: Dictionary mapping each converted local file path to the outcome returned by `convert_file`.
         """
+        max_workers = max(1, max_workers or config.INGEST_MAX_WORKERS)
+        incremental = config.INGEST_INCREMENTAL if incremental is None else incremental
+        results = {}
         try:
-            file_mapping = self.generate_file_to_s3_folder_mapping(config.RAW_DATA_DIR)
-            for file_name_csv, s3_sub_folder in file_mapping.items():
+            with self.report.stage('ingest', con=self.con) as stage:
+                file_mapping = self.generate_file_to_s3_folder_mapping(config.RAW_DATA_DIR)
+                self.manifest.load()
+                self.schema_cache.load()
+
+                jobs = {}
+                fingerprints = {}
+                landing = self.landing_etags() if incremental else None
+                for file_name_csv, s3_sub_folder in file_mapping.items():
+
+                    local_file_path = os.path.join(config.RAW_DATA_DIR, s3_sub_folder, file_name_csv)
+
+                    file_name_pq = f'{os.path.splitext(file_name_csv)[0]}.parquet'
+
+                    s3_file_path = f's3://{config.S3_BUCKET_NAME}/{config.LANDING_AREA_FOLDER}/{s3_sub_folder}/{file_name_pq}'
+
+                    if not os.path.isfile(local_file_path):
+                        logger.warning(f'File not found: {local_file_path}')
+                        continue
+
+                    rel_path = os.path.relpath(local_file_path, config.RAW_DATA_DIR)
+                    changed, fingerprints[rel_path] = self.manifest.check(rel_path, local_file_path)
+                    if incremental and not changed and landing is not None and not self.manifest.landed(rel_path, landing):
+                        logger.warning(f"Landing object of {local_file_path} is missing or was rewritten outside the ingest, converting it again")
+                        changed = True
+                    if incremental and not changed:
+                        logger.info(f"Skipping unchanged file: {local_file_path}")
+                        continue
+
+                    jobs[local_file_path] = (s3_file_path, s3_sub_folder)
+
+                self.databases = max(1, len({self.database_settings(get_ingest_profile(source)) for _, source in jobs.values()}))
+                logger.info(f"Converting {len(jobs)} files with up to {max_workers} concurrent workers.")
+                start = time.perf_counter()
+                if publish is not None:
+                    publish.put({
+                        "event": "planned",
+                        "s3_keys": [s3_file_path.split(f'{config.S3_BUCKET_NAME}/', 1)[1] for s3_file_path, _ in jobs.values()],
+                        "deleted_keys": [entry["s3_key"] for entry in self.deleted_files(fingerprints).values()] if incremental else [],
+                    })
 
-                local_file_path = os.path.join(config.RAW_DATA_DIR, s3_sub_folder, file_name_csv)
+                with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                    futures = {
+                        executor.submit(
+                            self.convert_file, local_file_path, s3_file_path, source,
+                            spool_path=os.path.join(spool_dir, s3_file_path.split(f'{config.S3_BUCKET_NAME}/', 1)[1]) if spool_dir else None
+                        ): local_file_path
+                        for local_file_path, (s3_file_path, source) in jobs.items()
+                    }
+                    for future in as_completed(futures):
+                        local_file_path = futures[future]
+                        outcome = results[local_file_path] = future.result()
+                        s3_key = outcome["s3_file_path"].split(f'{config.S3_BUCKET_NAME}/', 1)[1]
+                        if publish is not None:
+                            publish.put({"event": "file", "s3_key": s3_key, **outcome})
+                        if outcome["status"] == "error":
+                            logger.error(f"Failed to ingest {local_file_path}: {outcome['error']}")
+                            continue
 
-                file_name_pq = f'{os.path.splitext(file_name_csv)[0]}.parquet'
+                        rel_path = os.path.relpath(local_file_path, config.RAW_DATA_DIR)
+                        self.manifest.record(rel_path, fingerprints[rel_path], s3_key, outcome["etag"])
 
-                s3_file_path = f's3://{config.S3_BUCKET_NAME}/{config.LANDING_AREA_FOLDER}/{s3_sub_folder}/{file_name_pq}'
+                elapsed = time.perf_counter() - start
+                self.log_throughput(results, elapsed)
 
-                logger.info(f"Processing local file: {local_file_path}")
-                logger.info(f"Uploading to S3: {s3_file_path}")
+                if incremental:
+                    self.remove_deleted_files(fingerprints.keys())
+                self.manifest.save()
+                self.schema_cache.save()
 
-                if os.path.isfile(local_file_path):
-                    self.convert_csv_to_parquet_and_upload(local_file_path, s3_file_path)
+                failed = [path for path, outcome in results.items() if outcome["status"] == "error"]
+                if failed:
+                    logger.error(f"Ingestion completed with {len(failed)} failed files: {failed}")
                 else:
-                    logger.warning(f'File not found: {local_file_path}')
-            logger.info("Ingestion process completed successfully.")
-            
+                    logger.info("Ingestion process completed successfully.")
+
+                succeeded = [outcome for outcome in results.values() if outcome["status"] == "success"]
+                stage.update(
+                    files=len(results),
+                    failed_files=len(failed),
+                    rows=sum(outcome["rows"] or 0 for outcome in succeeded),
+                    bytes_read=sum(outcome["bytes"] for outcome in succeeded),
+                    s3_bytes_written=sum(outcome["s3_bytes"] or 0 for outcome in succeeded),
+                )
+                return results
+
         except Exception as e:
             logger.error(f"Error during file ingestion: {e}")
             raise
 
+        finally:
+            if publish is not None:
+                publish.put({"event": "done"})
+
+    def log_throughput(self, results: dict, elapsed: float) -> None:
+        """
+        Log the total throughput of an ingest batch.
+
+        :param results: Dictionary of per-file outcomes as returned by `convert_file`.
+        :param elapsed: Wall time of the batch in seconds.
+        """
+        succeeded = [outcome for outcome in results.values() if outcome["status"] == "success"]
+        total_mb = sum(outcome["bytes"] for outcome in succeeded) / 1024 ** 2
+        elapsed = max(elapsed, 1e-9)
+
+        logger.info(
+            f"Ingested {len(succeeded)}/{len(results)} files ({total_mb:.1f} MB) in {elapsed:.2f}s: "
+            f"{len(succeeded) / elapsed:.2f} files/s, {total_mb / elapsed:.2f} MB/s"
+        )
+
     def run(self):
         """
         Run the entire ingestion process.
         """
         try:
             self.setup_s3_secret()
-            self.convert_and_upload_files()
+            results = self.convert_and_upload_files()
+
+            failed = [path for path, outcome in results.items() if outcome["status"] == "error"]
+            if failed:
+                raise RuntimeError(f"{len(failed)} of {len(results)} files failed to ingest")
         finally:
+            self.report.save()
+            for con in self.connections.values():
+                if con is not self.con:
+                    con.close()
             self.con.close()
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Convert the raw CSV files to Parquet and upload them to the landing area.")
+    parser.add_argument('--profile', help="DuckDB runtime profile (a key of config.DUCKDB_PROFILES, defaults to DUCKDB_PROFILE)")
+    args = parser.parse_args()
+    set_duckdb_profile(args.profile)
+
     ingest_process = Ingest()
     ingest_process.run()
\ No newline at end of file
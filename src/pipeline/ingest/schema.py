@@ -0,0 +1,160 @@
+import os
+import json
+import hashlib
+import threading
+from pipeline.utils import setup_logger
+import pipeline.config as config
+
+# Setup
+logger = setup_logger(__name__)
+
+def read_header(local_file_path: str) -> str:
+    """
+    Read the header line of a CSV file.
+
+    :param local_file_path: Path to the local CSV file.
+    :return: The first line of the file, without the line terminator.
+    """
+    with open(local_file_path, 'rb') as f:
+        return f.readline().decode('utf-8', errors='replace').rstrip('\r\n')
+
+def sql_literal(value) -> str:
+    """
+    Render a Python string as a SQL string literal.
+
+    :param value: The string to render.
+    :return: The quoted SQL literal.
+    """
+    return "'" + str(value).replace("'", "''") + "'"
+
+class SchemaCache:
+    """
+    Persisted CSV dialect and column types detected by DuckDB for each raw file.
+
+    Entries are keyed by the raw file path relative to the raw data directory and are valid for as long
+    as the file's header line does not change. A cached entry lets `read_csv` skip auto-detection and
+    keeps the Parquet schema of a source stable from one run to the next.
+    """
+
+    def __init__(self, local_path: str = None) -> None:
+        """
+        Initialize the schema cache.
+
+        :param local_path: Local path of the cache file (defaults to config.INGEST_SCHEMA_CACHE_PATH).
+        """
+        self.local_path = local_path or config.INGEST_SCHEMA_CACHE_PATH
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def load(self) -> dict:
+        """
+        Load the schema cache from disk.
+
+        :return: The cache entries.
+        """
+        try:
+            if os.path.isfile(self.local_path):
+                with open(self.local_path) as f:
+                    self.entries = json.load(f)
+                logger.info(f"Loaded CSV schema cache with {len(self.entries)} entries from {self.local_path}")
+
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable CSV schema cache {self.local_path}: {e}")
+            self.entries = {}
+
+        return self.entries
+
+    def save(self) -> None:
+        """
+        Write the schema cache to disk.
+        """
+        try:
+            os.makedirs(os.path.dirname(self.local_path), exist_ok=True)
+            tmp_path = f'{self.local_path}.tmp'
+            with self.lock, open(tmp_path, 'w') as f:
+                json.dump(self.entries, f, indent=2, sort_keys=True)
+            os.replace(tmp_path, self.local_path)
+
+        except Exception as e:
+            logger.error(f"Error saving CSV schema cache: {e}", exc_info=True)
+            raise
+
+    def get(self, rel_path: str, header: str) -> dict:
+        """
+        Get the cached schema of a raw file, flagging schema drift when its header changed.
+
+        :param rel_path: Path of the file relative to the raw data directory.
+        :param header: The current header line of the file.
+        :return: The cached entry, or None if there is no entry for this header.
+        """
+        with self.lock:
+            entry = self.entries.get(rel_path)
+
+        if entry is None:
+            return None
+
+        if entry["header_sha256"] != hashlib.sha256(header.encode('utf-8')).hexdigest():
+            previous = [column["name"] for column in entry["columns"]]
+            current = [column.strip(entry["quote"] or '"') for column in header.split(entry["delimiter"])]
+            added = [column for column in current if column not in previous]
+            removed = [column for column in previous if column not in current]
+            logger.warning(f"Schema drift detected in {rel_path}: added columns {added}, removed columns {removed}")
+            return None
+
+        return entry
+
+    def sniff(self, con, rel_path: str, local_file_path: str, header: str) -> dict:
+        """
+        Detect the dialect and column types of a CSV file with DuckDB and cache them.
+
+        :param con: DuckDB connection or cursor to run the detection on.
+        :param rel_path: Path of the file relative to the raw data directory.
+        :param local_file_path: Path to the local CSV file.
+        :param header: The current header line of the file.
+        :return: The new cache entry.
+        """
+        relation = con.sql(f"SELECT * FROM sniff_csv({sql_literal(local_file_path)}, header = true)")
+        sniffed = dict(zip(relation.columns, relation.fetchone()))
+
+        entry = {
+            "header_sha256": hashlib.sha256(header.encode('utf-8')).hexdigest(),
+            "delimiter": sniffed["Delimiter"],
+            "quote": sniffed["Quote"],
+            "escape": sniffed["Escape"],
+            "new_line": sniffed["NewLineDelimiter"],
+            "skip": sniffed["SkipRows"],
+            "date_format": sniffed["DateFormat"],
+            "timestamp_format": sniffed["TimestampFormat"],
+            "columns": sniffed["Columns"],
+        }
+
+        with self.lock:
+            self.entries[rel_path] = entry
+
+        logger.info(f"Detected CSV schema of {rel_path} with {len(entry['columns'])} columns")
+        return entry
+
+def read_csv_options(entry: dict) -> str:
+    """
+    Build the `read_csv` arguments that replay a cached schema without auto-detection.
+
+    :param entry: A schema cache entry.
+    :return: Comma-separated `read_csv` named arguments.
+    """
+    columns = ', '.join(f"{sql_literal(column['name'])}: {sql_literal(column['type'])}" for column in entry["columns"])
+    options = [
+        "header = true",
+        "auto_detect = false",
+        f"delim = {sql_literal(entry['delimiter'])}",
+        f"quote = {sql_literal(entry['quote'])}",
+        f"escape = {sql_literal(entry['escape'])}",
+        f"new_line = {sql_literal(entry['new_line'])}",
+        f"skip = {int(entry['skip'])}",
+        f"columns = {{{columns}}}",
+    ]
+    if entry["date_format"]:
+        options.append(f"dateformat = {sql_literal(entry['date_format'])}")
+    if entry["timestamp_format"]:
+        options.append(f"timestampformat = {sql_literal(entry['timestamp_format'])}")
+
+    return ', '.join(options)
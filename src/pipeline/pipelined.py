@@ -0,0 +1,173 @@
+import os
+import time
+import queue
+import shutil
+import argparse
+import ibis
+from concurrent.futures import ThreadPoolExecutor
+from pipeline.utils import setup_logger, set_duckdb_profile, ibis_connect, parse_landing_key, landing_table_name
+from pipeline.ingest.run import Ingest
+from pipeline.etl.run import ETL
+from pipeline.etl.extract import DataLoader
+from pipeline.etl.state import ETLState
+from pipeline.etl.sources import source_tables
+import pipeline.config as config
+
+# Set up logging
+logger = setup_logger(__name__)
+
+class PipelinedRun:
+    """
+    Ingest and ETL run as one pipeline, with the transform of each source starting as soon as its landing files are ready.
+
+    The ingest publishes every converted file on an in-process queue. A consumer thread registers each file
+    with the ETL's DuckDB database, reading the local Parquet file the ingest just wrote instead of its S3
+    copy, and passes the new table on to the source scheduler. Files left unchanged by an incremental ingest
+    are read from the landing area, as in a regular ETL run, except those whose raw file was deleted, which
+    the ingest removes. Validation and load start once every source
+    is materialized, so the end-to-end time is close to that of the slowest source instead of the sum of
+    the two pipelines.
+    """
+
+    def __init__(self, con=None, spool_dir: str = None) -> None:
+        """
+        Initialize the pipelined run.
+
+        :param con: The Ibis-DuckDB backend connection of the ETL (defaults to an in-memory database).
+        :param spool_dir: Directory of the local Parquet files of this run (defaults to config.PIPELINED_SPOOL_DIR).
+        """
+        self.ingest = Ingest()
+        self.etl = ETL(con if con is not None else ibis_connect(':memory:'))
+        self.spool_dir = os.path.join(spool_dir or config.PIPELINED_SPOOL_DIR, self.etl.report.run_id)
+        self.files = queue.Queue()
+        self.start = None
+
+    def register(self, data_loader: DataLoader, table_name: str, path: str, tables: dict) -> bool:
+        """
+        Register a landing file as a view of the ETL's database, recording when it became available.
+
+        :param data_loader: Data loader of the consumer.
+        :param table_name: Name of the landing table.
+        :param path: Local or S3 path of the Parquet file.
+        :param tables: Landing tables read by the sources, with their columns (None to register every file with all its columns).
+        :return: Whether the table was registered.
+        """
+        if tables is not None and table_name not in tables:
+            return False
+
+        try:
+            data_loader.open_table(table_name, path, columns=tables.get(table_name) if tables is not None else None)
+            self.etl.report.add({
+                'stage': 'extract', 'source': table_name, 'status': 'success', 'path': path,
+                'ready_after_seconds': round(time.perf_counter() - self.start, 3),
+            })
+            logger.info(f"Registered {table_name} from {path}")
+            return True
+
+        except Exception as e:
+            logger.error(f"Error registering {table_name} from {path}: {e}")
+            self.etl.report.add({'stage': 'extract', 'source': table_name, 'status': 'error', 'error': str(e)})
+            return False
+
+    def consume(self, arrivals: queue.Queue) -> None:
+        """
+        Register the landing files with the ETL's database as the ingest publishes them, and announce them on `arrivals`.
+
+        Runs on its own thread and DuckDB cursor. None is always put on `arrivals` at the end, so the
+        sources still missing tables fail instead of waiting forever.
+
+        :param arrivals: Queue of the source scheduler (see `SourceScheduler.run`).
+        """
+        cursor = self.etl.con.con.cursor()
+        try:
+            data_loader = self.etl.data_loader = DataLoader(ibis.duckdb.from_connection(cursor))
+            tables = source_tables() if config.LAZY_EXTRACT else None
+
+            while True:
+                event = self.files.get()
+                if event['event'] == 'planned':
+                    # Files about to be converted are waited for, those about to be removed are skipped, and the
+                    # others are read from the landing area
+                    planned = {parse_landing_key(key, config.LANDING_AREA_FOLDER) for key in event['s3_keys'] + event['deleted_keys']}
+                    ready = {
+                        landing_table_name(source, name)
+                        for source, files in data_loader.file_metadata.items()
+                        for name, metadata in files.items()
+                        if (source, name) not in planned
+                        and self.register(data_loader, landing_table_name(source, name), data_loader.read_path(metadata), tables)
+                    }
+                    arrivals.put(ready)
+
+                elif event['event'] == 'file' and event['status'] == 'success':
+                    table_name = landing_table_name(*parse_landing_key(event['s3_key'], config.LANDING_AREA_FOLDER))
+                    if self.register(data_loader, table_name, event['local_path'], tables):
+                        arrivals.put({table_name})
+
+                elif event['event'] == 'done':
+                    break
+
+            if data_loader.cache is not None:
+                data_loader.cache.save()
+                data_loader.cache.log_stats()
+
+        except Exception as e:
+            logger.error(f"Error registering the landing files: {e}", exc_info=True)
+            raise
+
+        finally:
+            arrivals.put(None)
+            cursor.close()
+
+    def run(self, incremental: bool = None) -> None:
+        """
+        Run the ingest and the ETL together: ingest, extract and transform overlap, then validate and load.
+
+        A run in which a file failed to ingest stops before the load, as `just ingest` would stop before the ETL.
+        The ETL always rebuilds the full master table (see `ETL.run` for incremental runs).
+
+        :param incremental: Whether the ingest skips unchanged files (defaults to config.INGEST_INCREMENTAL).
+        """
+        arrivals = queue.Queue()
+        try:
+            with self.etl.report.stage('pipelined', con=self.etl.con.con):
+                self.start = time.perf_counter()
+                self.ingest.setup_s3_secret()
+
+                with ThreadPoolExecutor(max_workers=2) as executor:
+                    producer = executor.submit(
+                        self.ingest.convert_and_upload_files,
+                        incremental=incremental, publish=self.files, spool_dir=self.spool_dir
+                    )
+                    consumer = executor.submit(self.consume, arrivals)
+                    master = self.etl.transform(arrivals=arrivals)
+                    results = producer.result()
+                    consumer.result()
+
+                failed = [path for path, outcome in results.items() if outcome["status"] == "error"]
+                if failed:
+                    raise RuntimeError(f"{len(failed)} of {len(results)} files failed to ingest")
+
+                self.etl.load(self.etl.validate(master))
+
+                # The ETL state does not describe these outputs: the next incremental ETL rebuilds them in full
+                state = ETLState()
+                state.reset()
+                state.save()
+
+        finally:
+            self.ingest.report.save()
+            self.etl.report.save()
+            for con in self.ingest.connections.values():
+                if con is not self.ingest.con:
+                    con.close()
+            self.ingest.con.close()
+            self.etl.con.disconnect()
+            shutil.rmtree(self.spool_dir, ignore_errors=True)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run the ingest and the ETL as one pipeline, transforming sources as their files land.")
+    parser.add_argument('--profile', help="DuckDB runtime profile (a key of config.DUCKDB_PROFILES, defaults to DUCKDB_PROFILE)")
+    args = parser.parse_args()
+    set_duckdb_profile(args.profile)
+
+    PipelinedRun().run()
@@ -0,0 +1,48 @@
+import io
+import time
+import queue
+import ibis
+import pandas as pd
+import pipeline.config as config
+from pipeline.bench.local_s3 import local_s3
+from pipeline.etl.run import ETL
+from pipeline.pipelined import PipelinedRun
+from pipeline.report import RunReport
+
+def parquet(values: list) -> bytes:
+    buffer = io.BytesIO()
+    pd.DataFrame({'value': values}).to_parquet(buffer)
+    return buffer.getvalue()
+
+def pipelined_run() -> PipelinedRun:
+    # Only the ETL side is used to consume the ingest's events
+    run = PipelinedRun.__new__(PipelinedRun)
+    run.etl = ETL(ibis.duckdb.connect())
+    run.etl.report = RunReport('etl', enabled=False)
+    run.files = queue.Queue()
+    run.start = time.perf_counter()
+    return run
+
+def test_consumer_waits_for_planned_files_and_skips_removed_ones(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'LANDING_INDEX_PATH', str(tmp_path / 'landing_index.json'))
+    monkeypatch.setattr(config, 'LAZY_EXTRACT', False)
+    with local_s3(str(tmp_path / 's3')) as client:
+        for key in ('landing/wdi/WDICSV.parquet', 'landing/wdi/WDISeries.parquet', 'landing/edu/OLD.parquet'):
+            client.put_object(Bucket=config.S3_BUCKET_NAME, Key=key, Body=parquet([1.0]))
+        local_path = str(tmp_path / 'WDICSV.parquet')
+        with open(local_path, 'wb') as f:
+            f.write(parquet([1.0, 2.0]))
+
+        run = pipelined_run()
+        arrivals = queue.Queue()
+        for event in (
+            {'event': 'planned', 's3_keys': ['landing/wdi/WDICSV.parquet'], 'deleted_keys': ['landing/edu/OLD.parquet']},
+            {'event': 'file', 'status': 'success', 's3_key': 'landing/wdi/WDICSV.parquet', 'local_path': local_path},
+            {'event': 'done'},
+        ):
+            run.files.put(event)
+        run.consume(arrivals)
+
+        assert [arrivals.get() for _ in range(3)] == [{'wdi_WDISeries'}, {'wdi_WDICSV'}, None]
+        assert sorted(run.etl.con.list_tables()) == ['wdi_WDICSV', 'wdi_WDISeries']
+        assert run.etl.con.table('wdi_WDICSV').count().execute() == 2
@@ -0,0 +1,538 @@
+import os
+import time
+import uuid
+import queue
+import argparse
+import threading
+import contextlib
+from collections import OrderedDict
+from pipeline.utils import setup_logger, s3_filesystem, duckdb_connect
+from pipeline.snapshots import SnapshotStore
+from pipeline.catalog import STAR_TABLES, STAR_MASTER_VIEW
+from pipeline.etl.sources import MASTER_SCHEMA
+import pipeline.config as config
+
+# Set up logging
+logger = setup_logger(__name__)
+
+# Filters of the lookups that accept one value or a list of values
+LIST_FILTERS = ('indicator_id', 'country_id', 'database')
+
+def as_values(value) -> tuple:
+    """
+    Normalize a lookup filter to a sorted tuple of distinct values, so that equivalent lookups share a cache entry.
+
+    :param value: None, one value, or a list of values.
+    :return: The values (empty if no filter).
+    """
+    if value is None:
+        return ()
+    if isinstance(value, (str, int)):
+        return (value,)
+    return tuple(sorted(set(value)))
+
+def lookup_sql(filters: tuple) -> tuple:
+    """
+    Build the parameterized query of a lookup on the master table of a replica.
+
+    The SQL text only depends on which filters are set and on the number of values of each, with every
+    value bound as a parameter; the equality and range filters on the sort columns let DuckDB skip the
+    row groups of the replica whose min/max statistics exclude them.
+
+    :param filters: Normalized filters, as built by `QueryService.filters`.
+    :return: Tuple of (SQL, parameters).
+    """
+    indicator_ids, country_ids, year_from, year_to, databases = filters
+    conditions, params = [], []
+    for column, values in zip(LIST_FILTERS, (indicator_ids, country_ids, databases)):
+        if values:
+            conditions.append(f"{column} IN ({', '.join('?' * len(values))})")
+            params.extend(values)
+    if year_from is not None:
+        conditions.append("year >= ?")
+        params.append(year_from)
+    if year_to is not None:
+        conditions.append("year <= ?")
+        params.append(year_to)
+
+    where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+    order_by = ", ".join(config.MASTER_SORT_BY)
+    return f"SELECT * FROM master{where} ORDER BY {order_by}", params
+
+class ResultCache:
+    """
+    Thread-safe LRU cache of query results (Arrow tables), bounded by their total size in memory.
+    """
+
+    def __init__(self, max_mb: float = None) -> None:
+        """
+        Initialize the cache.
+
+        :param max_mb: Size limit of the cached results in MB (defaults to config.QUERY_CACHE_MB).
+        """
+        self.max_bytes = int((config.QUERY_CACHE_MB if max_mb is None else max_mb) * 1024 * 1024)
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Get a cached result, marking it as the most recently used.
+
+        :param key: Key of the result.
+        :return: The Arrow table, or None if it is not cached.
+        """
+        with self.lock:
+            table = self.entries.get(key)
+            if table is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return table
+
+    def put(self, key, table) -> None:
+        """
+        Cache a result, evicting the least recently used ones beyond the size limit.
+
+        :param key: Key of the result.
+        :param table: The Arrow table (not cached if larger than the whole cache).
+        """
+        if table.nbytes > self.max_bytes:
+            return
+        with self.lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.nbytes -= previous.nbytes
+            self.entries[key] = table
+            self.nbytes += table.nbytes
+            while self.nbytes > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+
+    def clear(self) -> None:
+        """
+        Drop every cached result.
+        """
+        with self.lock:
+            self.entries.clear()
+            self.nbytes = 0
+
+    def stats(self) -> dict:
+        """
+        :return: Number of entries, size in bytes, hits and misses of the cache.
+        """
+        with self.lock:
+            return {'entries': len(self.entries), 'bytes': self.nbytes, 'hits': self.hits, 'misses': self.misses}
+
+class Replica:
+    """
+    Local read-only DuckDB copy of the master table of a snapshot, queried through a pool of cursors.
+
+    Lookups hold the replica between `acquire` and `release`. A replica replaced by a newer snapshot is
+    retired: it is closed once its last lookup releases it.
+    """
+
+    def __init__(self, snapshot_id: str, path: str, pool_size: int) -> None:
+        """
+        Open a replica built by `build`.
+
+        :param snapshot_id: ID of the snapshot the replica holds.
+        :param path: Path of the replica's database file.
+        :param pool_size: Number of cursors of the pool, i.e. of queries run at once.
+        """
+        self.snapshot_id = snapshot_id
+        self.path = path
+        self.con = duckdb_connect(path, read_only=True)
+        self.pool = queue.LifoQueue()
+        for _ in range(pool_size):
+            self.pool.put(self.con.cursor())
+        self.lock = threading.Lock()
+        self.users = 0
+        self.retired = False
+
+    @classmethod
+    def build(cls, store: SnapshotStore, snapshot_id: str, pool_size: int) -> 'Replica':
+        """
+        Copy the master table of a snapshot into a new database file, sorted by MASTER_SORT_BY, and open it.
+
+        Snapshots of the 'star' model are joined back into the wide master table (STAR_MASTER_VIEW).
+
+        :param store: The snapshot store.
+        :param snapshot_id: ID of the snapshot.
+        :param pool_size: Number of cursors of the pool.
+        :return: The opened replica.
+        """
+        start = time.perf_counter()
+        manifest = store.load(snapshot_id)
+        tables = manifest['tables']
+
+        os.makedirs(config.QUERY_DB_DIR, exist_ok=True)
+        path = os.path.join(config.QUERY_DB_DIR, f"{snapshot_id}_{uuid.uuid4().hex[:6]}.duckdb")
+
+        def scan(table: str) -> str:
+            listing = ", ".join(f"'{store.url(entry['path'])}'" for entry in tables[table]['files'])
+            partitioned = str(bool(tables[table]['partition_by'])).lower()
+            return f"read_parquet([{listing}], hive_partitioning = {partitioned})"
+
+        try:
+            con = duckdb_connect(path)
+            try:
+                if store.path.startswith('s3://'):
+                    con.register_filesystem(s3_filesystem())
+                if 'master' in tables:
+                    source = f"SELECT * FROM {scan('master')}"
+                else:
+                    for table in STAR_TABLES:
+                        con.execute(f"CREATE TEMP VIEW {table} AS SELECT * FROM {scan(table)}")
+                    source = STAR_MASTER_VIEW
+                columns = ", ".join(MASTER_SCHEMA)
+                order_by = ", ".join(config.MASTER_SORT_BY)
+                con.execute(f"CREATE TABLE master AS SELECT {columns} FROM ({source}) ORDER BY {order_by}")
+                con.execute("CHECKPOINT")
+            finally:
+                con.close()
+
+            replica = cls(snapshot_id, path, pool_size)
+
+            # The first query on the database loads its metadata: pay it before the replica serves lookups
+            with replica.cursor() as cursor:
+                cursor.execute(*lookup_sql(QueryService.filters(indicator_id=''))).arrow()
+        except Exception as e:
+            logger.error(f"Error building the query replica of snapshot {snapshot_id}: {e}", exc_info=True)
+            cls.remove(path)
+            raise
+
+        logger.info(f"Query replica of snapshot {snapshot_id} built in {time.perf_counter() - start:.2f}s")
+        return replica
+
+    @contextlib.contextmanager
+    def cursor(self):
+        """
+        Borrow a cursor of the pool, waiting up to QUERY_POOL_TIMEOUT_SECONDS for one to be returned if they are all in use.
+
+        :return: Context manager yielding the cursor.
+        :raises TimeoutError: If no cursor was returned in time.
+        """
+        try:
+            cursor = self.pool.get(timeout=config.QUERY_POOL_TIMEOUT_SECONDS)
+        except queue.Empty:
+            raise TimeoutError(
+                f"No cursor of the replica of snapshot {self.snapshot_id} was free after {config.QUERY_POOL_TIMEOUT_SECONDS}s: "
+                f"they are all in use, or held by streams that were neither consumed nor deleted"
+            ) from None
+        try:
+            yield cursor
+        finally:
+            self.pool.put(cursor)
+
+    def acquire(self) -> bool:
+        """
+        Register a lookup reading the replica, so that it is not closed meanwhile.
+
+        :return: Whether the replica can be read, i.e. was not retired.
+        """
+        with self.lock:
+            if self.retired:
+                return False
+            self.users += 1
+            return True
+
+    def release(self) -> None:
+        """
+        Unregister a lookup, closing the replica if it was the last one of a retired replica.
+        """
+        with self.lock:
+            self.users -= 1
+            closing = self.retired and self.users == 0
+        if closing:
+            self.close()
+
+    def retire(self) -> None:
+        """
+        Close the replica once no lookup reads it anymore; new lookups cannot acquire it.
+        """
+        with self.lock:
+            self.retired = True
+            closing = self.users == 0
+        if closing:
+            self.close()
+
+    def close(self) -> None:
+        """
+        Close the replica and delete its database file.
+        """
+        self.con.close()
+        self.remove(self.path)
+
+    @staticmethod
+    def remove(path: str) -> None:
+        for file_path in (path, f"{path}.wal"):
+            if os.path.exists(file_path):
+                os.remove(file_path)
+
+class QueryService:
+    """
+    Low-latency lookups of the published master table, for dashboards and other interactive clients.
+
+    The service serves the current snapshot of the master outputs (see SnapshotStore) from a local
+    read-only DuckDB replica, so that lookups neither scan the Parquet files in S3 nor hold a lock on
+    staging.db while an ETL run writes it. Lookups by indicator, country, year range and database run
+    as parameterized queries on a pool of cursors, and return Arrow tables (or stream Arrow record
+    batches). Results are kept in an LRU cache keyed by the snapshot they were read from.
+
+    Every lookup checks the snapshot pointer at most every `refresh_seconds`. When a new snapshot was
+    published, the replica of the new snapshot is built in a background thread (meanwhile, lookups keep
+    reading the previous one), swapped in, and the result cache is cleared. If the build fails, the
+    previous replica keeps being served until the next check. The previous replica is closed once the
+    last lookup or stream reading it is done (see `Replica.retire`).
+    """
+
+    def __init__(self, path: str = None, pool_size: int = None, cache_mb: float = None,
+                 refresh_seconds: float = None) -> None:
+        """
+        Initialize the service, building the replica of the current snapshot.
+
+        :param path: Local or S3 directory of the master snapshots (defaults to config.MASTER_S3_DIR).
+        :param pool_size: Number of queries run at once (defaults to config.QUERY_POOL_SIZE).
+        :param cache_mb: Size of the result cache in MB (defaults to config.QUERY_CACHE_MB).
+        :param refresh_seconds: Interval between checks of the snapshot pointer (defaults to config.QUERY_REFRESH_SECONDS).
+        :raises ValueError: If nothing was published yet.
+        """
+        self.store = SnapshotStore(path or config.MASTER_S3_DIR)
+        self.pool_size = pool_size or config.QUERY_POOL_SIZE
+        self.refresh_seconds = config.QUERY_REFRESH_SECONDS if refresh_seconds is None else refresh_seconds
+        self.cache = ResultCache(cache_mb)
+        self.lock = threading.Lock()
+        self.replica = None
+        self.building = None
+        self.closed = False
+        self.checked_at = 0.0
+        self.refresh(force=True)
+
+    def refresh(self, force: bool = False) -> Replica:
+        """
+        Check the snapshot pointer, and start building the replica of the current snapshot if a new one was published.
+
+        The first replica is built before returning; the later ones are built by `build` in a background thread,
+        while the current one keeps being served.
+
+        :param force: Check the pointer even if it was checked less than `refresh_seconds` ago.
+        :return: The replica to query.
+        :raises ValueError: If nothing was published yet.
+        """
+        if not force and time.monotonic() - self.checked_at < self.refresh_seconds:
+            return self.replica
+
+        with self.lock:
+            if not force and time.monotonic() - self.checked_at < self.refresh_seconds:
+                return self.replica
+            self.checked_at = time.monotonic()
+            if self.building is not None:
+                return self.replica
+
+            try:
+                pointer = self.store.current()
+            except Exception as e:
+                if self.replica is None:
+                    raise
+                logger.warning(f"Serving snapshot {self.replica.snapshot_id}, as the snapshot pointer could not be read: {e}")
+                return self.replica
+
+            if pointer is None:
+                raise ValueError(f"No snapshot was published to {self.store.path}")
+            if self.replica is not None and pointer['snapshot_id'] == self.replica.snapshot_id:
+                return self.replica
+
+            if self.replica is None:
+                self.swap(Replica.build(self.store, pointer['snapshot_id'], self.pool_size))
+            else:
+                # Lookups arriving while the new replica is built keep reading the current one
+                self.building = threading.Thread(
+                    target=self.build, args=(pointer['snapshot_id'],), name='query-replica-build', daemon=True
+                )
+                self.building.start()
+            return self.replica
+
+    def build(self, snapshot_id: str) -> None:
+        """
+        Build the replica of a snapshot and swap it in, keeping the current replica if the build fails.
+
+        :param snapshot_id: ID of the snapshot.
+        """
+        try:
+            replica = Replica.build(self.store, snapshot_id, self.pool_size)
+        except Exception as e:
+            logger.error(f"Keeping the current snapshot, as the replica of snapshot {snapshot_id} could not be built: {e}", exc_info=True)
+            replica = None
+
+        with self.lock:
+            self.building = None
+            if replica is not None and self.closed:
+                replica.close()
+            elif replica is not None:
+                self.swap(replica)
+
+    def swap(self, replica: Replica) -> None:
+        """
+        Serve a new replica, retiring the previous one and clearing the result cache. Called with the lock held.
+
+        :param replica: The replica of the current snapshot.
+        """
+        previous, self.replica = self.replica, replica
+        if previous is not None:
+            previous.retire()
+        self.cache.clear()
+        logger.info(f"Serving snapshot {replica.snapshot_id}")
+
+    @contextlib.contextmanager
+    def serving(self):
+        """
+        Hold the replica of the current snapshot, so that a swap does not close it while it is read.
+
+        :return: Context manager yielding the replica.
+        """
+        replica = self.refresh()
+        # A replica retired between the refresh and its acquisition was already swapped out: read the new one
+        while not replica.acquire():
+            replica = self.refresh(force=True)
+        try:
+            yield replica
+        finally:
+            replica.release()
+
+    @staticmethod
+    def filters(indicator_id=None, country_id=None, year_from: int = None, year_to: int = None, database=None) -> tuple:
+        """
+        Normalize the filters of a lookup.
+
+        :return: Tuple of (indicator IDs, country IDs, first year, last year, databases).
+        """
+        return as_values(indicator_id), as_values(country_id), year_from, year_to, as_values(database)
+
+    def lookup(self, indicator_id=None, country_id=None, year_from: int = None, year_to: int = None, database=None):
+        """
+        Look up rows of the master table, from the result cache if the same lookup was served since the last publish.
+
+        :param indicator_id: Indicator ID or list of IDs (None for all indicators).
+        :param country_id: Country ID or list of IDs (None for all countries).
+        :param year_from: First year, inclusive (None for no lower bound).
+        :param year_to: Last year, inclusive (None for no upper bound).
+        :param database: Source database or list of databases (None for all databases).
+        :return: The matching rows as an Arrow table, sorted by MASTER_SORT_BY.
+        """
+        filters = self.filters(indicator_id, country_id, year_from, year_to, database)
+        with self.serving() as replica:
+            key = (replica.snapshot_id, filters)
+
+            table = self.cache.get(key)
+            if table is None:
+                sql, params = lookup_sql(filters)
+                with replica.cursor() as cursor:
+                    table = cursor.execute(sql, params).arrow()
+                if table.num_rows <= config.QUERY_CACHE_MAX_ROWS:
+                    self.cache.put(key, table)
+        return table
+
+    def stream(self, indicator_id=None, country_id=None, year_from: int = None, year_to: int = None, database=None,
+               batch_rows: int = None):
+        """
+        Look up rows of the master table as a stream of Arrow record batches, for results too large to hold at once.
+
+        The cursor the lookup runs on, and the replica it reads, are held until the stream is consumed or the
+        reader is deleted (pyarrow's `close` keeps them): callers must not keep unread readers around, or
+        their cursors are lost to the pool until then. Results of up to QUERY_CACHE_MAX_ROWS rows are cached
+        as in `lookup`.
+
+        :param indicator_id: Indicator ID or list of IDs (None for all indicators).
+        :param country_id: Country ID or list of IDs (None for all countries).
+        :param year_from: First year, inclusive (None for no lower bound).
+        :param year_to: Last year, inclusive (None for no upper bound).
+        :param database: Source database or list of databases (None for all databases).
+        :param batch_rows: Rows per record batch (defaults to config.QUERY_BATCH_ROWS).
+        :return: A pyarrow RecordBatchReader.
+        """
+        import pyarrow as pa
+
+        batch_rows = batch_rows or config.QUERY_BATCH_ROWS
+        filters = self.filters(indicator_id, country_id, year_from, year_to, database)
+        held = contextlib.ExitStack()
+        try:
+            replica = held.enter_context(self.serving())
+            key = (replica.snapshot_id, filters)
+
+            table = self.cache.get(key)
+            if table is not None:
+                held.close()
+                return table.to_reader(max_chunksize=batch_rows)
+
+            sql, params = lookup_sql(filters)
+            cursor = held.enter_context(replica.cursor())
+            reader = cursor.execute(sql, params).fetch_record_batch(batch_rows)
+        except Exception:
+            held.close()
+            raise
+
+        def batches():
+            kept, rows = [], 0
+            try:
+                yield None
+                for batch in reader:
+                    rows += batch.num_rows
+                    if kept is not None and rows <= config.QUERY_CACHE_MAX_ROWS:
+                        kept.append(batch)
+                    else:
+                        kept = None
+                    yield batch
+                if kept is not None:
+                    self.cache.put(key, pa.Table.from_batches(kept, schema=reader.schema))
+            finally:
+                reader.close()
+                held.close()
+
+        # Start the generator, so that deleting the reader before its first batch still returns the cursor
+        stream = batches()
+        next(stream)
+        return pa.RecordBatchReader.from_batches(reader.schema, stream)
+
+    def stats(self) -> dict:
+        """
+        :return: The snapshot served and the statistics of the result cache.
+        """
+        return {'snapshot_id': self.replica.snapshot_id if self.replica else None, 'cache': self.cache.stats()}
+
+    def close(self) -> None:
+        """
+        Close the replica and delete its database file, once the streams still reading it are done. A replica
+        still being built is closed when its build ends.
+        """
+        with self.lock:
+            self.closed = True
+            if self.replica is not None:
+                self.replica.retire()
+            self.replica = None
+            self.cache.clear()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Look up rows of the published master table, and time the lookup.")
+    parser.add_argument('--path', help="Local or S3 directory of the snapshots (defaults to the master folder of the S3 staging area)")
+    parser.add_argument('--indicator', nargs='+', help="Indicator IDs")
+    parser.add_argument('--country', nargs='+', help="Country IDs")
+    parser.add_argument('--years', nargs=2, type=int, metavar=('FROM', 'TO'), help="Inclusive year range")
+    parser.add_argument('--database', nargs='+', help="Source databases")
+    parser.add_argument('--repeat', type=int, default=3, help="Number of times the lookup is run (the first one misses the result cache)")
+    args = parser.parse_args()
+
+    service = QueryService(args.path)
+    try:
+        year_from, year_to = args.years or (None, None)
+        for attempt in range(args.repeat):
+            start = time.perf_counter()
+            result = service.lookup(args.indicator, args.country, year_from, year_to, args.database)
+            logger.info(f"Lookup {attempt + 1}: {result.num_rows} rows in {(time.perf_counter() - start) * 1000:.1f} ms")
+        print(result.to_pandas().head(20).to_string(index=False))
+        logger.info(f"Query service: {service.stats()}")
+    finally:
+        service.close()
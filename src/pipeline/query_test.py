@@ -0,0 +1,80 @@
+import os
+import duckdb
+import threading
+import pandas as pd
+import pytest
+import pipeline.config as config
+from pipeline.query import QueryService, Replica
+from pipeline.snapshots import SnapshotStore, new_snapshot_id
+
+def publish(store: SnapshotStore, value: float, parent_id: str = None) -> str:
+    snapshot_id = new_snapshot_id()
+    partition = f'{store.root}/{config.MASTER_SNAPSHOT_DIR}/{snapshot_id}/database=wdi'
+    os.makedirs(partition)
+    pd.DataFrame({
+        'country_id': ['KEN', 'NGA'], 'indicator_id': ['A', 'A'], 'year': [2001, 2001], 'value': [value, 2.0], 'indicator_label': ['a', 'a']
+    }).to_parquet(f'{partition}/data_0.parquet')
+    store.commit(snapshot_id, duckdb.connect(), store.files(snapshot_id), parent_id=parent_id)
+    return snapshot_id
+
+def ken_value(service: QueryService) -> float:
+    return service.lookup(indicator_id='A', country_id='KEN')['value'].to_pylist()[0]
+
+def replica_files() -> list:
+    return sorted(name for name in os.listdir(config.QUERY_DB_DIR) if name.endswith('.duckdb'))
+
+def wait_for_builds() -> None:
+    for thread in threading.enumerate():
+        if thread.name == 'query-replica-build':
+            thread.join()
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'QUERY_DB_DIR', str(tmp_path / 'query'))
+    return SnapshotStore(str(tmp_path / 'master'))
+
+def test_new_snapshot_is_built_in_the_background_while_the_previous_one_is_served(store, monkeypatch):
+    first = publish(store, 1.0)
+    service = QueryService(store.path, pool_size=2, refresh_seconds=0)
+    assert ken_value(service) == 1.0
+
+    build, built = Replica.build, threading.Event()
+    monkeypatch.setattr(Replica, 'build', staticmethod(lambda *args: built.wait() and build(*args)))
+    second = publish(store, 5.0, parent_id=first)
+
+    # The lookup starts the build of the new replica and is served by the previous one
+    assert ken_value(service) == 1.0
+    assert service.building is not None
+    assert service.stats()['snapshot_id'] == first
+
+    built.set()
+    wait_for_builds()
+    assert ken_value(service) == 5.0
+    assert service.stats()['snapshot_id'] == second
+    assert len(replica_files()) == 1
+    service.close()
+    assert replica_files() == []
+
+def test_failed_build_keeps_serving_the_previous_snapshot(store, monkeypatch):
+    first = publish(store, 1.0)
+    service = QueryService(store.path, pool_size=2, refresh_seconds=0)
+
+    build = Replica.build
+    def failing(*args):
+        raise IOError("No space left on device")
+    monkeypatch.setattr(Replica, 'build', staticmethod(failing))
+    second = publish(store, 5.0, parent_id=first)
+
+    assert ken_value(service) == 1.0
+    wait_for_builds()
+    assert ken_value(service) == 1.0
+    wait_for_builds()
+    assert service.stats()['snapshot_id'] == first
+
+    # The next check builds it again
+    monkeypatch.setattr(Replica, 'build', build)
+    ken_value(service)
+    wait_for_builds()
+    assert ken_value(service) == 5.0
+    assert service.stats()['snapshot_id'] == second
+    service.close()
@@ -0,0 +1,302 @@
+import os
+import json
+import time
+import uuid
+import resource
+import datetime
+import threading
+import contextlib
+from pipeline.utils import setup_logger, s3_init, get_s3_prefix_size
+import pipeline.config as config
+
+# Set up logging
+logger = setup_logger(__name__)
+
+# Seconds between two samples of the process and DuckDB memory usage
+SAMPLE_INTERVAL = 0.05
+
+def current_rss() -> int:
+    """
+    Return the current resident set size of the process, in bytes.
+
+    Falls back to the peak resident set size of the process where /proc is not available.
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak * 1024 if os.uname().sysname == 'Linux' else peak
+
+def io_counters() -> dict:
+    """
+    Return the bytes read and written by the process so far (all threads, files and sockets, so S3 traffic included),
+    or None where /proc is not available.
+    """
+    try:
+        with open('/proc/self/io') as f:
+            counters = dict(line.split(': ') for line in f.read().splitlines())
+        return {'read': int(counters['rchar']), 'written': int(counters['wchar'])}
+    except OSError:
+        return None
+
+def output_size(path: str) -> int:
+    """
+    Return the size in bytes of a sink's output: a local file or directory, or every S3 object under an s3:// path.
+
+    :param path: Local path or full S3 path of the output.
+    :return: Total size in bytes, or None if it cannot be determined.
+    """
+    try:
+        if path.startswith('s3://'):
+            bucket_name, prefix = path.replace('s3://', '', 1).split('/', 1)
+            return get_s3_prefix_size(s3_init(), bucket_name, prefix)
+        if os.path.isdir(path):
+            return sum(
+                os.path.getsize(os.path.join(subdir, file_name))
+                for subdir, _, files in os.walk(path)
+                for file_name in files
+            )
+        return os.path.getsize(path)
+
+    except Exception as e:
+        logger.warning(f"Could not determine the size of {path}: {e}")
+        return None
+
+class StageMonitor:
+    """
+    Measure the wall time, peak memory and bytes read and written of a block of code.
+
+    The resident set size (and, if a DuckDB connection is given, the memory held by DuckDB's buffer
+    manager) is sampled on a background thread, so the peaks include the memory used by DuckDB's
+    threads. Bytes read and written are the process-wide I/O counters over the block.
+
+        with StageMonitor('ingest') as stage:
+            ...
+        stage.metrics  # {'seconds': ..., 'peak_rss_mb': ..., 'read_mb': ..., 'written_mb': ...}
+    """
+
+    def __init__(self, name: str, con=None) -> None:
+        """
+        Initialize the monitor.
+
+        :param name: Name of the stage, used in the log.
+        :param con: DuckDB connection whose database memory usage is sampled (optional).
+        """
+        self.name = name
+        self.con = con
+        self.metrics = {}
+        self.peak_rss = 0
+        self.peak_duckdb_memory = None
+        self.stop_event = threading.Event()
+        self.sampler = threading.Thread(target=self.sample, daemon=True)
+
+    def sample(self) -> None:
+        cursor = self.con.cursor() if self.con is not None else None
+        try:
+            while not self.stop_event.is_set():
+                self.peak_rss = max(self.peak_rss, current_rss())
+                if cursor is not None:
+                    used = cursor.execute("SELECT sum(memory_usage_bytes) FROM duckdb_memory()").fetchone()[0] or 0
+                    self.peak_duckdb_memory = max(self.peak_duckdb_memory or 0, used)
+                self.stop_event.wait(SAMPLE_INTERVAL)
+        except Exception as e:
+            logger.warning(f"Stopped sampling memory usage of stage '{self.name}': {e}")
+        finally:
+            if cursor is not None:
+                cursor.close()
+
+    def __enter__(self):
+        self.peak_rss = current_rss()
+        self.io_start = io_counters()
+        self.sampler.start()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        seconds = time.perf_counter() - self.start
+        self.stop_event.set()
+        self.sampler.join()
+        self.peak_rss = max(self.peak_rss, current_rss())
+        io_end = io_counters()
+
+        self.metrics = {
+            'seconds': round(seconds, 3),
+            'peak_rss_mb': round(self.peak_rss / 1024 ** 2, 1),
+            'read_mb': round((io_end['read'] - self.io_start['read']) / 1024 ** 2, 1) if io_end else None,
+            'written_mb': round((io_end['written'] - self.io_start['written']) / 1024 ** 2, 1) if io_end else None,
+        }
+        if self.peak_duckdb_memory is not None:
+            self.metrics['duckdb_peak_memory_mb'] = round(self.peak_duckdb_memory / 1024 ** 2, 1)
+
+        status = "failed" if exc_type else "done"
+        logger.info(f"Stage '{self.name}' {status}: {self.metrics}")
+
+class RunReport:
+    """
+    Machine-readable report of an ingest or ETL run, written as JSON to the staging area.
+
+    It holds one record per stage (wall time, peak memory, DuckDB peak memory, bytes read and written,
+    row counts) and one record per source, file or sink within a stage (wall time, row counts, bytes
+    written and DuckDB's JSON profile of its main query). Records are added from worker threads.
+    """
+
+    def __init__(self, pipeline: str, enabled: bool = None) -> None:
+        """
+        Initialize the run report.
+
+        :param pipeline: Name of the pipeline being run ('ingest' or 'etl').
+        :param enabled: Whether to record anything (defaults to config.RUN_REPORT).
+        """
+        self.pipeline = pipeline
+        self.enabled = config.RUN_REPORT if enabled is None else enabled
+        self.started_at = datetime.datetime.now(datetime.timezone.utc)
+        self.run_id = f"{pipeline}_{self.started_at:%Y%m%dT%H%M%SZ}_{uuid.uuid4().hex[:6]}"
+        self.profile_dir = os.path.join(config.RUN_REPORT_DIR, 'profiles', self.run_id)
+        self.records = []
+        self.lock = threading.Lock()
+
+    def add(self, record: dict) -> None:
+        """
+        Add a record to the report.
+
+        :param record: Dictionary with at least the 'stage' of the record, and the 'source' it is about (if any).
+        """
+        if self.enabled:
+            with self.lock:
+                self.records.append({'source': None, **record})
+
+    @contextlib.contextmanager
+    def stage(self, name: str, con=None):
+        """
+        Record a stage of the run, measured by StageMonitor. The caller can add fields (e.g. row counts) to the yielded record.
+
+        :param name: Name of the stage (e.g. 'transform').
+        :param con: DuckDB connection whose database memory usage is sampled (optional).
+        """
+        record = {'stage': name, 'status': 'success'}
+        if not self.enabled:
+            yield record
+            return
+
+        monitor = StageMonitor(name, con=con)
+        try:
+            with monitor:
+                yield record
+        except Exception as e:
+            record.update(status='error', error=str(e))
+            raise
+        finally:
+            record.update(monitor.metrics)
+            self.add(record)
+
+    @contextlib.contextmanager
+    def source(self, stage: str, source: str, con=None):
+        """
+        Record the processing of a source, file or sink within a stage, with the query profile of the last query run on `con`.
+
+        :param stage: Name of the stage (e.g. 'transform').
+        :param source: Name of the source, file or sink.
+        :param con: DuckDB connection or cursor running the source's queries, profiled if config.QUERY_PROFILING is set.
+        """
+        record = {'stage': stage, 'source': source, 'status': 'success'}
+        if not self.enabled:
+            yield record
+            return
+
+        profile_path = self.enable_profiling(con, f'{stage}_{source}') if con is not None else None
+        start = time.perf_counter()
+        try:
+            yield record
+        except Exception as e:
+            record.update(status='error', error=str(e))
+            raise
+        finally:
+            record['seconds'] = round(time.perf_counter() - start, 3)
+            if profile_path is not None:
+                record['profile'] = self.read_profile(profile_path)
+            self.add(record)
+
+    def enable_profiling(self, con, name: str) -> str:
+        """
+        Enable DuckDB's JSON profiling on a connection or cursor; each query then overwrites the profile file.
+
+        :param con: DuckDB connection or cursor (profiling settings are per connection).
+        :param name: Name of the profile file.
+        :return: Path of the profile file, or None if profiling is disabled or failed.
+        """
+        if not config.QUERY_PROFILING:
+            return None
+
+        try:
+            os.makedirs(self.profile_dir, exist_ok=True)
+            path = os.path.join(self.profile_dir, f"{name.replace(os.sep, '_')}.json")
+            con.execute("PRAGMA enable_profiling = 'json'")
+            con.execute(f"PRAGMA profiling_output = '{path}'")
+            return path
+
+        except Exception as e:
+            logger.warning(f"Could not enable query profiling for {name}: {e}")
+            return None
+
+    @staticmethod
+    def read_profile(path: str) -> dict:
+        """
+        Read a DuckDB JSON profile.
+
+        :param path: Path of the profile file.
+        :return: The profile (query, CPU time, rows scanned and operator tree), or None if no query was profiled.
+        """
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def to_dict(self) -> dict:
+        """
+        Return the report as a dictionary.
+        """
+        with self.lock:
+            records = list(self.records)
+        return {
+            'run_id': self.run_id,
+            'pipeline': self.pipeline,
+            'started_at': self.started_at.isoformat(timespec='seconds'),
+            'finished_at': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+            'status': 'error' if any(record['status'] == 'error' for record in records) else 'success',
+            'stages': [record for record in records if record['source'] is None],
+            'sources': [record for record in records if record['source'] is not None],
+        }
+
+    def save(self, upload: bool = True) -> str:
+        """
+        Write the report to config.RUN_REPORT_DIR and upload it to the staging area in S3.
+
+        A report that cannot be written is logged, without failing the run it describes.
+
+        :param upload: Whether to upload the report to S3 (under config.RUN_REPORT_S3_PREFIX).
+        :return: Local path of the report, or None if it was not written.
+        """
+        if not self.enabled:
+            return None
+
+        try:
+            body = json.dumps(self.to_dict(), indent=2, default=str)
+
+            os.makedirs(config.RUN_REPORT_DIR, exist_ok=True)
+            local_path = os.path.join(config.RUN_REPORT_DIR, f'{self.run_id}.json')
+            with open(local_path, 'w') as f:
+                f.write(body)
+
+            if upload:
+                s3_key = f'{config.RUN_REPORT_S3_PREFIX}/{self.run_id}.json'
+                s3_init().put_object(Bucket=config.S3_BUCKET_NAME, Key=s3_key, Body=body.encode('utf-8'))
+                logger.info(f"Run report uploaded to s3://{config.S3_BUCKET_NAME}/{s3_key}")
+
+            logger.info(f"Run report written to {local_path}")
+            return local_path
+
+        except Exception as e:
+            logger.error(f"Error saving run report {self.run_id}: {e}", exc_info=True)
+            return None
@@ -0,0 +1,449 @@
+import os
+import json
+import uuid
+import argparse
+import datetime
+from pipeline.utils import setup_logger, s3_init, get_filesystem, partition_values
+from pipeline.catalog import STAR_TABLES
+import pipeline.config as config
+
+# Set up logging
+logger = setup_logger(__name__)
+
+def new_snapshot_id() -> str:
+    """
+    Generate a snapshot ID: the UTC time of its creation and a random suffix, so that IDs sort by creation time.
+
+    :return: The snapshot ID, e.g. '20241101T120000123456Z_3f2a1b'.
+    """
+    return f"{datetime.datetime.now(datetime.timezone.utc):%Y%m%dT%H%M%S%fZ}_{uuid.uuid4().hex[:6]}"
+
+def table_of(rel_path: str) -> str:
+    """
+    Name of the table a data file of a snapshot belongs to.
+
+    :param rel_path: Path of the file relative to its snapshot directory, e.g. 'master.parquet',
+                     'database=wdi/year_bucket=2000/data_0.parquet' or 'fact_master/database=wdi/...'.
+    :return: The table name ('master', 'fact_master', 'dim_indicator'...).
+    """
+    first = rel_path.split('/', 1)[0]
+    if '=' in first:
+        return 'master'
+    return first[:-len('.parquet')] if first.endswith('.parquet') else first
+
+class SnapshotStore:
+    """
+    Snapshot-versioned Parquet outputs in a local or S3 directory, published atomically and readable at any past version.
+
+    Layout of the directory:
+
+    - snapshots/<snapshot id>/: the immutable data files written by a run. A snapshot can also list
+      files of earlier snapshots it left unchanged (e.g. the partitions of the sources an incremental
+      run did not rebuild).
+    - _snapshots/<snapshot id>.json: the manifest of a snapshot: its parent, operation, and for each
+      table its row count, partition columns and files, with each file's rows, bytes and per-column
+      min, max and null count (from the Parquet footers, and the hive partition values).
+    - _current.json: the pointer to the current snapshot, a few hundred bytes replaced in one write.
+
+    Writers write their files, then `commit` a snapshot: the manifest first, then the pointer. Readers
+    only follow the pointer (or a past snapshot's manifest), so they see a run's files all at once or
+    not at all, and can check whether anything changed by reading the pointer alone. `plan` selects the
+    files of a scan from the manifest statistics, without opening any data file.
+    """
+
+    def __init__(self, path: str) -> None:
+        """
+        Initialize the store.
+
+        :param path: Local or S3 directory of the snapshots (e.g. 's3://bucket/staging/master/').
+        """
+        self.path = path.rstrip('/') + '/'
+        self.fs, self.root = get_filesystem(path)
+
+    def url(self, rel_path: str) -> str:
+        """
+        Path of a file of the store, as DuckDB reads it.
+
+        :param rel_path: Path of the file relative to the store's directory.
+        :return: The local path or 's3://' URL.
+        """
+        return f'{self.path}{rel_path}'
+
+    def data_path(self, snapshot_id: str) -> str:
+        """
+        Directory the data files of a snapshot are written to.
+
+        :param snapshot_id: ID of the snapshot.
+        :return: The local path or 's3://' URL of the directory, ending with '/'.
+        """
+        return self.url(f'{config.MASTER_SNAPSHOT_DIR}/{snapshot_id}/')
+
+    def files(self, snapshot_id: str) -> list:
+        """
+        List the data files written under a snapshot's directory.
+
+        :param snapshot_id: ID of the snapshot.
+        :return: Paths of the files relative to the store's directory.
+        """
+        data_dir = f'{self.root}/{config.MASTER_SNAPSHOT_DIR}/{snapshot_id}'
+        self.fs.invalidate_cache(data_dir)
+        if not self.fs.exists(data_dir):
+            return []
+        return sorted(path[len(self.root) + 1:] for path in self.fs.find(data_dir) if path.endswith('.parquet'))
+
+    def current(self) -> dict:
+        """
+        Read the pointer to the current snapshot.
+
+        :return: The pointer (snapshot_id, manifest, committed_at and rows by table), or None if nothing was published.
+        """
+        path = f'{self.root}/{config.MASTER_SNAPSHOT_POINTER}'
+        try:
+            return json.loads(self.fs.cat_file(path))
+        except FileNotFoundError:
+            return None
+
+    def snapshot_ids(self) -> list:
+        """
+        List the snapshots whose manifest is still kept, oldest first.
+
+        :return: Sorted snapshot IDs.
+        """
+        manifest_dir = f'{self.root}/{config.MASTER_SNAPSHOT_MANIFEST_DIR}'
+        self.fs.invalidate_cache(manifest_dir)
+        if not self.fs.exists(manifest_dir):
+            return []
+        return sorted(os.path.basename(path)[:-len('.json')] for path in self.fs.ls(manifest_dir, detail=False) if path.endswith('.json'))
+
+    def load(self, snapshot_id: str = None, as_of: datetime.datetime = None) -> dict:
+        """
+        Read the manifest of a snapshot: the current one, a given one, or the last one committed at a point in time.
+
+        :param snapshot_id: ID of the snapshot (defaults to the current one).
+        :param as_of: Timezone-aware point in time; the last snapshot committed at or before it is read.
+        :return: The manifest, or None if nothing was published.
+        :raises ValueError: If no snapshot matches.
+        """
+        if as_of is not None:
+            for candidate in reversed(self.snapshot_ids()):
+                manifest = self.load(candidate)
+                if datetime.datetime.fromisoformat(manifest['committed_at']) <= as_of:
+                    return manifest
+            raise ValueError(f"No snapshot of {self.path} was committed at or before {as_of.isoformat()}")
+
+        if snapshot_id is None:
+            pointer = self.current()
+            if pointer is None:
+                return None
+            snapshot_id = pointer['snapshot_id']
+
+        path = f'{self.root}/{config.MASTER_SNAPSHOT_MANIFEST_DIR}/{snapshot_id}.json'
+        try:
+            return json.loads(self.fs.cat_file(path))
+        except FileNotFoundError:
+            raise ValueError(f"Snapshot {snapshot_id} of {self.path} does not exist or has expired")
+
+    def file_stats(self, con, rel_paths: list) -> list:
+        """
+        Compute the manifest entries of data files from their Parquet footers: rows, bytes and per-column min, max and null count.
+
+        Only the footers are read. The hive partition values in a file's path are added as columns with
+        a single value.
+
+        :param con: DuckDB connection that can read the files.
+        :param rel_paths: Paths of the files relative to the store's directory.
+        :return: One entry per file: path, table, rows, bytes and columns.
+        """
+        sizes = {}
+        for prefix in {'/'.join(rel.split('/')[:2]) for rel in rel_paths}:
+            self.fs.invalidate_cache(f'{self.root}/{prefix}')
+            sizes.update({path[len(self.root) + 1:]: info['size'] for path, info in self.fs.find(f'{self.root}/{prefix}', detail=True).items()})
+        entries = []
+        by_table = {}
+        for rel in rel_paths:
+            by_table.setdefault(table_of(self.relative(rel)), []).append(rel)
+
+        for table, files in by_table.items():
+            urls = [self.url(rel) for rel in files]
+            listing = ", ".join(f"'{url}'" for url in urls)
+            columns = con.execute(f"DESCRIBE SELECT * FROM read_parquet([{listing}], hive_partitioning = false)").fetchall()
+            aggregates = ", ".join(
+                f"""min(TRY_CAST(stats_min_value AS {column_type})) FILTER (WHERE path_in_schema = '{name}'),
+                    max(TRY_CAST(stats_max_value AS {column_type})) FILTER (WHERE path_in_schema = '{name}'),
+                    sum(stats_null_count) FILTER (WHERE path_in_schema = '{name}')"""
+                for name, column_type, *_ in columns
+            )
+            stats = {
+                row[0]: row[1:]
+                for row in con.execute(f"""
+                    SELECT file_name, sum(row_group_num_rows) FILTER (WHERE column_id = 0), {aggregates}
+                    FROM parquet_metadata([{listing}])
+                    GROUP BY file_name
+                """).fetchall()
+            }
+
+            for rel, url in zip(files, urls):
+                rows, *values = stats[url]
+                entry_columns = {
+                    name: {'min': values[3 * i], 'max': values[3 * i + 1], 'nulls': int(values[3 * i + 2] or 0)}
+                    for i, (name, *_) in enumerate(columns)
+                }
+                for name, value in partition_values(self.relative(rel)).items():
+                    # Typed as DuckDB infers hive partition values, e.g. year_bucket=2000 as an integer
+                    value = int(value) if value.lstrip('-').isdigit() else value
+                    entry_columns[name] = {'min': value, 'max': value, 'nulls': 0}
+                entries.append({
+                    'path': rel, 'table': table, 'rows': int(rows or 0), 'bytes': sizes.get(rel), 'columns': entry_columns,
+                })
+
+        return entries
+
+    @staticmethod
+    def relative(rel_path: str) -> str:
+        """
+        Path of a data file relative to its snapshot directory.
+
+        :param rel_path: Path of the file relative to the store's directory ('snapshots/<id>/...').
+        :return: The path under the snapshot directory (e.g. 'database=wdi/year_bucket=2000/data_0.parquet').
+        """
+        return rel_path.split('/', 2)[2] if rel_path.startswith(f'{config.MASTER_SNAPSHOT_DIR}/') else rel_path
+
+    def commit(self, snapshot_id: str, con, new_files: list, kept_files: list = None, parent_id: str = None,
+               operation: str = 'etl', properties: dict = None) -> dict:
+        """
+        Publish a snapshot: write its manifest, then point the store's pointer at it (see `swap_pointer`).
+
+        :param snapshot_id: ID of the snapshot.
+        :param con: DuckDB connection that can read the new files.
+        :param new_files: Paths of the files written for this snapshot, relative to the store's directory.
+        :param kept_files: Manifest entries of files of the parent snapshot that this snapshot keeps.
+        :param parent_id: ID of the snapshot the writer started from; the commit fails if another was published meanwhile.
+        :param operation: What wrote the snapshot ('etl', 'etl-sharded', 'compact'...).
+        :param properties: Writer-specific details recorded in the manifest (e.g. the run ID).
+        :return: The manifest.
+        :raises RuntimeError: If the current snapshot is no longer `parent_id`.
+        """
+        try:
+            files = list(kept_files or []) + (self.file_stats(con, new_files) if new_files else [])
+            tables = {}
+            for entry in sorted(files, key=lambda entry: entry['path']):
+                table = tables.setdefault(entry['table'], {
+                    'rows': 0, 'partition_by': list(partition_values(self.relative(entry['path']))), 'files': [],
+                })
+                table['rows'] += entry['rows']
+                table['files'].append(entry)
+
+            manifest = {
+                'snapshot_id': snapshot_id,
+                'parent_id': parent_id,
+                'committed_at': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+                'operation': operation,
+                'properties': properties or {},
+                'tables': tables,
+            }
+            manifest_rel = f'{config.MASTER_SNAPSHOT_MANIFEST_DIR}/{snapshot_id}.json'
+            self.fs.pipe_file(f'{self.root}/{manifest_rel}', json.dumps(manifest, indent=2, default=str).encode('utf-8'))
+
+            pointer = {
+                'snapshot_id': snapshot_id,
+                'manifest': manifest_rel,
+                'committed_at': manifest['committed_at'],
+                'rows': {name: table['rows'] for name, table in tables.items()},
+            }
+            try:
+                self.swap_pointer(pointer, parent_id)
+            except RuntimeError:
+                self.fs.rm(f'{self.root}/{manifest_rel}')
+                raise
+            if parent_id is None:
+                self.remove_legacy_outputs()
+
+            logger.info(f"Snapshot {snapshot_id} published to {self.path}: {pointer['rows']}")
+            return manifest
+
+        except Exception as e:
+            logger.error(f"Error publishing snapshot {snapshot_id} to {self.path}: {e}", exc_info=True)
+            raise
+
+    def swap_pointer(self, pointer: dict, parent_id: str) -> None:
+        """
+        Replace the pointer, if it still points at the parent snapshot, in one conditional write.
+
+        Optimistic concurrency: of two writers that started from the same parent, only the first to swap
+        the pointer publishes its snapshot. In S3, the pointer is read with its ETag and replaced by a PUT
+        conditioned on that ETag (or on its absence), which S3 rejects if the pointer changed in between.
+        Locally, the check and the replacement (os.replace) hold an exclusive lock on '_current.json.lock'.
+
+        :param pointer: The new pointer.
+        :param parent_id: ID of the snapshot the writer started from (None for the first snapshot).
+        :raises RuntimeError: If the current snapshot is no longer `parent_id`.
+        """
+        from botocore.exceptions import ClientError
+
+        body = json.dumps(pointer, indent=2).encode('utf-8')
+        conflict = f"A snapshot was published to {self.path} after {parent_id}, not committing {pointer['snapshot_id']}"
+
+        if self.path.startswith('s3://'):
+            bucket_name, _, prefix = self.root.partition('/')
+            key = f'{prefix}/{config.MASTER_SNAPSHOT_POINTER}'.lstrip('/')
+            s3_client = s3_init()
+            try:
+                response = s3_client.get_object(Bucket=bucket_name, Key=key)
+                current, condition = json.loads(response['Body'].read()).get('snapshot_id'), {'IfMatch': response['ETag']}
+            except ClientError as e:
+                if e.response['Error']['Code'] != 'NoSuchKey':
+                    raise
+                current, condition = None, {'IfNoneMatch': '*'}
+            if current != parent_id:
+                raise RuntimeError(conflict)
+            try:
+                s3_client.put_object(Bucket=bucket_name, Key=key, Body=body, **condition)
+            except ClientError as e:
+                if e.response['Error']['Code'] in ('PreconditionFailed', 'ConditionalRequestConflict'):
+                    raise RuntimeError(conflict) from e
+                raise
+            return
+
+        import fcntl
+
+        pointer_path = os.path.join(self.root, config.MASTER_SNAPSHOT_POINTER)
+        os.makedirs(self.root, exist_ok=True)
+        with open(f'{pointer_path}.lock', 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                if (self.current() or {}).get('snapshot_id') != parent_id:
+                    raise RuntimeError(conflict)
+                with open(f'{pointer_path}.tmp', 'wb') as f:
+                    f.write(body)
+                os.replace(f'{pointer_path}.tmp', pointer_path)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def remove_legacy_outputs(self) -> list:
+        """
+        Delete the outputs written in place with MASTER_PUBLISH=overwrite, which no snapshot lists: the Parquet
+        files, star model tables and partitions directly under the store's directory.
+
+        :return: Paths of the deleted files and directories, relative to the store's directory.
+        """
+        self.fs.invalidate_cache(self.root)
+        legacy = [
+            path for path in self.fs.ls(self.root, detail=False)
+            if (name := os.path.basename(path.rstrip('/'))).endswith('.parquet') or '=' in name or name in STAR_TABLES
+        ]
+        if legacy:
+            self.fs.rm(legacy, recursive=True)
+            logger.info(f"Deleted the outputs written in place in {self.path}: {[os.path.basename(path) for path in legacy]}")
+        return [path[len(self.root) + 1:] for path in legacy]
+
+    def discard(self, snapshot_id: str) -> None:
+        """
+        Delete the data files of a snapshot that was not committed (e.g. after a failed run).
+
+        :param snapshot_id: ID of the snapshot.
+        """
+        path = f'{self.root}/{config.MASTER_SNAPSHOT_DIR}/{snapshot_id}'
+        if self.fs.exists(path):
+            self.fs.rm(path, recursive=True)
+
+    def expire(self, keep: int = None) -> list:
+        """
+        Delete the snapshots older than the last `keep` ones, with the data files no kept snapshot lists.
+
+        :param keep: Number of snapshots kept (defaults to config.MASTER_SNAPSHOT_RETENTION); the current one always is.
+        :return: IDs of the expired snapshots.
+        """
+        keep = config.MASTER_SNAPSHOT_RETENTION if keep is None else keep
+        try:
+            snapshot_ids = self.snapshot_ids()
+            current = (self.current() or {}).get('snapshot_id')
+            kept = set(snapshot_ids[-keep:] if keep > 0 else []) | {current}
+            expired = [snapshot_id for snapshot_id in snapshot_ids if snapshot_id not in kept]
+            if not expired:
+                return []
+
+            referenced = {entry['path'] for snapshot_id in kept if snapshot_id for table in self.load(snapshot_id)['tables'].values() for entry in table['files']}
+            stale = []
+            for snapshot_id in expired:
+                data_dir = f'{self.root}/{config.MASTER_SNAPSHOT_DIR}/{snapshot_id}'
+                self.fs.invalidate_cache(data_dir)
+                if self.fs.exists(data_dir):
+                    stale += [path for path in self.fs.find(data_dir) if path[len(self.root) + 1:] not in referenced]
+                stale.append(f'{self.root}/{config.MASTER_SNAPSHOT_MANIFEST_DIR}/{snapshot_id}.json')
+            self.fs.rm(stale)
+
+            logger.info(f"Expired snapshots {expired} of {self.path}, deleting {len(stale)} files.")
+            return expired
+
+        except Exception as e:
+            logger.error(f"Error expiring snapshots of {self.path}: {e}", exc_info=True)
+            raise
+
+    def plan(self, table: str = 'master', snapshot_id: str = None, as_of: datetime.datetime = None, **bounds) -> list:
+        """
+        Select the files of a table a scan has to read, from the manifest statistics alone.
+
+        :param table: Name of the table.
+        :param snapshot_id: ID of the snapshot (defaults to the current one).
+        :param as_of: Read the last snapshot committed at or before this point in time instead.
+        :param bounds: Filters on columns: a value (e.g. database='wdi') or an inclusive (min, max) range,
+                       with None for an open end (e.g. year=(2000, None)).
+        :return: Paths of the files whose statistics overlap every filter, as DuckDB reads them.
+        :raises ValueError: If nothing was published or the snapshot has no such table.
+        """
+        manifest = self.load(snapshot_id, as_of)
+        if manifest is None:
+            raise ValueError(f"No snapshot was published to {self.path}")
+        if table not in manifest['tables']:
+            raise ValueError(f"Snapshot {manifest['snapshot_id']} has no table '{table}'")
+
+        def overlaps(stats: dict, bound) -> bool:
+            low, high = bound if isinstance(bound, tuple) else (bound, bound)
+            if stats is None or stats['min'] is None or stats['max'] is None:
+                return True
+            return (low is None or stats['max'] >= low) and (high is None or stats['min'] <= high)
+
+        return [
+            self.url(entry['path'])
+            for entry in manifest['tables'][table]['files']
+            if all(overlaps(entry['columns'].get(column), bound) for column, bound in bounds.items())
+        ]
+
+    def read(self, con, table: str = 'master', snapshot_id: str = None, as_of: datetime.datetime = None, **bounds):
+        """
+        Read a table of a snapshot, scanning only the files whose statistics overlap the filters.
+
+        The filters only prune files: apply them to the returned table as well.
+
+        :param con: The Ibis-DuckDB backend connection to read with (with the S3 filesystem registered for S3 stores).
+        :param table: Name of the table.
+        :param snapshot_id: ID of the snapshot (defaults to the current one).
+        :param as_of: Read the last snapshot committed at or before this point in time instead.
+        :param bounds: Filters on columns, as in `plan`.
+        :return: Ibis table expression over the files (empty, with the table's columns, if no file matches).
+        """
+        manifest = self.load(snapshot_id, as_of)
+        files = self.plan(table, manifest['snapshot_id'], **bounds)
+        partitioned = str(bool(manifest['tables'][table]['partition_by'])).lower()
+        limit = "" if files else " LIMIT 0"
+        listing = ", ".join(f"'{path}'" for path in files or [self.url(manifest['tables'][table]['files'][0]['path'])])
+        return con.sql(f"SELECT * FROM read_parquet([{listing}], hive_partitioning = {partitioned}){limit}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="List, inspect and expire the snapshots of the master outputs.")
+    parser.add_argument('--path', help="Local or S3 directory of the snapshots (defaults to the master folder of the S3 staging area)")
+    parser.add_argument('--show', metavar='SNAPSHOT_ID', nargs='?', const='', help="Print the manifest of a snapshot (defaults to the current one)")
+    parser.add_argument('--expire', action='store_true', help="Delete the snapshots beyond MASTER_SNAPSHOT_RETENTION")
+    args = parser.parse_args()
+
+    store = SnapshotStore(args.path or config.MASTER_S3_DIR)
+    if args.show is not None:
+        print(json.dumps(store.load(args.show or None), indent=2, default=str))
+    elif args.expire:
+        store.expire()
+    else:
+        current = (store.current() or {}).get('snapshot_id')
+        for snapshot_id in store.snapshot_ids():
+            manifest = store.load(snapshot_id)
+            rows = {name: table['rows'] for name, table in manifest['tables'].items()}
+            print(f"{'*' if snapshot_id == current else ' '} {snapshot_id}  {manifest['committed_at']}  {manifest['operation']:<12} {rows}")
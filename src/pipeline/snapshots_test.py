@@ -0,0 +1,84 @@
+import os
+import ibis
+import duckdb
+import pytest
+import pandas as pd
+import pipeline.config as config
+from pipeline.bench.local_s3 import local_s3
+from pipeline.snapshots import SnapshotStore, new_snapshot_id
+from pipeline.utils import s3_filesystem
+
+def write_files(store: SnapshotStore, snapshot_id: str, databases: list) -> list:
+    for database in databases:
+        partition = f'{store.root}/{config.MASTER_SNAPSHOT_DIR}/{snapshot_id}/database={database}'
+        store.fs.makedirs(partition, exist_ok=True)
+        with store.fs.open(f'{partition}/data_0.parquet', 'wb') as f:
+            pd.DataFrame({'indicator_id': ['A'], 'value': [1.0]}).to_parquet(f)
+    return store.files(snapshot_id)
+
+def publish(store: SnapshotStore, con, databases: list, parent_id: str = None, kept: list = None) -> dict:
+    snapshot_id = new_snapshot_id()
+    return store.commit(snapshot_id, con, write_files(store, snapshot_id, databases), kept, parent_id=parent_id)
+
+def test_commit_fails_if_another_snapshot_was_published(tmp_path):
+    store = SnapshotStore(str(tmp_path / 'master'))
+    con = duckdb.connect()
+    first = publish(store, con, ['wdi'])
+    second = publish(store, con, ['wdi'], parent_id=first['snapshot_id'])
+
+    # A writer that also started from the first snapshot
+    with pytest.raises(RuntimeError, match='A snapshot was published'):
+        publish(store, con, ['sdg'], parent_id=first['snapshot_id'])
+
+    assert store.current()['snapshot_id'] == second['snapshot_id']
+    assert store.snapshot_ids() == [first['snapshot_id'], second['snapshot_id']]
+
+def test_s3_commit_fails_if_another_snapshot_was_published(tmp_path):
+    with local_s3(str(tmp_path / 's3')):
+        store = SnapshotStore(f's3://{config.S3_BUCKET_NAME}/staging/master/')
+        con = duckdb.connect()
+        con.register_filesystem(s3_filesystem())
+        first = publish(store, con, ['wdi'])
+
+        with pytest.raises(RuntimeError, match='A snapshot was published'):
+            publish(store, con, ['sdg'])
+        second = publish(store, con, ['sdg'], parent_id=first['snapshot_id'])
+        with pytest.raises(RuntimeError, match='A snapshot was published'):
+            publish(store, con, ['sdg'], parent_id=first['snapshot_id'])
+
+        assert store.current()['snapshot_id'] == second['snapshot_id']
+
+def test_expire_keeps_the_files_of_kept_snapshots(tmp_path):
+    store = SnapshotStore(str(tmp_path / 'master'))
+    con = duckdb.connect()
+    first = publish(store, con, ['wdi', 'sdg'])
+    sdg = [entry for entry in first['tables']['master']['files'] if 'database=sdg' in entry['path']]
+    # The next snapshots rebuild wdi and keep the sdg file of the first one
+    second = publish(store, con, ['wdi'], parent_id=first['snapshot_id'], kept=sdg)
+    third = publish(store, con, ['wdi'], parent_id=second['snapshot_id'], kept=sdg)
+
+    assert store.expire(keep=1) == [first['snapshot_id'], second['snapshot_id']]
+
+    assert store.snapshot_ids() == [third['snapshot_id']]
+    paths = sorted(entry['path'] for entry in third['tables']['master']['files'])
+    assert all(os.path.exists(store.url(path)) for path in paths)
+    assert not os.path.exists(store.url(f"{config.MASTER_SNAPSHOT_DIR}/{second['snapshot_id']}/database=wdi/data_0.parquet"))
+    assert store.read(ibis.duckdb.connect()).count().execute() == 2
+
+def test_first_snapshot_removes_the_outputs_written_in_place(tmp_path):
+    path = tmp_path / 'master'
+    os.makedirs(path / 'database=wdi')
+    os.makedirs(path / 'fact_master')
+    for name in ('master.parquet', 'dim_country.parquet', 'database=wdi/data_0.parquet', 'notes.txt'):
+        (path / name).write_bytes(b'')
+    store = SnapshotStore(str(path))
+    con = duckdb.connect()
+
+    first = publish(store, con, ['wdi'])
+    (path / 'master.parquet').write_bytes(b'')
+    publish(store, con, ['wdi'], parent_id=first['snapshot_id'])
+
+    assert sorted(os.listdir(path)) == [
+        config.MASTER_SNAPSHOT_POINTER, f'{config.MASTER_SNAPSHOT_POINTER}.lock', config.MASTER_SNAPSHOT_MANIFEST_DIR,
+        'master.parquet', 'notes.txt', config.MASTER_SNAPSHOT_DIR
+    ]
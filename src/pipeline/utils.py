@@ -1,6 +1,15 @@
+from __future__ import annotations
+
 import os
+import re
+import json
+import hashlib
 import logging
-import boto3
+import threading
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import boto3
 
 ### LOGGER ###
 def setup_logger(script_name: str = None) -> logging.Logger:
@@ -16,50 +25,366 @@ def setup_logger(script_name: str = None) -> logging.Logger:
     logger = logging.getLogger(script_name)
     logger.setLevel(logging.INFO)
 
-    # Create handler (streaming to console)
-    handler = logging.StreamHandler()
+    # Loggers are shared per name: only attach the handler the first time, or every message is printed once per call
+    if not logger.handlers:
+        # Create handler (streaming to console)
+        handler = logging.StreamHandler()
 
-    # Define format including script/module name
-    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+        # Define format including script/module name
+        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 
-    handler.setFormatter(formatter)
-    logger.addHandler(handler)
+        handler.setFormatter(formatter)
+        logger.addHandler(handler)
 
     return logger
 
 logger = setup_logger()
 
 ### s3 INITIALIZER ###
+# Process-wide S3 client, session and fsspec filesystem, built on first use and shared by every module
+_s3 = {}
+_s3_lock = threading.RLock()
+
 def s3_init(return_session=False) -> boto3.client:
     """
-    Initialize and return an S3 client using credentials from environment variables.
+    Return the process-wide S3 client, initializing it on first use with credentials from environment variables.
 
-    :return: boto3 S3 client object
+    boto3 is only imported, and the .env file only read, when the first client is built. The client is
+    thread-safe; its connection pool is sized by config.S3_MAX_POOL_CONNECTIONS so that concurrent
+    ingest and sink workers reuse connections instead of waiting for one.
+
+    :param return_session: Whether to also return the boto3 session the client was created from.
+    :return: boto3 S3 client object (and session, if return_session)
     """
-    from dotenv import load_dotenv
-    load_dotenv()
+    with _s3_lock:
+        if 'client' not in _s3:
+            import boto3
+            from botocore.config import Config
+            from dotenv import load_dotenv
+            from pipeline.config import S3_MAX_POOL_CONNECTIONS
+            load_dotenv()
 
-    try:
-        session = boto3.Session(
-            aws_access_key_id=os.getenv('KEY_ID'),
-            aws_secret_access_key=os.getenv('SECRET'),
-            region_name=os.getenv('REGION')
-        )
+            try:
+                session = boto3.Session(
+                    aws_access_key_id=os.getenv('KEY_ID'),
+                    aws_secret_access_key=os.getenv('SECRET'),
+                    region_name=os.getenv('REGION')
+                )
+
+                s3_client = session.client('s3', config=Config(max_pool_connections=S3_MAX_POOL_CONNECTIONS))
+                _s3.update(client=s3_client, session=session)
+
+                logger.info("S3 client initialized successfully.")
 
-        s3_client = session.client('s3')
+            except Exception as e:
+                logger.error(f"Error initializing S3 client: {e}")
+                raise
 
-        logger.info("S3 client initialized successfully.")
-        
         if return_session:
-            return s3_client, session
+            return _s3['client'], _s3['session']
         else:
-            return s3_client
-    
-    except Exception as e:
-        logger.error(f"Error initializing S3 client: {e}")
+            return _s3['client']
+
+def s3_filesystem():
+    """
+    Return the process-wide fsspec S3 filesystem, initializing it on first use with the credentials of the S3 session.
+
+    :return: fsspec (s3fs) filesystem object
+    """
+    with _s3_lock:
+        if 'filesystem' not in _s3:
+            import fsspec
+            _, session = s3_init(return_session=True)
+
+            try:
+                options = {'client_kwargs': {'region_name': session.region_name}}
+                credentials = session.get_credentials()
+                if credentials is not None:
+                    credentials = credentials.get_frozen_credentials()
+                    options.update(key=credentials.access_key, secret=credentials.secret_key, token=credentials.token)
+
+                _s3['filesystem'] = fsspec.filesystem('s3', **options)
+
+            except Exception as e:
+                logger.error(f"Error initializing S3 filesystem: {e}")
+                raise
+
+        return _s3['filesystem']
+
+def set_s3(client=None, session=None, filesystem=None) -> dict:
+    """
+    Replace the process-wide S3 client, session and filesystem (e.g. with a local stand-in).
+
+    Objects left as None are built again on first use.
+
+    :param client: S3 client returned by `s3_init`.
+    :param session: Session returned by `s3_init(return_session=True)`.
+    :param filesystem: fsspec filesystem returned by `s3_filesystem`.
+    :return: The previous objects, as keyword arguments to restore them with.
+    """
+    if (client is None) != (session is None):
+        raise ValueError("An S3 client must be set together with its session")
+
+    with _s3_lock:
+        previous = {name: _s3.get(name) for name in ('client', 'session', 'filesystem')}
+        _s3.clear()
+        _s3.update({
+            name: value
+            for name, value in (('client', client), ('session', session), ('filesystem', filesystem))
+            if value is not None
+        })
+        return previous
+
+### DUCKDB ###
+# Keys of a DuckDB runtime profile (config.DUCKDB_PROFILES), each set as a database setting
+DUCKDB_SETTINGS = (
+    'threads', 'memory_limit', 'temp_directory', 'max_temp_directory_size',
+    'preserve_insertion_order', 'enable_object_cache',
+)
+
+# Name of the runtime profile applied to new DuckDB connections, when selected at runtime (e.g. --profile)
+_duckdb = {}
+
+def set_duckdb_profile(name: str = None) -> None:
+    """
+    Select the DuckDB runtime profile applied to the connections opened from now on.
+
+    :param name: A key of config.DUCKDB_PROFILES, or None to go back to config.DUCKDB_PROFILE.
+    """
+    import pipeline.config as config
+
+    if name is not None and name not in config.DUCKDB_PROFILES:
+        raise ValueError(f"Unknown DuckDB profile '{name}', expected one of {sorted(config.DUCKDB_PROFILES)}")
+    _duckdb['profile'] = name
+
+def get_duckdb_profile(name: str = None) -> dict:
+    """
+    Get the database settings of a DuckDB runtime profile, applied on top of the 'default' profile.
+
+    :param name: A key of config.DUCKDB_PROFILES (defaults to the selected profile).
+    :return: Dictionary of DuckDB settings, None meaning DuckDB's own default.
+    """
+    import pipeline.config as config
+
+    name = name or _duckdb.get('profile') or config.DUCKDB_PROFILE
+    if name not in config.DUCKDB_PROFILES:
+        raise ValueError(f"Unknown DuckDB profile '{name}', expected one of {sorted(config.DUCKDB_PROFILES)}")
+    return {**config.DUCKDB_PROFILES['default'], **config.DUCKDB_PROFILES[name]}
+
+def configure_duckdb(con, settings: dict = None) -> None:
+    """
+    Apply database settings to a DuckDB connection, creating the spill directory if needed.
+
+    The settings apply to the whole database, i.e. to every cursor of the connection.
+
+    :param con: DuckDB connection.
+    :param settings: Database settings, keyed as in DUCKDB_SETTINGS (defaults to the selected runtime profile).
+    """
+    settings = get_duckdb_profile() if settings is None else settings
+    for setting in DUCKDB_SETTINGS:
+        value = settings.get(setting)
+        if value is None:
+            continue
+        if setting == 'temp_directory':
+            os.makedirs(value, exist_ok=True)
+        if isinstance(value, bool):
+            value = str(value).lower()
+        elif isinstance(value, str):
+            value = f"'{value}'"
+        con.execute(f"SET {setting} = {value}")
+
+def duckdb_connect(database: str = ':memory:', settings: dict = None, read_only: bool = False):
+    """
+    Open a DuckDB connection configured with the selected runtime profile.
+
+    :param database: Path of the database file, or ':memory:'.
+    :param settings: Database settings overriding the runtime profile's.
+    :param read_only: Whether to open the database file read-only.
+    :return: The DuckDB connection.
+    """
+    import duckdb
+
+    con = duckdb.connect(database, read_only=read_only)
+    try:
+        configure_duckdb(con, {**get_duckdb_profile(), **(settings or {})})
+    except Exception:
+        con.close()
         raise
+    return con
+
+# Units of the memory sizes DuckDB reports (e.g. '4.6 GiB')
+DUCKDB_MEMORY_UNITS = {'bytes': 1, 'KiB': 1024, 'MiB': 1024 ** 2, 'GiB': 1024 ** 3, 'TiB': 1024 ** 4, 'PiB': 1024 ** 5}
+
+def split_duckdb_settings(workers: int, profile: str = None, settings: dict = None) -> dict:
+    """
+    Divide the threads and memory limit of a DuckDB runtime profile between databases running side by side
+    (e.g. one per worker process), so that together they stay within the profile's limits.
+
+    The limits a profile leaves unset are DuckDB's own defaults on this machine (all cores, 80% of the RAM).
+
+    :param workers: Number of databases sharing the limits.
+    :param profile: A key of config.DUCKDB_PROFILES (defaults to the selected profile).
+    :param settings: Database settings overriding the profile's (e.g. those of an ingest profile).
+    :return: The 'threads' and 'memory_limit' settings of each database (at least 1 thread each).
+    """
+    con = duckdb_connect(settings={**get_duckdb_profile(profile), **(settings or {})})
+    try:
+        threads, memory_limit = con.execute("SELECT current_setting('threads'), current_setting('memory_limit')").fetchone()
+    finally:
+        con.close()
+
+    amount, unit = memory_limit.split()
+    memory_mb = float(amount) * DUCKDB_MEMORY_UNITS[unit] / 1024 ** 2
+    return {
+        'threads': max(1, int(threads) // workers),
+        'memory_limit': f"{max(1, int(memory_mb / workers))}MiB",
+    }
+
+def ibis_connect(database: str = ':memory:', settings: dict = None, read_only: bool = False):
+    """
+    Open an Ibis-DuckDB backend on a connection configured with the selected runtime profile.
+
+    :param database: Path of the database file, or ':memory:'.
+    :param settings: Database settings overriding the runtime profile's.
+    :param read_only: Whether to open the database file read-only.
+    :return: The Ibis-DuckDB backend.
+    """
+    import ibis
+
+    return ibis.duckdb.from_connection(duckdb_connect(database, settings, read_only))
+
+### NAMING ###
+def snake_case(name: str) -> str:
+    """
+    Convert a column name to snake_case, following the same rules as Ibis' `Table.rename("snake_case")`.
+
+    :param name: The column name.
+    :return: The snake_case column name.
+    """
+    name = name.strip()
+    if " " in name:
+        return "_".join(name.lower().split()).replace("-", "_")
+    name = re.sub(r"([A-Z]+)([A-Z][a-z])", r"\1_\2", name)
+    name = re.sub(r"([a-z\d])([A-Z])", r"\1_\2", name)
+    return name.replace("-", "_").lower()
+
+### DATASETS ###
+def get_filesystem(path: str) -> tuple:
+    """
+    Get the fsspec filesystem of a local or S3 directory, and the directory as that filesystem names it.
+
+    :param path: Local directory or 's3://' URL.
+    :return: Tuple of (filesystem, path without protocol nor trailing slash).
+    """
+    if path.startswith('s3://'):
+        return s3_filesystem(), path[len('s3://'):].rstrip('/')
+
+    import fsspec
+    return fsspec.filesystem('file', auto_mkdir=True), os.path.abspath(path)
+
+def partition_values(rel_path: str) -> dict:
+    """
+    Parse the hive partition values of a file path relative to its dataset (e.g. 'database=wdi/year_bucket=2000/f.parquet').
+
+    :param rel_path: Path of the file relative to the dataset directory.
+    :return: Partition values by column ({'database': 'wdi', 'year_bucket': '2000'}).
+    """
+    return dict(part.split('=', 1) for part in rel_path.split('/')[:-1] if '=' in part)
 
 ### AWS S3 INTERACTIONS ###
+def list_s3_objects(s3_client: boto3.client, bucket_name: str, prefix: str, start_after: str = None):
+    """
+    List the objects under a prefix in the S3 bucket, in key order.
+
+    :param s3_client: The boto3 S3 client.
+    :param bucket_name: The name of the S3 bucket.
+    :param prefix: The prefix of the objects to list.
+    :param start_after: Only list the keys after this one (S3 lists keys in lexicographic order).
+    :return: Iterator of dictionaries with the key, size, ETag and last modified time of each object.
+    """
+    operation_parameters = {'Bucket': bucket_name, 'Prefix': prefix}
+    if start_after:
+        operation_parameters['StartAfter'] = start_after
+
+    for page in s3_client.get_paginator('list_objects_v2').paginate(**operation_parameters):
+        for obj in page.get('Contents', []):
+            yield {
+                "key": obj['Key'],
+                "size": obj['Size'],
+                "etag": obj['ETag'].strip('"'),
+                "last_modified": obj['LastModified'],
+            }
+
+def parse_landing_key(key: str, prefix: str) -> tuple:
+    """
+    Split a landing key '<prefix>/<source folders>/<file name>' into its source and file name.
+
+    The source is the folder path under the prefix (e.g. 'edu' or 'edu/national'), and the file name
+    keeps everything but its last extension (e.g. 'WDI.v2.parquet' -> 'WDI.v2').
+
+    :param key: The S3 key.
+    :param prefix: The landing folder prefix (e.g. 'landing').
+    :return: Tuple of (source, name), or None for keys that are not source files: folder markers, objects
+             directly under the prefix, and hidden objects (names starting with '_' or '.', e.g. the ingest manifest).
+    """
+    folder, _, file_name = key[len(prefix):].strip('/').rpartition('/')
+    if not key.startswith(f'{prefix}/') or not folder or not file_name or file_name[0] in '_.':
+        return None
+    return folder, os.path.splitext(file_name)[0]
+
+def landing_table_name(source: str, name: str) -> str:
+    """
+    Name of the DuckDB table of a landing file, '<source>_<name>' with nested source folders joined by '_'.
+
+    :param source: The source folder path (e.g. 'wdi').
+    :param name: The file name without extension (e.g. 'WDICSV').
+    :return: The table name (e.g. 'wdi_WDICSV').
+    """
+    return f"{source}_{name}".replace('/', '_')
+
+def group_file_metadata(bucket_name: str, prefix: str, objects) -> dict:
+    """
+    Organize landing objects by source folder and file name, skipping the objects that are not source files.
+
+    :param bucket_name: The name of the S3 bucket.
+    :param prefix: The landing folder prefix.
+    :param objects: Objects as listed by `list_s3_objects`.
+    :return: Dictionary of file metadata (path, size, ETag and last modified time) organized by source folder.
+    """
+    file_metadata = {}
+    for obj in objects:
+        parsed = parse_landing_key(obj["key"], prefix)
+        if parsed is None:
+            continue
+        source, name = parsed
+        file_metadata.setdefault(source, {})[name] = {
+            "path": f"s3://{bucket_name}/{obj['key']}",
+            "size": obj["size"],
+            "etag": obj["etag"],
+            "last_modified": obj["last_modified"],
+        }
+    return file_metadata
+
+def get_s3_file_metadata(bucket_name: str, prefix: str) -> dict:
+    """
+    Get the metadata of the files in the S3 bucket and organize them into a dictionary.
+
+    Source folders can be nested; see `parse_landing_key` for how keys map to sources and file names.
+
+    :param bucket_name: The name of the S3 bucket.
+    :param prefix: The folder prefix to filter the file paths.
+    :return: Dictionary of file metadata (path, size, ETag and last modified time) organized by source folder.
+    """
+    try:
+        objects = list_s3_objects(s3_init(), bucket_name, prefix + '/')
+        file_metadata = group_file_metadata(bucket_name, prefix, objects)
+
+        logger.info(f"Successfully retrieved file metadata from S3 bucket {bucket_name}.")
+        return file_metadata
+    except Exception as e:
+        logger.error(f"Error retrieving file metadata from S3: {e}")
+        raise
+
 def get_s3_file_paths(bucket_name: str, prefix: str) -> dict:
     """
     Get a list of file paths from the S3 bucket and organize them into a dictionary.
@@ -68,59 +393,251 @@ def get_s3_file_paths(bucket_name: str, prefix: str) -> dict:
     :param prefix: The folder prefix to filter the file paths.
     :return: Dictionary of file paths organized by source folder.
     """
+    file_metadata = get_s3_file_metadata(bucket_name, prefix)
+    return {
+        source: {name: metadata["path"] for name, metadata in files.items()}
+        for source, files in file_metadata.items()
+    }
+
+def delete_s3_prefix(s3_client: boto3.client, bucket_name: str, prefix: str) -> int:
+    """
+    Delete every object under a prefix in the S3 bucket.
+
+    :param s3_client: The boto3 S3 client.
+    :param bucket_name: The name of the S3 bucket.
+    :param prefix: The prefix of the objects to delete.
+    :return: Number of objects deleted.
+    """
+    try:
+        paginator = s3_client.get_paginator('list_objects_v2')
+        deleted = 0
+        for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix):
+            keys = [{'Key': obj['Key']} for obj in page.get('Contents', [])]
+            if keys:
+                s3_client.delete_objects(Bucket=bucket_name, Delete={'Objects': keys})
+                deleted += len(keys)
+
+        logger.info(f"Deleted {deleted} objects under s3://{bucket_name}/{prefix}")
+        return deleted
+    except Exception as e:
+        logger.error(f"Error deleting objects under s3://{bucket_name}/{prefix}: {e}")
+        raise
+
+def get_s3_prefix_size(s3_client: boto3.client, bucket_name: str, prefix: str) -> int:
+    """
+    Get the total size of the objects under a prefix in the S3 bucket.
+
+    :param s3_client: The boto3 S3 client.
+    :param bucket_name: The name of the S3 bucket.
+    :param prefix: The prefix of the objects (a full key selects a single object).
+    :return: Total size in bytes.
+    """
     try:
-        s3_prefix = prefix + '/'
-
-        paginator = s3_init().get_paginator('list_objects_v2')
-        operation_parameters = {'Bucket': bucket_name, 'Prefix': s3_prefix}
-        page_iterator = paginator.paginate(**operation_parameters)
-        filtered_iterator = page_iterator.search(f"Contents[?Key != '{s3_prefix}'][]")
-
-        file_paths = {}
-        for key_data in filtered_iterator:
-            key = key_data['Key']
-            parts = key.split('/')
-            if len(parts) == 3:  # Ensure we have landing/source/filename structure
-                source, filename = parts[1], parts[2]
-                if source not in file_paths:
-                    file_paths[source] = {}
-                file_paths[source][filename.split('.')[0]] = f"s3://{bucket_name}/{key}"
-
-        logger.info(f"Successfully retrieved file paths from S3 bucket {bucket_name}.")
-        return file_paths
+        paginator = s3_client.get_paginator('list_objects_v2')
+        return sum(
+            obj['Size']
+            for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix)
+            for obj in page.get('Contents', [])
+        )
     except Exception as e:
-        logger.error(f"Error retrieving file paths from S3: {e}")
+        logger.error(f"Error getting the size of s3://{bucket_name}/{prefix}: {e}")
         raise
 
-def download_s3_client(s3_client: boto3.client, s3_bucket_name: str, s3_folder: str, local_dir: str) -> None:
+def _local_md5(path: str) -> str:
+    """MD5 of a local file, which is the ETag of an object uploaded in a single part."""
+    md5 = hashlib.md5()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            md5.update(block)
+    return md5.hexdigest()
+
+def _is_downloaded(obj: dict, local_path: str, state: dict) -> bool:
+    """
+    Whether a local file already holds the current version of an object: same size, and the ETag recorded
+    when it was downloaded (or, for single-part ETags, the local file's MD5) matches the object's ETag.
+    """
+    if not os.path.isfile(local_path) or os.path.getsize(local_path) != obj["size"]:
+        return False
+    if state.get(obj["key"], {}).get("etag") == obj["etag"]:
+        return True
+    return '-' not in obj["etag"] and _local_md5(local_path) == obj["etag"]
+
+class _PartialDownload:
+    """
+    Download of one object into '<local path>.part', in byte ranges that can be fetched concurrently.
+
+    The ranges already written are recorded in '<local path>.part.json' with the object's ETag, so an
+    interrupted download resumes with the missing ranges, unless the object changed in the meantime.
+    """
+
+    def __init__(self, s3_client: boto3.client, bucket_name: str, obj: dict, local_path: str, part_size: int) -> None:
+        self.s3_client = s3_client
+        self.bucket_name = bucket_name
+        self.obj = obj
+        self.local_path = local_path
+        self.part_path = f'{local_path}.part'
+        self.progress_path = f'{local_path}.part.json'
+        self.ranges = [(start, min(start + part_size, obj["size"]) - 1) for start in range(0, obj["size"], part_size)]
+        self.part_size = part_size
+        self.done = set()
+        self.lock = threading.Lock()
+
+        progress = None
+        if os.path.isfile(self.progress_path) and os.path.isfile(self.part_path):
+            with open(self.progress_path) as f:
+                progress = json.load(f)
+        if progress and (progress["etag"], progress["size"], progress["part_size"]) == (obj["etag"], obj["size"], part_size):
+            self.done = set(progress["done"])
+        else:
+            os.makedirs(os.path.dirname(local_path), exist_ok=True)
+            with open(self.part_path, 'wb') as f:
+                f.truncate(obj["size"])
+
+    def pending(self) -> list:
+        """Indexes of the byte ranges still to download."""
+        return [index for index in range(len(self.ranges)) if index not in self.done]
+
+    def fetch(self, index: int) -> bool:
+        """
+        Download one byte range into the part file, and move the part file in place once every range is written.
+
+        :param index: Index of the byte range.
+        :return: Whether the download of the object is complete.
+        """
+        start, end = self.ranges[index]
+        # IfMatch fails the request if the object changed since it was listed, so ranges of two versions are never mixed
+        body = self.s3_client.get_object(
+            Bucket=self.bucket_name, Key=self.obj["key"], Range=f'bytes={start}-{end}', IfMatch=self.obj["etag"]
+        )['Body']
+        with open(self.part_path, 'r+b') as f:
+            f.seek(start)
+            for block in iter(lambda: body.read(1024 * 1024), b''):
+                f.write(block)
+
+        with self.lock:
+            self.done.add(index)
+            if len(self.done) < len(self.ranges):
+                with open(self.progress_path, 'w') as f:
+                    json.dump({"etag": self.obj["etag"], "size": self.obj["size"], "part_size": self.part_size,
+                               "done": sorted(self.done)}, f)
+                return False
+
+        self.complete()
+        return True
+
+    def complete(self) -> None:
+        """Move the fully written part file to the local path."""
+        os.replace(self.part_path, self.local_path)
+        if os.path.exists(self.progress_path):
+            os.remove(self.progress_path)
+
+def download_s3_client(
+    s3_client: boto3.client, s3_bucket_name: str, s3_folder: str, local_dir: str, max_workers: int = None
+) -> dict:
     """
-    Download all files from a specified S3 folder to a local directory.
+    Download all files from a specified S3 folder to a local directory, keeping the key hierarchy.
+
+    The listing is paginated, so folders of any size are downloaded in full. Files are fetched in byte
+    ranges of config.DOWNLOAD_PART_SIZE_MB by a pool of threads, so large files are downloaded in parallel
+    parts and small files concurrently. Files whose local copy has the same size and ETag are skipped, and
+    interrupted downloads resume with their missing ranges (see `_PartialDownload`). The ETags of the
+    downloaded files are recorded in '<local_dir>/.s3_download.json'.
 
     :param s3_client: The boto3 S3 client.
     :param s3_bucket_name: The name of the S3 bucket.
     :param s3_folder: The folder within the S3 bucket to download files from.
     :param local_dir: The local directory to save downloaded files.
+    :param max_workers: Maximum number of byte ranges downloaded at the same time (defaults to config.DOWNLOAD_MAX_WORKERS).
+    :return: Dictionary with the number of files 'downloaded' and 'skipped' and the 'bytes' downloaded.
+    :raises RuntimeError: If some files could not be downloaded; the others are kept.
     """
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+    import pipeline.config as config
+
+    max_workers = max(1, max_workers or config.DOWNLOAD_MAX_WORKERS)
+    part_size = int(config.DOWNLOAD_PART_SIZE_MB * 1024 ** 2)
+    state_path = os.path.join(local_dir, '.s3_download.json')
+    local_root = os.path.abspath(local_dir)
+    state = {}
+    stats = {"downloaded": 0, "skipped": 0, "bytes": 0}
+    failed = {}
+
     try:
-        # Ensure the local directory exists
-        if not os.path.exists(local_dir):
-            os.makedirs(local_dir)
-
-        # List objects in the specified S3 folder
-        response = s3_client.list_objects_v2(Bucket=s3_bucket_name, Prefix=s3_folder)
-        
-        # Check if any objects are returned
-        if 'Contents' in response:
-            for obj in response['Contents']:
-                s3_key = obj['Key']
-                local_file_path = os.path.join(local_dir, os.path.basename(s3_key))
-                
-                # Download the file
-                s3_client.download_file(s3_bucket_name, s3_key, local_file_path)
-                logger.info(f'Successfully downloaded {s3_key} to {local_file_path}')
-        else:
+        os.makedirs(local_dir, exist_ok=True)
+        if os.path.isfile(state_path):
+            with open(state_path) as f:
+                state = json.load(f)
+
+        downloads = []
+        for obj in list_s3_objects(s3_client, s3_bucket_name, s3_folder):
+            if obj["key"].endswith('/'):
+                continue  # Folder marker
+            relative_key = obj["key"][len(s3_folder):].lstrip('/') or os.path.basename(obj["key"])
+            local_path = os.path.abspath(os.path.join(local_root, *relative_key.split('/')))
+            if os.path.commonpath([local_root, local_path]) != local_root:
+                logger.warning(f'Skipping {obj["key"]}: it resolves outside {local_dir}')
+                continue
+
+            if _is_downloaded(obj, local_path, state):
+                state[obj["key"]] = {"etag": obj["etag"], "size": obj["size"]}
+                stats["skipped"] += 1
+                continue
+            downloads.append(_PartialDownload(s3_client, s3_bucket_name, obj, local_path, part_size))
+
+        if not downloads and not stats["skipped"]:
             logger.warning(f'No files found in s3://{s3_bucket_name}/{s3_folder}')
+            return stats
+
+        def finish(download):
+            state[download.obj["key"]] = {"etag": download.obj["etag"], "size": download.obj["size"]}
+            stats["downloaded"] += 1
+            logger.info(f'Successfully downloaded {download.obj["key"]} to {download.local_path}')
+
+        total_bytes = sum(download.obj["size"] for download in downloads)
+        logger.info(
+            f'Downloading {len(downloads)} files ({total_bytes / 1024 ** 2:.1f} MB) from s3://{s3_bucket_name}/{s3_folder} '
+            f'with up to {max_workers} concurrent requests; {stats["skipped"]} files are up to date.'
+        )
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        try:
+            futures = {}
+            for download in downloads:
+                if not download.ranges:
+                    # Empty object: its part file is already complete
+                    download.complete()
+                    finish(download)
+                for index in download.pending():
+                    futures[executor.submit(download.fetch, index)] = (download, index)
+
+            for future in as_completed(futures):
+                download, index = futures[future]
+                try:
+                    start, end = download.ranges[index]
+                    if future.result():
+                        finish(download)
+                    stats["bytes"] += end - start + 1
+                except Exception as e:
+                    failed.setdefault(download.obj["key"], e)
+        finally:
+            # On interruption, drop the queued ranges instead of downloading them before exiting
+            executor.shutdown(cancel_futures=True)
+
+        for key, error in failed.items():
+            logger.error(f'Error downloading {key}: {error}')
+        if failed:
+            raise RuntimeError(f'{len(failed)} of {len(downloads)} files could not be downloaded; run again to resume them')
+
+        logger.info(f'Downloaded {stats["downloaded"]} files ({stats["bytes"] / 1024 ** 2:.1f} MB), skipped {stats["skipped"]}')
+        return stats
 
     except Exception as e:
         logger.error(f'Error downloading files from S3: {e}', exc_info=True)
-        raise
\ No newline at end of file
+        raise
+
+    finally:
+        # Record the completed files even when interrupted, so the next run skips them
+        if state:
+            tmp_path = f'{state_path}.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(state, f, indent=2, sort_keys=True)
+            os.replace(tmp_path, state_path)
@@ -0,0 +1,59 @@
+import os
+import pytest
+import pipeline.config as config
+from pipeline.bench.local_s3 import local_s3
+from pipeline.utils import download_s3_client
+
+class FailingRange:
+    """S3 client failing the get_object of one byte range, as an interrupted download would."""
+
+    def __init__(self, client, failing_range: str) -> None:
+        self.client = client
+        self.failing_range = failing_range
+
+    def get_object(self, **kwargs):
+        if kwargs.get('Range') == self.failing_range:
+            raise ConnectionError(f"Connection reset during {self.failing_range}")
+        return self.client.get_object(**kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+def put(client, key: str, body: bytes) -> None:
+    client.put_object(Bucket='bucket', Key=key, Body=body)
+
+def read(path) -> bytes:
+    with open(path, 'rb') as f:
+        return f.read()
+
+def test_download_keeps_the_key_hierarchy_and_skips_unchanged_files(tmp_path):
+    with local_s3(str(tmp_path / 's3')) as client:
+        put(client, 'staging/wdi/data.parquet', b'wdi')
+        put(client, 'staging/sdg/data.parquet', b'sdg')
+        local_dir = tmp_path / 'local'
+
+        assert download_s3_client(client, 'bucket', 'staging', str(local_dir))['downloaded'] == 2
+        assert read(local_dir / 'wdi' / 'data.parquet') == b'wdi'
+        assert read(local_dir / 'sdg' / 'data.parquet') == b'sdg'
+
+        put(client, 'staging/sdg/data.parquet', b'sdg, changed')
+        stats = download_s3_client(client, 'bucket', 'staging', str(local_dir))
+
+        assert (stats['downloaded'], stats['skipped']) == (1, 1)
+        assert read(local_dir / 'sdg' / 'data.parquet') == b'sdg, changed'
+
+def test_interrupted_download_resumes_with_the_missing_ranges(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'DOWNLOAD_PART_SIZE_MB', 4 / 1024 ** 2)
+    with local_s3(str(tmp_path / 's3')) as client:
+        put(client, 'staging/wdi/data.parquet', b'0123456789')
+        local_path = tmp_path / 'local' / 'wdi' / 'data.parquet'
+
+        with pytest.raises(RuntimeError):
+            download_s3_client(FailingRange(client, 'bytes=4-7'), 'bucket', 'staging', str(tmp_path / 'local'), max_workers=1)
+        assert not os.path.exists(local_path)
+
+        stats = download_s3_client(client, 'bucket', 'staging', str(tmp_path / 'local'), max_workers=1)
+
+        assert (stats['downloaded'], stats['bytes']) == (1, 4)
+        assert read(local_path) == b'0123456789'
+        assert os.listdir(local_path.parent) == ['data.parquet']